@@ -0,0 +1,210 @@
+"""
+Cross-paper (multi-year) exam analysis, map-reduce style.
+
+MAP:    each paper (or each part of a large paper) -> compact JSON of its
+        questions and topic weightage. Runs in parallel; the result per
+        paper is cached, so adding a new year only maps that year.
+REDUCE: the per-paper JSON of every selected year, plus locally counted
+        repeats, -> one final report.
+"""
+import os
+import re
+import json
+import hashlib
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from db import get_file_content, get_file_names
+from utils import ask_gemini
+from chunker import iter_structured_chunks, estimate_tokens
+from cache import cached_text
+from frequency import get_repeated_questions, format_repeat_summary
+
+# Bump when the prompts below change, so cached map/reduce results are not reused
+MAP_PROMPT_VERSION = "v1"
+REDUCE_PROMPT_VERSION = "v2"
+
+# Papers longer than this are mapped in several parts
+MAP_PART_TOKENS = int(os.getenv("MAP_PART_TOKENS", "20000"))
+MAP_WORKERS = int(os.getenv("MAP_WORKERS", "4"))
+
+MAP_PROMPT = """
+Here is {part_label} of the exam paper "{file_name}":
+{text}
+
+---------------------------------------------
+INSTRUCTIONS:
+List every question in this text and the topic it tests. Respond with JSON only:
+{{
+  "questions": [{{"question": "<question text, without its number>", "topic": "<short topic name>", "marks": <number or null>}}],
+  "topics": [{{"topic": "<short topic name>", "weight": <share of the marks in this text, 0-100>}}]
+}}
+Use short, consistent topic names (e.g. "Dijkstra's Algorithm", "AVL Trees").
+"""
+
+REDUCE_PROMPT = """
+You are analysing {paper_count} previous-year exam papers of the same subject: {file_names}.
+
+PER-PAPER EXTRACTS (JSON, one object per paper):
+{extracts}
+
+LOCALLY COUNTED REPEATS (topic -> papers it appeared in, total marks):
+{frequencies}
+
+NEAR-DUPLICATE QUESTIONS ACROSS THESE PAPERS (from the question-frequency index):
+{repeat_summary}
+
+---------------------------------------------
+INSTRUCTIONS:
+Using ONLY the data above, deliver a cross-year analysis in this structure:
+1️⃣ Repeated Questions Analysis (questions/topics asked in more than one year, with the years)
+2️⃣ Important Topics Priority List (High Weightage across years)
+3️⃣ Chapter-wise Weightage (%) across all papers
+4️⃣ Trends (topics rising or fading over the years)
+5️⃣ Final Summary: Top 5 Expected Questions
+
+Be highly accurate and structured.
+"""
+
+def _parse_json(text):
+    """Gemini sometimes wraps JSON in ```json fences even in JSON mode"""
+    match = re.search(r"\{.*\}", text or "", re.DOTALL)
+    if not match:
+        return None
+    try:
+        return json.loads(match.group(0))
+    except json.JSONDecodeError:
+        return None
+
+def split_for_map(raw_text, max_tokens=MAP_PART_TOKENS):
+    """A paper that fits goes in one part; bigger ones are cut on question/section boundaries"""
+    if estimate_tokens(raw_text) <= max_tokens:
+        return [raw_text]
+
+    parts, current, tokens = [], [], 0
+    for chunk, _, _ in iter_structured_chunks([(1, raw_text)], overlap_tokens=0):
+        chunk_tokens = estimate_tokens(chunk)
+        if current and tokens + chunk_tokens > max_tokens:
+            parts.append("\n".join(current))
+            current, tokens = [], 0
+        current.append(chunk)
+        tokens += chunk_tokens
+    if current:
+        parts.append("\n".join(current))
+    return parts
+
+async def _map_part(file_name, text, part_label):
+    from async_io import gemini
+
+    response = await gemini().generate(
+        MAP_PROMPT.format(part_label=part_label, file_name=file_name, text=text),
+        json_output=True
+    )
+    parsed = _parse_json(response)
+    if parsed is None:
+        raise ValueError(f"Map step for {file_name} ({part_label}) did not return JSON: {response[:200]}")
+    return parsed
+
+def _merge_parts(results):
+    """Several parts of one paper -> one extract (topic weights re-normalised to 100)"""
+    if len(results) == 1:
+        return results[0]
+    questions, weights = [], defaultdict(float)
+    for result in results:
+        questions.extend(result.get("questions", []))
+        for topic in result.get("topics", []):
+            weights[topic.get("topic", "Other")] += float(topic.get("weight") or 0)
+    total = sum(weights.values()) or 1
+    return {
+        "questions": questions,
+        "topics": [{"topic": t, "weight": round(100 * w / total, 1)} for t, w in weights.items()],
+    }
+
+def map_paper(file_hash, file_name):
+    """The MAP output for one paper, from the cache when this paper was mapped before"""
+    # httpx/asyncpg load on the first analysis, not with the app
+    from async_io import gather
+
+    def compute():
+        raw_text = get_file_content(file_hash)
+        if not raw_text:
+            raise ValueError(f"No stored text for {file_name}")
+        parts = split_for_map(raw_text)
+        # All parts go out at once over the shared async client
+        results = gather(*(
+            _map_part(file_name, part, f"part {i + 1} of {len(parts)}" if len(parts) > 1 else "the full text")
+            for i, part in enumerate(parts)
+        ))
+        return json.dumps(_merge_parts(results))
+
+    return json.loads(cached_text("analysis_map", file_hash, MAP_PROMPT_VERSION, compute))
+
+def _question_key(text):
+    """Loose key so 'Q3. Explain X. [10 marks]' and 'Explain X' count as the same question"""
+    text = re.sub(r"\[[^\]]*\]|\([^)]*marks?\)", " ", text.lower())
+    return " ".join(re.findall(r"[a-z]+", text))
+
+def count_repeats(extracts):
+    """Local frequency tables over the map outputs (file_hash -> extract): topics and exact-ish repeated questions"""
+    topics = defaultdict(lambda: {"papers": set(), "marks": 0.0})
+    questions = defaultdict(set)
+    for file_hash, extract in extracts.items():
+        for q in extract.get("questions", []):
+            topic = (q.get("topic") or "Other").strip()
+            topics[topic]["papers"].add(file_hash)
+            try:
+                topics[topic]["marks"] += float(q.get("marks") or 0)
+            except (TypeError, ValueError):
+                pass
+            questions[_question_key(q.get("question", ""))].add(file_hash)
+
+    topic_table = sorted(
+        ({"topic": t, "papers": len(v["papers"]), "marks": v["marks"]} for t, v in topics.items()),
+        key=lambda row: (-row["papers"], -row["marks"])
+    )
+    repeated = sorted(
+        ({"question": q, "papers": len(p)} for q, p in questions.items() if q and len(p) > 1),
+        key=lambda row: -row["papers"]
+    )
+    return topic_table, repeated
+
+def analyze_papers(file_hashes, on_progress=None):
+    """
+    Runs the map-reduce analysis over the selected papers and returns the
+    report (markdown). on_progress(message) is called as papers are mapped.
+    """
+    report = on_progress or (lambda message: None)
+    file_hashes = sorted(set(file_hashes))
+    names = get_file_names(file_hashes)
+
+    # MAP: papers in parallel (cache + DB are blocking); their parts run concurrently on the async client
+    with ThreadPoolExecutor(max_workers=MAP_WORKERS) as paper_pool:
+        futures = {h: paper_pool.submit(map_paper, h, names.get(h, h)) for h in file_hashes}
+        # Keyed by file_hash: two papers can share a file name, the name is only a label
+        extracts = {}
+        for file_hash, future in futures.items():
+            extracts[file_hash] = future.result()
+            report(f"Mapped {names.get(file_hash, file_hash)}")
+
+    # REDUCE: cached on the exact set of map outputs
+    topic_table, repeated = count_repeats(extracts)
+    repeat_summary = format_repeat_summary(get_repeated_questions(file_hashes))
+    extracts_json = json.dumps(
+        [{"paper": names.get(h, h), **extract} for h, extract in extracts.items()], ensure_ascii=False
+    )
+    reduce_key = hashlib.sha256((extracts_json + repeat_summary).encode()).hexdigest()
+    report("Combining all years...")
+
+    def compute():
+        frequencies = "\n".join(
+            f"- {row['topic']}: {row['papers']} paper(s), {row['marks']:g} marks" for row in topic_table
+        )
+        if repeated:
+            frequencies += "\n\nQuestions repeated word-for-word:\n" + "\n".join(
+                f"- ({row['papers']} papers) {row['question']}" for row in repeated[:30]
+            )
+        return ask_gemini(REDUCE_PROMPT.format(
+            paper_count=len(extracts), file_names=", ".join(names.get(h, h) for h in extracts),
+            extracts=extracts_json, frequencies=frequencies, repeat_summary=repeat_summary
+        ))
+
+    return cached_text("analysis_reduce", reduce_key, REDUCE_PROMPT_VERSION, compute)
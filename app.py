@@ -1,13 +1,27 @@
+import os
+import time
 import streamlit as st
-import hashlib
+import metrics
 from db import (
-    login_user, save_file_record, get_all_files, update_ai_analysis, 
-    get_leaderboard, get_db_connection, get_file_content,
-    save_document_sections, match_document_sections
+    login_user, list_files, count_files, get_file_analysis, get_leaderboard, get_xp_rank,
+    wipe_all_files, get_library_version,
+    search_document_sections, search_library, enqueue_ingest_job, get_ingest_jobs, get_chat_messages, CHAT_PAGE_SIZE,
+    RETRIEVAL_MODES
 )
-from utils import extract_text_from_pdf, ask_gemini, ask_gemini_chat, generate_embedding
+from utils import ask_gemini_chat_stream, generate_embedding, get_gemini_client, GeminiError
+from cache import get_cache_stats, get_chat_cache
+from analysis import analyze_papers
+import chat_history
 
 st.set_page_config(page_title="Student Portal", layout="wide")
+rerun_started = time.perf_counter()
+
+@st.cache_resource(show_spinner=False)
+def start_metrics_server():
+    # Once per server process; without METRICS_PORT the Timing Dashboard is the only view
+    return metrics.start_metrics_server()
+
+start_metrics_server()
 
 def apply_custom_css():
     st.markdown("""
@@ -72,6 +86,68 @@ def apply_custom_css():
 # CALL THE FUNCTION IMMEDIATELY
 apply_custom_css()
 
+# How the chat finds chunks: "hybrid" (default), "vector" or "lexical"
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid").lower()
+if RETRIEVAL_MODE not in RETRIEVAL_MODES:
+    print(f"⚠️ Unknown RETRIEVAL_MODE {RETRIEVAL_MODE!r} (expected one of {RETRIEVAL_MODES}), using 'hybrid'")
+    RETRIEVAL_MODE = "hybrid"
+
+# --- CACHED LIBRARY LISTING ---
+# Shared across reruns and sessions; cleared when an upload finishes (see show_ingest_jobs).
+# The TTL catches uploads finished by other users.
+LIBRARY_PAGE_SIZE = 20
+CHAT_FILE_OPTIONS_LIMIT = 500
+
+@st.cache_data(ttl=300, show_spinner=False)
+def cached_list_files(uploaded_by, after, limit):
+    return list_files(uploaded_by=uploaded_by, after=after, limit=limit)
+
+@st.cache_data(ttl=300, show_spinner=False)
+def cached_count_files(uploaded_by):
+    return count_files(uploaded_by)
+
+def invalidate_library():
+    cached_list_files.clear()
+    cached_count_files.clear()
+    # Re-fetched pages shift, so cursors taken from the old ones would skip rows
+    for key in [k for k in st.session_state if k.startswith("library_cursors_")]:
+        del st.session_state[key]
+
+# --- CACHED RANKS ---
+# Keyed by XP, not by user: everyone on the same XP shares one entry, and a
+# user whose XP changes simply looks up a different key.
+RANK_CACHE_TTL = 30
+
+@st.cache_data(ttl=RANK_CACHE_TTL, show_spinner=False)
+def cached_xp_rank(xp):
+    return get_xp_rank(xp)
+
+@st.cache_data(ttl=RANK_CACHE_TTL, show_spinner=False)
+def cached_leaderboard():
+    return get_leaderboard()
+
+# The Dev Tools expander body runs on every rerun, open or not; its GROUP BY
+# over ai_cache doesn't need to
+@st.cache_data(ttl=RANK_CACHE_TTL, show_spinner=False)
+def cached_cache_stats():
+    return get_cache_stats()
+
+# --- METRICS ---
+@st.dialog("📈 Timing Dashboard", width="large")
+def show_metrics():
+    # This server process only; each worker serves its own on METRICS_PORT + 1 + i
+    histograms, counters = metrics.snapshot()
+    st.markdown("#### Latencies (seconds) and sizes (bytes)")
+    if histograms:
+        st.dataframe(histograms, hide_index=True, use_container_width=True)
+    else:
+        st.caption("Nothing recorded yet.")
+    st.markdown("#### Counters")
+    if counters:
+        st.dataframe(counters, hide_index=True, use_container_width=True)
+    st.download_button("⬇️ Prometheus text", metrics.render_prometheus(),
+                       file_name="metrics.prom", mime="text/plain")
+
 # --- SIDEBAR: LOGIN ---
 with st.sidebar:
     st.title("🎓 Student Portal")
@@ -102,19 +178,32 @@ with st.sidebar:
     st.markdown("---")
     st.subheader("🛠️ Dev Tools")
     if st.button("🗑️ Wipe All Files (Reset DB)"):
-        conn = get_db_connection()
-        if conn:
-            with conn.cursor() as cur:
-                cur.execute("TRUNCATE TABLE master_files CASCADE;")
-                # Also truncate document_sections if it exists
-                cur.execute("TRUNCATE TABLE document_sections CASCADE;")
-                conn.commit()
-            conn.close()
+        if wipe_all_files():
+            invalidate_library()
+            get_chat_cache().clear()
             st.success("Database Wiped! Please refresh.")
             st.rerun()
         else:
             st.error("Failed to connect to database.")
 
+    with st.expander("📊 AI Cache Stats"):
+        for kind, counts in cached_cache_stats().items():
+            st.write(f"**{kind}**: {counts['hits']} hits / {counts['misses']} misses since server start "
+                     f"({counts.get('entries', 0)} cached, {counts.get('total_hits', 0)} hits all-time)")
+        chat_stats = get_chat_cache().stats
+        st.write(f"**chat**: {chat_stats['exact_hits']} exact + {chat_stats['semantic_hits']} similar hits "
+                 f"/ {chat_stats['misses']} misses")
+
+    with st.expander("📡 Gemini API Stats"):
+        # Counters cover this server process only (workers keep their own)
+        for endpoint, stats in get_gemini_client().stats().items():
+            st.write(f"**{endpoint}**: {stats['requests']} requests, p50 {stats['p50_ms']:.0f} ms / "
+                     f"p95 {stats['p95_ms']:.0f} ms, {stats['retries']} retries, {stats['throttles']} throttled, "
+                     f"{stats['hedges']} hedged ({stats['hedge_wins']} won)")
+
+    if st.button("📈 Timing Dashboard"):
+        show_metrics()
+
 # --- DIALOGS ---
 @st.dialog("📄 Note Analysis", width="large")
 def show_analysis(file_name, analysis):
@@ -123,6 +212,70 @@ def show_analysis(file_name, analysis):
     if st.button("Close"):
         st.rerun()
 
+JOB_STAGE_LABELS = {
+    "queued": "⏳ Waiting for a worker",
+    "claimed": "📥 Picked up",
+    "extracting": "📖 Reading file",
+    "saving": "💾 Saving to Database",
+    "analyzing": "🤖 AI Analyst is thinking",
+    "indexing": "🧠 Indexing for Chat",
+    "done": "✅ Analysis Saved & Indexed",
+    "failed": "❌ Failed",
+}
+# The queue is only polled while one of the jobs is in one of these
+ACTIVE_JOB_STATUSES = ("queued", "running")
+
+def note_finished_jobs(jobs):
+    """A job finished since the last look: the cached library list and chat answers are out of date"""
+    finished = {job['id'] for job in jobs if job['status'] in ('done', 'failed')}
+    seen = st.session_state.get("finished_jobs")
+    st.session_state["finished_jobs"] = finished
+    if seen is not None and finished - seen:
+        invalidate_library()
+        # ...and so are chat answers about those papers (this drops the
+        # student's whole-library scope too)
+        for job in jobs:
+            if job['id'] in finished - seen and job['file_hash']:
+                get_chat_cache().invalidate(job['file_hash'])
+        st.rerun()
+
+def render_ingest_jobs(jobs):
+    if not jobs:
+        return
+
+    st.subheader("Processing Queue")
+    for job in jobs:
+        label = JOB_STAGE_LABELS.get(job['stage'], job['stage'])
+        c1, c2 = st.columns([0.6, 0.4])
+        with c1:
+            st.markdown(f"**{job['file_name']}**")
+        with c2:
+            st.write(label)
+        if job['error']:
+            st.caption(f"Error: {job['error']}")
+        if job['partial_analysis']:
+            with st.expander("🤖 Live analysis", expanded=True):
+                st.markdown(job['partial_analysis'])
+
+@st.fragment(run_every="3s")
+def poll_ingest_jobs(user_email):
+    """Reruns on its own every few seconds, so progress updates without rerunning the whole page"""
+    jobs = get_ingest_jobs(user_email)
+    note_finished_jobs(jobs)
+    if not any(job['status'] in ACTIVE_JOB_STATUSES for job in jobs):
+        # Nothing left to watch: a full rerun draws the queue once, without polling
+        st.rerun()
+    render_ingest_jobs(jobs)
+
+def show_ingest_jobs(user_email):
+    """The processing queue; polled only while one of the jobs is queued or running"""
+    jobs = get_ingest_jobs(user_email)
+    note_finished_jobs(jobs)
+    if any(job['status'] in ACTIVE_JOB_STATUSES for job in jobs):
+        poll_ingest_jobs(user_email)
+    else:
+        render_ingest_jobs(jobs)
+
 # --- MAIN APP ---
 if "user" in st.session_state:
     st.title("📚 My Study Dashboard")
@@ -135,24 +288,40 @@ if "user" in st.session_state:
     with tab1:
         st.header("📚 My Study Dashboard")
         
-        # Define files here!
-        files = get_all_files()
+        user_email = st.session_state["user"]["email"]
+        only_mine = st.toggle("Only my uploads", key="library_only_mine")
+        owner = user_email if only_mine else None
+        total_files = cached_count_files(owner)
         
         # Grid Layout for stats
         col1, col2, col3 = st.columns(3)
         with col1:
-            st.metric(label="Total Papers", value=len(files))
+            st.metric(label="Total Papers", value=total_files)
         with col2:
             st.metric(label="Total XP", value=st.session_state["user"]['xp'])
         with col3:
-            st.metric(label="Global Rank", value="#5") # Placeholder for now
+            rank = cached_xp_rank(st.session_state["user"]['xp'])
+            if rank:
+                st.metric(label="Global Rank", value=f"#{rank['rank']}", help=f"out of {rank['total']} students")
+            else:
+                st.metric(label="Global Rank", value="–")
+
+        with st.expander("🏆 Leaderboard"):
+            for position, leader in enumerate(cached_leaderboard(), start=1):
+                st.write(f"**#{position}** {leader['full_name']} · {leader['xp'] or 0} XP")
 
         st.divider()
         st.subheader("Your Library")
 
-        if not files:
+        if not total_files:
             st.info("📂 No files uploaded yet. Go to the 'AI Generator' tab to start!")
         else:
+            # Keyset pagination: one cursor per loaded page (None = first page)
+            cursors = st.session_state.setdefault(f"library_cursors_{only_mine}", [None])
+            files = []
+            for cursor in cursors:
+                files.extend(cached_list_files(owner, cursor, LIBRARY_PAGE_SIZE))
+            
             # Display files in a nice grid instead of a list
             for file in files:
                 with st.container():
@@ -166,12 +335,22 @@ if "user" in st.session_state:
                         st.caption(f"Uploaded: {file['created_at'].strftime('%Y-%m-%d')}")
                     with c3:
                         if st.button("Open", key=f"btn_{file['file_hash']}"):
-                            if file.get('ai_analysis'):
-                                show_analysis(file['file_name'], file['ai_analysis'])
+                            # The analysis text is only fetched now, not with the list (and only once completed)
+                            analysis = get_file_analysis(file['file_hash'])
+                            if analysis:
+                                show_analysis(file['file_name'], analysis)
+                            elif file['ai_status'] == 'failed':
+                                st.error("❌ The analysis of this file failed. Upload it again to retry.")
                             else:
                                 st.warning("Analysis not yet generated for this file.")
                     
                     st.divider() # Thin line between items
+            
+            if len(files) < total_files and len(files) == len(cursors) * LIBRARY_PAGE_SIZE:
+                if st.button("⬇️ Load more"):
+                    last = files[-1]
+                    cursors.append((last['created_at'], last['file_hash']))
+                    st.rerun()
     # TAB 2: UPLOAD & GENERATE
     # TAB 2: UPLOAD & GENERATE
     with tab2:
@@ -181,133 +360,182 @@ if "user" in st.session_state:
         
         if uploaded_files:
             if st.button("⚡ Generate Exam Strategy"):
-                
-                # Create a progress bar
-                progress_bar = st.progress(0)
-                total_files = len(uploaded_files)
-                
-                for index, uploaded_file in enumerate(uploaded_files):
-                    with st.status(f"Processing {uploaded_file.name}...", expanded=True) as status:
-                        
-                        # A. Read PDF
-                        st.write("📖 Reading file...")
-                        
-                        # Fix: Pass the stream directly to pypdf (via utils.py)
-                        # No need to save temp files!
-                        raw_text = extract_text_from_pdf(uploaded_file)
-                        
-                        # B. Generate Hash (Unique ID)
-                        file_hash = hashlib.md5(raw_text.encode()).hexdigest()
-                        
-                        # C. Save Raw Input to DB
-                        st.write("💾 Saving to Database...")
-                        save_file_record(file_hash, uploaded_file.name, raw_text)
-                        
-                        # D. Ask Gemini (The PRO Prompt)
-                        st.write("🤖 AI Analyst is thinking...")
-                        
-                        prompt = f"""
-                        Here is the text content from the uploaded exam paper ({uploaded_file.name}):
-                        {raw_text}
+                # Only queue the work here; worker.py does the heavy lifting, so
+                # the page stays responsive and a refresh doesn't kill anything.
+                job_ids = [
+                    enqueue_ingest_job(f.name, f.getvalue(), st.session_state["user"]["email"])
+                    for f in uploaded_files
+                ]
+                if all(job_ids):
+                    st.success(f"Queued {len(job_ids)} file(s)! Progress shows below.")
+                else:
+                    st.error("❌ Some files could not be queued: Connection to database failed.")
 
-                        ---------------------------------------------
-                        INSTRUCTIONS:
-                        Analyze this exam paper in detail. Your goal is to extract crystal-clear insights.
-                        
-                        Deliver the analysis in this structure:
-                        1️⃣ Repeated Questions Analysis (Frequency & Topics)
-                        2️⃣ Important Topics Priority List (High Weightage)
-                        3️⃣ Chapter-wise Weightage (%)
-                        4️⃣ Difficulty Assessment (Easy/Moderate/Hard)
-                        5️⃣ Final Summary: Top 5 Expected Questions
-
-                        Be highly accurate and structured.
-                        """
-                        
-                        ai_response = ask_gemini(prompt)
-                        
-                        # E. Save AI Output to DB
-                        update_ai_analysis(file_hash, ai_response)
-                        
-                        # F. CHUNKING & EMBEDDINGS (NEW: RAG Preparation)
-                        st.write("🧠 Indexing for Chat...")
-                        # Simple chunking: split by paragraphs or every 1000 chars
-                        chunks = [raw_text[i:i+1000] for i in range(0, len(raw_text), 1000)]
-                        
-                        sections_to_save = []
-                        for chunk in chunks:
-                            vector = generate_embedding(chunk)
-                            if vector:
-                                sections_to_save.append((chunk, vector))
-                        
-                        if sections_to_save:
-                            save_document_sections(file_hash, sections_to_save)
-                        
-                        st.success("Analysis Saved & Indexed!")
-                        status.update(label=f"✅ {uploaded_file.name} Complete!", state="complete", expanded=False)
-                    
-                    # Update progress bar
-                    progress_bar.progress((index + 1) / total_files)
+        show_ingest_jobs(st.session_state["user"]["email"])
+
+        # Multi-year strategy: map each paper once (cached), then reduce across the selection
+        st.divider()
+        st.subheader("📊 Cross-Year Analysis")
+        library = cached_list_files(None, None, CHAT_FILE_OPTIONS_LIMIT)
+        year_options = {f['file_name']: f['file_hash'] for f in library}
+        selected_years = st.multiselect("Pick the papers to compare:", list(year_options.keys()))
+        
+        if len(selected_years) >= 2 and st.button("📈 Analyze Selected Years"):
+            with st.status("Analyzing papers...", expanded=True) as status:
+                try:
+                    st.session_state["cross_year_report"] = analyze_papers(
+                        [year_options[name] for name in selected_years], on_progress=st.write
+                    )
+                    status.update(label="✅ Cross-year analysis ready!", state="complete", expanded=False)
+                except Exception as e:
+                    status.update(label="❌ Analysis failed", state="error")
+                    st.error(f"❌ {e}")
+        
+        if st.session_state.get("cross_year_report"):
+            st.markdown(st.session_state["cross_year_report"])
 
-                st.balloons()
-                st.success("All files processed! Check 'My Notes' tab to view them.")
     # TAB 3: CHAT ASSISTANT
     with tab3:
         st.header("💬 Chat with a Paper")
+        user_email = st.session_state["user"]["email"]
         
-        # 1. Select a File
-        files = get_all_files()
+        # 1. Select what to search: one paper, a few, or all of your own uploads
+        files = cached_list_files(None, None, CHAT_FILE_OPTIONS_LIMIT)
         file_options = {f['file_name']: f['file_hash'] for f in files}
         
-        selected_file_name = st.selectbox("Choose a paper to discuss:", list(file_options.keys()))
+        scope = st.radio("Search in:", ["📄 One paper", "📚 Selected papers", "🌐 All my papers"], horizontal=True)
+        search_hashes, scope_label = None, None
+        if scope == "📄 One paper":
+            selected_file_name = st.selectbox("Choose a paper to discuss:", list(file_options.keys()))
+            if selected_file_name:
+                search_hashes, scope_label = [file_options[selected_file_name]], selected_file_name
+        elif scope == "📚 Selected papers":
+            selected_names = st.multiselect("Choose the papers to search:", list(file_options.keys()))
+            if selected_names:
+                search_hashes = sorted(file_options[name] for name in selected_names)
+                scope_label = f"{len(selected_names)} papers"
+        elif cached_count_files(user_email):
+            # Only the student's own uploads
+            scope_label = "all your papers"
         
-        if selected_file_name:
-            selected_hash = file_options[selected_file_name]
+        if scope_label:
+            # The chat cache is per search scope: one paper's hash, or a key for the set of papers
+            # (the whole-library scope differs per student, so its key carries the student)
+            if search_hashes and len(search_hashes) == 1:
+                scope_key = search_hashes[0]
+            elif search_hashes:
+                scope_key = "library:" + ",".join(search_hashes)
+            else:
+                scope_key = f"library:{user_email}:*"
             
-            # Initialize Chat History
-            if "messages" not in st.session_state:
-                st.session_state.messages = []
+            # Chat History: one conversation per student and scope, stored in the DB.
+            # The latest page is loaded once per session; older pages on request.
+            histories = st.session_state.setdefault("chat_histories", {})
+            history_start_reached = st.session_state.setdefault("chat_history_start_reached", set())
+            if scope_key not in histories:
+                histories[scope_key] = get_chat_messages(user_email, scope_key)
+                if len(histories[scope_key]) < CHAT_PAGE_SIZE:
+                    history_start_reached.add(scope_key)
+            messages = histories[scope_key]
             
             # --- CRITICAL FIX: DISPLAY MESSAGES FIRST ---
             # Create a container specifically for the chat history
             chat_container = st.container()
             
             with chat_container:
-                for message in st.session_state.messages:
+                if messages and scope_key not in history_start_reached:
+                    if st.button("⬆️ Load earlier messages", key=f"older_{scope_key}"):
+                        older = get_chat_messages(user_email, scope_key, before_id=messages[0]['id'])
+                        if len(older) < CHAT_PAGE_SIZE:
+                            history_start_reached.add(scope_key)
+                        messages[:0] = older
+                for message in messages:
                     with st.chat_message(message["role"]):
                         st.markdown(message["content"])
             
             # --- INPUT BOX COMES LAST ---
             # This ensures it stays at the bottom or below the messages
-            if prompt := st.chat_input(f"Ask about {selected_file_name}..."):
+            if prompt := st.chat_input(f"Ask about {scope_label}..."):
                 
                 # 1. Show User Message immediately
                 with chat_container: # Write to the container we created above
                     with st.chat_message("user"):
                         st.markdown(prompt)
                 
-                st.session_state.messages.append({"role": "user", "content": prompt})
+                messages.append({"role": "user", "content": prompt})
+                # Summary + recent turns, so follow-ups keep their context (bounded, see chat_history.py)
+                history = chat_history.format_history(chat_history.load_context(user_email, scope_key))
+                
+                def save_turn(answer):
+                    # Swap the unsaved question for the stored rows (they carry the ids paging needs)
+                    stored = chat_history.record_turn(user_email, scope_key, prompt, answer)
+                    messages[-1:] = stored or [messages[-1], {"role": "assistant", "content": answer}]
+                    chat_history.schedule_summary(user_email, scope_key)
                 
                 # 2. Get AI Response
                 with chat_container: # Write to the container
                     with st.chat_message("assistant"):
-                        with st.spinner("Searching document..."):
-                            # 1. Generate embedding for the question
-                            query_vector = generate_embedding(prompt)
-                            
-                            if query_vector:
-                                # 2. Find relevant chunks
-                                relevant_chunks = match_document_sections(selected_hash, query_vector)
+                        chat_cache = get_chat_cache()
+                        relevant_chunks, sources = [], []
+                        query_vector = None
+                        # Cached answers only count while the papers' sections are as they were
+                        # (worker.py and reindex.py change them out of this process's reach)
+                        library_version = None if history else get_library_version(
+                            search_hashes, uploaded_by=None if search_hashes else user_email
+                        )
+                        # 0. Asked word-for-word before? Skip the embedding call entirely.
+                        # Only for a conversation's first question: a follow-up's answer depends on the turns before it
+                        cached = None if history else chat_cache.get_exact(scope_key, prompt, library_version)
+                        if not cached:
+                            with st.spinner("Searching document..."):
+                                # 1. Generate embedding for the question
+                                query_vector = generate_embedding(prompt)
                                 
-                                if relevant_chunks:
-                                    # 3. Ask Gemini with context
-                                    response = ask_gemini_chat(prompt, relevant_chunks)
-                                    st.markdown(response)
-                                    st.session_state.messages.append({"role": "assistant", "content": response})
-                                else:
-                                    st.error("I couldn't find any relevant sections in the paper.")
+                                if query_vector and not history:
+                                    # 1b. Or something close enough to an earlier question?
+                                    cached = chat_cache.get_similar(scope_key, query_vector, library_version)
+                                if query_vector and not cached and search_hashes and len(search_hashes) == 1:
+                                    # 2. Find relevant chunks (keywords + meaning, see RETRIEVAL_MODE)
+                                    relevant_chunks = search_document_sections(
+                                        search_hashes[0], prompt, query_vector, mode=RETRIEVAL_MODE
+                                    )
+                                elif query_vector and not cached:
+                                    # 2. Across papers: label each chunk with where it came from
+                                    matches = search_library(
+                                        prompt, query_vector, file_hashes=search_hashes,
+                                        uploaded_by=None if search_hashes else user_email,
+                                        mode="vector" if RETRIEVAL_MODE == "vector" else "hybrid"
+                                    )
+                                    relevant_chunks = [
+                                        f"[Source: {m['file_name']}, page {m['page_start'] or '?'}]\n{m['content']}"
+                                        for m in matches
+                                    ]
+                                    sources = sorted({m['file_name'] for m in matches if m['file_name']})
+                        
+                        if cached:
+                            st.markdown(cached["answer"])
+                            st.caption("⚡ Answered from cache")
+                            save_turn(cached["answer"])
+                        elif not query_vector:
+                            st.error("Failed to generate embedding for your question.")
+                        elif relevant_chunks:
+                            # 3. Ask Gemini with context, rendering tokens as they stream in
+                            try:
+                                response = st.write_stream(ask_gemini_chat_stream(prompt, relevant_chunks, history))
+                            except GeminiError as e:
+                                st.error(f"❌ The AI tutor is unavailable right now: {e}")
                             else:
-                                st.error("Failed to generate embedding for your question.")
+                                if sources:
+                                    st.caption("📚 Sources: " + ", ".join(sources))
+                                if response:
+                                    save_turn(response)
+                                    if not history:
+                                        chat_cache.put(scope_key, prompt, query_vector, relevant_chunks, response, library_version)
+                        else:
+                            st.error(f"I couldn't find any relevant sections in {scope_label}.")
 
 else:
-    st.info("👈 Please log in from the sidebar to continue.")
\ No newline at end of file
+    st.info("👈 Please log in from the sidebar to continue.")
+
+# Reruns cut short by st.rerun() never get here, so they aren't counted
+metrics.observe("streamlit_rerun_seconds", time.perf_counter() - rerun_started)
@@ -0,0 +1,185 @@
+"""
+Async counterparts of the blocking I/O in utils.py / db.py, plus a bridge so
+synchronous code (the Streamlit script, the worker) can run several
+independent calls at once:
+
+    analysis, vectors = gather(
+        gemini().generate(prompt),
+        gemini().embed_many(chunks),
+    )
+
+Everything async lives on one background event loop per process, which owns
+the shared httpx client (HTTP/2, keep-alive) and the asyncpg pool.
+"""
+import os
+import json
+import time
+import asyncio
+import threading
+import asyncpg
+import httpx
+import streamlit as st
+import metrics
+from db import get_database_settings
+from utils import (
+    get_api_key, GEMINI_API_BASE, CHAT_MODEL, EMBEDDING_MODEL, EMBED_BATCH_SIZE, RETRYABLE_STATUS, THROTTLE_STATUS,
+    UNMETERED_METHODS, GeminiError, get_gemini_client, estimate_request_tokens, build_generate_payload,
+    build_embed_request,
+)
+
+# Max Gemini requests in flight per process
+GEMINI_CONCURRENCY = int(os.getenv("GEMINI_CONCURRENCY", "8"))
+ASYNC_DB_POOL_MAX = int(os.getenv("ASYNC_DB_POOL_MAX", "10"))
+# Set to 0 behind a transaction-mode pooler (e.g. Supabase's pgbouncer port)
+ASYNCPG_STATEMENT_CACHE = int(os.getenv("ASYNCPG_STATEMENT_CACHE", "100"))
+
+# --- THE BRIDGE ---
+
+class _LoopThread:
+    """An event loop running forever on a daemon thread"""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, daemon=True, name="async-io").start()
+
+    def submit(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def run(self, coro, timeout=None):
+        return self.submit(coro).result(timeout)
+
+@st.cache_resource(show_spinner=False)
+def _get_loop_thread():
+    return _LoopThread()
+
+def submit(coro):
+    """Starts a coroutine on the shared background loop; returns a concurrent.futures.Future"""
+    return _get_loop_thread().submit(coro)
+
+def run_async(coro, timeout=None):
+    """Runs a coroutine on the shared background loop and blocks until it finishes"""
+    return _get_loop_thread().run(coro, timeout)
+
+def gather(*coros, timeout=None):
+    """Runs independent coroutines concurrently; returns their results in order"""
+    async def _all():
+        return await asyncio.gather(*coros)
+    return run_async(_all(), timeout)
+
+# --- GEMINI ---
+
+class AsyncGemini:
+    """Gemini REST client: one HTTP/2 connection pool, at most `concurrency` requests in flight"""
+
+    def __init__(self, concurrency=GEMINI_CONCURRENCY, max_retries=4):
+        self.client = httpx.AsyncClient(
+            http2=GEMINI_API_BASE.startswith("https"),
+            timeout=httpx.Timeout(120.0, connect=10.0),
+            limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency),
+            headers={'Content-Type': 'application/json'},
+        )
+        self.limiter = asyncio.Semaphore(concurrency)
+        self.max_retries = max_retries
+
+    async def _post(self, model, method, payload):
+        """Async GeminiClient.post: same buckets, backoff and counters as the sync client"""
+        quota = get_gemini_client()
+        url = f"{GEMINI_API_BASE}/{model}:{method}?key={get_api_key()}"
+        tokens = estimate_request_tokens(payload)
+        for attempt in range(self.max_retries + 1):
+            await asyncio.sleep(quota.reserve(tokens))
+            queued = time.perf_counter()
+            try:
+                async with self.limiter:
+                    # Latency is the request alone; the wait for a free slot is its own metric
+                    start = time.perf_counter()
+                    metrics.observe("gemini_queue_wait_seconds", start - queued, endpoint=method)
+                    response = await self.client.post(url, json=payload)
+            except httpx.HTTPError as e:
+                quota.record(method, latency=time.perf_counter() - start, status=-1)
+                if attempt == self.max_retries:
+                    raise GeminiError(f"Connection Error: {e}") from e
+                quota.record(method, retry=True)
+                await asyncio.sleep(quota.backoff(attempt))
+                continue
+
+            quota.record(method, latency=time.perf_counter() - start, status=response.status_code)
+            if response.status_code == 200:
+                if method in UNMETERED_METHODS:
+                    metrics.inc("gemini_tokens_total", tokens, kind="input_estimated", endpoint=method)
+                return response
+            if response.status_code in THROTTLE_STATUS:
+                quota.requests_bucket.drain()
+            if response.status_code not in RETRYABLE_STATUS or attempt == self.max_retries:
+                raise GeminiError(f"Server Error {response.status_code}: {response.text}", response.status_code)
+            quota.record(method, retry=True)
+            await asyncio.sleep(quota.backoff(attempt, response))
+
+    async def generate(self, prompt, json_output=False):
+        """Async ask_gemini: the answer text, or GeminiError"""
+        response = await self._post(CHAT_MODEL, "generateContent", build_generate_payload(prompt, json_output))
+        result = response.json()
+        get_gemini_client().charge_output(result.get('usageMetadata'))
+        try:
+            return result['candidates'][0]['content']['parts'][0]['text']
+        except (KeyError, IndexError) as e:
+            raise GeminiError(f"No text in response: {json.dumps(result)[:500]}") from e
+
+    async def embed_batch(self, texts):
+        try:
+            response = await self._post(EMBEDDING_MODEL, "batchEmbedContents", {
+                "requests": [build_embed_request(text) for text in texts]
+            })
+            return [e.get('values') for e in response.json()['embeddings']]
+        except GeminiError as e:
+            print(f"❌ Batch Embedding API Error: {e}")
+            metrics.record_error("embed_batch", e)
+        return [None] * len(texts)
+
+    async def embed_many(self, texts, batch_size=EMBED_BATCH_SIZE):
+        """
+        Embeds many texts: batches of `batch_size` go to batchEmbedContents, all
+        at once (the limiter caps what is in flight). The result lines up with
+        `texts` (a failed batch gives None for each of its texts).
+        """
+        texts = list(texts)
+        batches = [texts[i:i + batch_size] for i in range(0, len(texts), batch_size)]
+        results = await asyncio.gather(*(self.embed_batch(batch) for batch in batches))
+        return [vector for batch in results for vector in batch]
+
+_gemini = None
+_gemini_lock = threading.Lock()
+
+def gemini():
+    """The process-wide client (use it from coroutines run via run_async / gather)"""
+    global _gemini
+    with _gemini_lock:
+        if _gemini is None:
+            _gemini = AsyncGemini()
+    return _gemini
+
+# --- POSTGRES (asyncpg) ---
+
+_pool = None
+_pool_lock = asyncio.Lock()
+
+async def get_async_pool():
+    """asyncpg pool, created on first use (on the bridge loop); None when there is no database"""
+    global _pool
+    async with _pool_lock:
+        if _pool is None:
+            settings = get_database_settings()
+            connect = {"dsn": settings["dsn"]} if "dsn" in settings else {
+                "database": settings["dbname"], "user": settings["user"], "password": settings["password"],
+                "host": settings["host"], "port": settings["port"],
+            }
+            try:
+                _pool = await asyncpg.create_pool(
+                    min_size=1, max_size=ASYNC_DB_POOL_MAX,
+                    statement_cache_size=ASYNCPG_STATEMENT_CACHE, **connect
+                )
+            except (OSError, asyncpg.PostgresError, asyncpg.InterfaceError) as e:
+                print(f"❌ Async DB Connection Error: {e}")
+                metrics.record_error("get_async_pool", e)
+                return None
+    return _pool
@@ -0,0 +1,101 @@
+"""
+Benchmark: recall@k vs. latency of the halfvec HNSW / IVFFlat index for a
+range of ef_search / probes values, over synthetic clustered vectors.
+
+Builds its own scratch table (bench_ann_vectors), so it never touches real data.
+Needs a local Postgres with pgvector >= 0.7 (halfvec):
+
+    DATABASE_URL=postgresql://postgres@localhost/portal_bench python benchmarks/bench_ann_recall.py [rows]
+"""
+import io
+import os
+import sys
+import time
+import struct
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import db  # noqa: E402
+
+DIMS = 3072
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+QUERIES = 50
+K = 10
+EF_SEARCH_VALUES = [10, 20, 40, 80, 160, 320]
+PROBES_VALUES = [1, 5, 10, 20, 50]
+
+def synthetic_vectors(rows, clusters=200, seed=0):
+    """Gaussian blobs around random centres: closer to real embeddings than pure noise"""
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((clusters, DIMS), dtype=np.float32)
+    labels = rng.integers(0, clusters, rows)
+    vectors = centres[labels] + 0.3 * rng.standard_normal((rows, DIMS), dtype=np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def load(cur, vectors):
+    cur.execute("DROP TABLE IF EXISTS bench_ann_vectors")
+    cur.execute("CREATE TABLE bench_ann_vectors (id int primary key, embedding vector(3072) not null)")
+    buffer = io.BytesIO()
+    buffer.write(db._COPY_HEADER)
+    for i, vector in enumerate(vectors):
+        buffer.write(struct.pack("!h", 2))
+        buffer.write(db._copy_field(struct.pack("!i", i)))
+        buffer.write(db._copy_field(db.encode_vector_binary(vector)))
+    buffer.write(db._COPY_TRAILER)
+    buffer.seek(0)
+    cur.copy_expert("COPY bench_ann_vectors (id, embedding) FROM STDIN WITH (FORMAT binary)", buffer)
+
+def run_queries(cur, queries, truth, setting, values):
+    print(f"\n{setting:>18} | {'recall@' + str(K):>9} | {'p50 ms':>7} | {'p95 ms':>7}")
+    print("-" * 50)
+    for value in values:
+        cur.execute(f"SET {setting} = {int(value)}")
+        latencies, hits = [], 0
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            cur.execute(
+                """SELECT id FROM bench_ann_vectors
+                   ORDER BY embedding::halfvec(3072) <=> %s::vector(3072)::halfvec(3072) LIMIT %s""",
+                (query.tolist(), K)
+            )
+            found = {row[0] for row in cur.fetchall()}
+            latencies.append((time.perf_counter() - start) * 1000)
+            hits += len(found & expected)
+        p50, p95 = np.percentile(latencies, [50, 95])
+        print(f"{value:>18} | {hits / (len(queries) * K):>9.3f} | {p50:>7.1f} | {p95:>7.1f}")
+
+def main():
+    vectors = synthetic_vectors(ROWS)
+    queries = synthetic_vectors(QUERIES, seed=1)
+    # Exact top-k with NumPy (vectors are normalised, so dot product ranks like cosine)
+    truth = [set(np.argsort(-(vectors @ q))[:K].tolist()) for q in queries]
+
+    with db.db_connection() as conn:
+        if not conn:
+            sys.exit("❌ No database. Set DATABASE_URL to a Postgres with pgvector.")
+        with conn.cursor() as cur:
+            print(f"Loading {ROWS} x {DIMS}-dim vectors...")
+            load(cur, vectors)
+            conn.commit()
+
+            for index_type, options, setting, values in [
+                ("hnsw", "with (m = 16, ef_construction = 64)", "hnsw.ef_search", EF_SEARCH_VALUES),
+                ("ivfflat", f"with (lists = {max(ROWS // 1000, 10)})", "ivfflat.probes", PROBES_VALUES),
+            ]:
+                cur.execute("DROP INDEX IF EXISTS bench_ann_idx")
+                start = time.perf_counter()
+                cur.execute(
+                    f"""CREATE INDEX bench_ann_idx ON bench_ann_vectors
+                        USING {index_type} ((embedding::halfvec(3072)) halfvec_cosine_ops) {options}"""
+                )
+                conn.commit()
+                print(f"\n{index_type}: index built in {time.perf_counter() - start:.1f}s")
+                run_queries(cur, queries, truth, setting, values)
+                conn.rollback()
+
+            cur.execute("DROP TABLE bench_ann_vectors")
+            conn.commit()
+
+if __name__ == "__main__":
+    main()
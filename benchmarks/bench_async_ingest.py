@@ -0,0 +1,75 @@
+"""
+Benchmark: wall-clock time of the real ingest_pdf (extract -> save -> chunk &
+embed -> analyse) for papers of growing size, against a local mock Gemini:
+every embedding group in flight on the async loop (what ingest does) vs.
+one group at a time. Also reports how ingest's time splits over its stages.
+
+Every run uses freshly generated papers, so the embedding/analysis cache
+never hits. Runs with or without a database (without one, the DB writes are
+skipped and only the Gemini side is timed):
+
+    python benchmarks/bench_async_ingest.py
+"""
+import io
+import os
+import sys
+import time
+from concurrent.futures import Future
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mock_gemini import start_mock_server  # noqa: E402
+from sample_papers import generate_corpus, paper_to_pdf  # noqa: E402
+
+server, base_url = start_mock_server(latency=0.3, per_item_latency=0.002, stream_chunks=40, token_interval=0.005)
+os.environ["GEMINI_API_BASE"] = base_url
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+
+import metrics  # noqa: E402  (must come after the env vars above)
+import ingest  # noqa: E402
+
+# Papers per PDF (2 pages each); the biggest is past PARALLEL_PDF_MIN_PAGES
+PAPER_COUNTS = [1, 10, 30]
+STAGES = ["extracting", "saving", "indexing", "analyzing"]
+
+def make_pdf(papers, seed):
+    pages = [text for paper in generate_corpus(papers, seed=seed) for _, text in paper["pages"]]
+    return paper_to_pdf({"pages": list(enumerate(pages, start=1))}), len(pages)
+
+def one_at_a_time(texts, embed_group=ingest.embed_group):
+    # Waits for each group before reading on, like ingest without the async loop
+    future = Future()
+    future.set_result(embed_group(texts).result())
+    return future
+
+def stage_totals():
+    histograms, _ = metrics.snapshot()
+    return {h["stage"]: h["sum"] for h in histograms if h["metric"] == "ingest_stage_seconds"}
+
+def time_ingest(pdf_bytes, name):
+    before = stage_totals()
+    start = time.perf_counter()
+    ingest.ingest_pdf(io.BytesIO(pdf_bytes), name, uploaded_by="bench-ingest@example.com")
+    seconds = time.perf_counter() - start
+    after = stage_totals()
+    return seconds, {stage: after.get(stage, 0) - before.get(stage, 0) for stage in STAGES}
+
+def main():
+    print(f"Mock Gemini at {base_url} (300 ms/request, 2 ms/text in a batch)\n")
+    print(f"{'pages':>5} | {'one group at a time (s)':>23} | {'async (s)':>9} | {'speedup':>7} | async stages (s)")
+    print("-" * 100)
+    async_embed = ingest.embed_group
+    for seed, count in enumerate(PAPER_COUNTS):
+        pdf_bytes, pages = make_pdf(count, seed=2 * seed)
+        ingest.embed_group = one_at_a_time
+        serial, _ = time_ingest(pdf_bytes, f"bench-serial-{pages}.pdf")
+
+        pdf_bytes, _ = make_pdf(count, seed=2 * seed + 1)
+        ingest.embed_group = async_embed
+        concurrent, stages = time_ingest(pdf_bytes, f"bench-async-{pages}.pdf")
+
+        split = "  ".join(f"{stage} {seconds:.2f}" for stage, seconds in stages.items())
+        print(f"{pages:>5} | {serial:>23.2f} | {concurrent:>9.2f} | {serial / concurrent:>6.1f}x | {split}")
+    print(f"\nMock Gemini calls: {dict(sorted(server.state.counts.items()))}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Benchmark: row-by-row INSERT (the old save_document_sections) vs. the single
+binary COPY now used by db.save_document_sections.
+
+Needs a local Postgres with pgvector and the schema from setup_db.py:
+
+    DATABASE_URL=postgresql://postgres@localhost/portal_bench python benchmarks/bench_bulk_insert.py
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import db  # noqa: E402
+
+CHUNK_COUNTS = [10, 100, 1000]
+DIMS = 3072
+BENCH_HASH = "bench-bulk-insert"
+
+def make_sections(count):
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((count, DIMS), dtype=np.float32)
+    return [(f"chunk {i} " + "lorem ipsum " * 80, vectors[i]) for i in range(count)]
+
+def insert_row_by_row(file_hash, sections):
+    """The pre-COPY implementation, kept here only for comparison"""
+    with db.db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM document_sections WHERE file_hash = %s", (file_hash,))
+            for content, embedding in sections:
+                cur.execute(
+                    "INSERT INTO document_sections (file_hash, content, embedding) VALUES (%s, %s, %s)",
+                    (file_hash, content, embedding.tolist())
+                )
+            conn.commit()
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    fn(*args)
+    return time.perf_counter() - start
+
+def main():
+    with db.db_connection() as conn:
+        if not conn:
+            sys.exit("❌ No database. Set DATABASE_URL to a Postgres with pgvector.")
+
+    print(f"{'chunks':>7} | {'INSERT rows/s':>13} | {'COPY rows/s':>11} | {'speedup':>7}")
+    print("-" * 49)
+    try:
+        for count in CHUNK_COUNTS:
+            sections = make_sections(count)
+            row_time = timed(insert_row_by_row, BENCH_HASH, sections)
+            copy_time = timed(db.save_document_sections, BENCH_HASH, sections)
+            print(f"{count:>7} | {count / row_time:>13.0f} | {count / copy_time:>11.0f} | "
+                  f"{row_time / copy_time:>6.1f}x")
+    finally:
+        with db.db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM document_sections WHERE file_hash = %s", (BENCH_HASH,))
+            conn.commit()
+
+if __name__ == "__main__":
+    main()
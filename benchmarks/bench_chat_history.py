@@ -0,0 +1,77 @@
+"""
+Benchmark: prompt size of a growing chat conversation, sending the whole
+history every turn vs. chat_history's bounded window + rolling summary, and
+the cost of loading that context from Postgres.
+
+Uses the local mock Gemini for answers and summaries, and a scratch
+conversation (deleted afterwards) in the real chat tables:
+
+    DATABASE_URL=postgresql://postgres@localhost/portal_bench python benchmarks/bench_chat_history.py
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mock_gemini import start_mock_server  # noqa: E402
+from sample_papers import generate_paper  # noqa: E402
+
+server, base_url = start_mock_server(latency=0.01, stream_chunks=120, token_interval=0)
+os.environ["GEMINI_API_BASE"] = base_url
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+
+import db  # noqa: E402  (must come after the env vars above)
+import chat_history  # noqa: E402
+from chunker import estimate_tokens  # noqa: E402
+from utils import build_chat_prompt, ask_gemini_stream  # noqa: E402
+
+TURNS = 60
+REPORT_AT = {1, 5, 10, 20, 40, 60}
+USER = "bench-chat@example.com"
+SCOPE = "bench-chat-scope"
+CONTEXT_CHUNKS = ["(retrieved section) " + "lorem ipsum " * 150] * 5
+
+def cleanup():
+    with db.db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM chat_messages WHERE user_email = %s", (USER,))
+            cur.execute("DELETE FROM chat_sessions WHERE user_email = %s", (USER,))
+        conn.commit()
+
+def main():
+    with db.db_connection() as conn:
+        if not conn:
+            sys.exit("❌ No database. Set DATABASE_URL to a Postgres (with setup_db.py applied).")
+    cleanup()
+
+    questions = [q["text"] for q in generate_paper(2022, questions_per_section=20)["questions"]]
+    full_history = []
+    load_ms = []
+    print(f"window {chat_history.CHAT_WINDOW_TOKENS} tokens, summary every {chat_history.CHAT_SUMMARY_EVERY} messages\n")
+    print(f"{'turn':>4} | {'full history (tokens)':>21} | {'window + summary (tokens)':>25} | {'context load ms':>15}")
+    print("-" * 76)
+    try:
+        for turn in range(1, TURNS + 1):
+            question = questions[turn % len(questions)]
+            start = time.perf_counter()
+            history = chat_history.format_history(chat_history.load_context(USER, SCOPE))
+            load_ms.append((time.perf_counter() - start) * 1000)
+
+            naive = build_chat_prompt(question, CONTEXT_CHUNKS, "\n".join(full_history))
+            bounded = build_chat_prompt(question, CONTEXT_CHUNKS, history)
+            answer = "".join(ask_gemini_stream(bounded, label="bench"))
+
+            chat_history.record_turn(USER, SCOPE, question, answer)
+            chat_history.update_summary(USER, SCOPE)
+            full_history += [f"USER: {question}", f"ASSISTANT: {answer}"]
+            if turn in REPORT_AT:
+                print(f"{turn:>4} | {estimate_tokens(naive):>21} | {estimate_tokens(bounded):>25} | "
+                      f"{np.median(load_ms[-5:]):>15.2f}")
+    finally:
+        cleanup()
+    print(f"\nMock Gemini calls: {dict(sorted(server.state.counts.items()))}")
+
+if __name__ == "__main__":
+    main()
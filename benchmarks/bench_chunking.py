@@ -0,0 +1,75 @@
+"""
+Benchmark: fixed-width (1000 char) vs. structure-aware chunking on sample
+exam papers. Reports chunk counts, how often the retrieved chunks contain the
+whole question asked about, and how many prompt tokens top-k retrieval adds.
+
+Retrieval uses a local hashed bag-of-words embedding (no API calls), which is
+enough to compare how well each chunker keeps questions intact.
+
+    python benchmarks/bench_chunking.py
+"""
+import os
+import re
+import sys
+import zlib
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sample_papers import generate_corpus  # noqa: E402
+import chunker  # noqa: E402
+
+DIMS = 2048
+TOP_K = [1, 3, 5]
+WORD = re.compile(r"[a-z0-9']+")
+
+def embed(texts):
+    """Hashed bag-of-words, L2-normalised"""
+    matrix = np.zeros((len(texts), DIMS), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for word in WORD.findall(text.lower()):
+            matrix[row, zlib.crc32(word.encode()) % DIMS] += 1.0
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+def question_query(question):
+    # Students paraphrase: keep the topic and drop the question number / marks
+    return f"what do I need to know about {question['topic']}"
+
+def covered(question_text, chunks):
+    """Does the retrieved text contain (almost) every word of the question?"""
+    needed = set(WORD.findall(question_text.lower()))
+    have = set(WORD.findall(" ".join(chunks).lower()))
+    return len(needed & have) / len(needed) >= 0.95
+
+def evaluate(name, chunk_fn, papers):
+    totals = {k: {"covered": 0, "tokens": 0} for k in TOP_K}
+    chunk_count, queries = 0, 0
+    for paper in papers:
+        chunks = [c[0] for c in chunk_fn(paper["pages"])]
+        chunk_count += len(chunks)
+        chunk_vectors = embed(chunks)
+        for question in paper["questions"]:
+            queries += 1
+            scores = chunk_vectors @ embed([question_query(question)])[0]
+            ranked = [chunks[i] for i in np.argsort(-scores)]
+            for k in TOP_K:
+                top = ranked[:k]
+                totals[k]["covered"] += covered(question["text"], top)
+                totals[k]["tokens"] += sum(chunker.estimate_tokens(c) for c in top)
+
+    print(f"\n{name}: {chunk_count} chunks over {len(papers)} papers ({queries} questions)")
+    print(f"{'top-k':>6} | {'whole question retrieved':>24} | {'avg prompt tokens':>17}")
+    for k in TOP_K:
+        print(f"{k:>6} | {totals[k]['covered'] / queries:>23.0%} | {totals[k]['tokens'] / queries:>17.0f}")
+
+def main():
+    papers = generate_corpus(10)
+    evaluate("Fixed width (1000 chars)", chunker.iter_fixed_chunks, papers)
+    evaluate(
+        f"Structure-aware (max {chunker.CHUNK_MAX_TOKENS} tokens, overlap {chunker.CHUNK_OVERLAP_TOKENS})",
+        chunker.iter_structured_chunks, papers
+    )
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+"""
+Benchmark: the shared Gemini client under throttling and tail latency,
+against a local mock Gemini server.
+
+  1. a burst of embedding batches with 30% of requests answered 429
+     (the retries should absorb every one of them)
+  2. the same burst with 3% of requests stalling for 1 s, without and with
+     hedging (a duplicate request once the first is slower than the p95)
+
+    python benchmarks/bench_gemini_client.py
+"""
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mock_gemini import start_mock_server
+
+server, base_url = start_mock_server(latency=0.05, per_item_latency=0.0005, error_rate=0.0, dims=64)
+os.environ["GEMINI_API_BASE"] = base_url
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+
+import utils  # noqa: E402  (must come after the env vars above)
+
+BATCHES = 200
+# Well above what the burst needs, so the bucket never paces these runs
+UNCAPPED_RPM = 100_000
+
+def burst(client):
+    chunks = [f"chunk {i} " + "lorem ipsum " * 40 for i in range(BATCHES * 10)]
+    batches = [chunks[i:i + 10] for i in range(0, len(chunks), 10)]
+
+    def embed(texts):
+        try:
+            response = client.post(utils.EMBEDDING_MODEL, "batchEmbedContents", {
+                "requests": [utils.build_embed_request(text) for text in texts]
+            }, hedge=True)
+            return [e.get('values') for e in response.json()['embeddings']]
+        except utils.GeminiError:
+            return [None] * len(texts)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        vectors = [vector for batch in executor.map(embed, batches) for vector in batch]
+    return time.perf_counter() - start, sum(1 for v in vectors if v is None)
+
+def report(label, elapsed, lost, client):
+    stats = client.stats()["batchEmbedContents"]
+    print(f"{label:<22} | {elapsed:>6.2f}s | p50 {stats['p50_ms']:>6.0f} ms | p95 {stats['p95_ms']:>6.0f} ms | "
+          f"max {stats['latency_max_ms']:>6.0f} ms | {stats['retries']:>3} retries | {stats['throttles']:>3} throttled | "
+          f"{stats['hedges']:>3} hedges | {lost} lost")
+
+def main():
+    print(f"Mock Gemini at {base_url}, {BATCHES} batches of 10 texts, 8 in flight\n")
+
+    server.state.error_rate = 0.3
+    client = utils.GeminiClient(rpm=UNCAPPED_RPM, base_delay=0.05, max_retries=6, hedge_after=-1)
+    report("30% 429s", *burst(client), client)
+
+    server.state.error_rate = 0.0
+    server.state.tail_rate = 0.03
+    client = utils.GeminiClient(rpm=UNCAPPED_RPM, hedge_after=-1)
+    report("3% stalls, no hedge", *burst(client), client)
+    client = utils.GeminiClient(rpm=UNCAPPED_RPM, hedge_after=0)
+    report("3% stalls, hedged", *burst(client), client)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Benchmark: leaderboard and rank lookups over a synthetic users table, for the
+old queries (sort the whole table, RANK() window) and the new ones (xp index,
+trigger-maintained xp_buckets), plus what the trigger adds to an XP update.
+
+Builds scratch copies (bench_users, bench_xp_buckets), so real users are untouched:
+
+    DATABASE_URL=postgresql://postgres@localhost/portal_bench python benchmarks/bench_leaderboard.py
+"""
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import db  # noqa: E402
+
+USER_COUNTS = [10_000, 100_000, 500_000]
+REPEATS = 50
+
+SCHEMA = """
+drop table if exists bench_users, bench_xp_buckets;
+create table bench_users (email text primary key, full_name text, xp int);
+create table bench_xp_buckets (xp int primary key, user_count int not null);
+
+create or replace function bench_users_xp_buckets() returns trigger
+language plpgsql
+as $$
+begin
+  if tg_op in ('UPDATE', 'DELETE') then
+    update bench_xp_buckets set user_count = user_count - 1 where xp = coalesce(old.xp, 0);
+    delete from bench_xp_buckets where xp = coalesce(old.xp, 0) and user_count <= 0;
+  end if;
+  if tg_op in ('INSERT', 'UPDATE') then
+    insert into bench_xp_buckets (xp, user_count) values (coalesce(new.xp, 0), 1)
+    on conflict (xp) do update set user_count = bench_xp_buckets.user_count + 1;
+  end if;
+  return null;
+end;
+$$;
+"""
+
+# Long-tailed XP: most students have a little, a few have a lot
+LOAD = """
+insert into bench_users (email, full_name, xp)
+select 'user' || i || '@example.com', 'User ' || i, floor(exp(random() * 9))::int
+from generate_series(1, %s) i;
+"""
+
+QUERIES = {
+    "leaderboard top 10": "SELECT full_name, xp FROM bench_users ORDER BY xp DESC NULLS LAST, email LIMIT 10",
+    "rank (RANK() window)": """SELECT rank FROM (SELECT email, rank() OVER (ORDER BY xp DESC NULLS LAST) AS rank
+                                                 FROM bench_users) r WHERE email = %(email)s""",
+    "rank (count above, index)": "SELECT count(*) + 1 FROM bench_users WHERE xp > %(xp)s",
+    "rank (xp_buckets)": """SELECT coalesce(sum(user_count) FILTER (WHERE xp > %(xp)s), 0) + 1,
+                                   coalesce(sum(user_count), 0) FROM bench_xp_buckets""",
+}
+
+def timed(cur, sql, params_list):
+    latencies = []
+    for params in params_list:
+        start = time.perf_counter()
+        cur.execute(sql, params)
+        cur.fetchall()
+        latencies.append((time.perf_counter() - start) * 1000)
+    return np.percentile(latencies, 50)
+
+def main():
+    with db.db_connection() as conn:
+        if not conn:
+            sys.exit("❌ No database. Set DATABASE_URL to a Postgres.")
+
+        rng = np.random.default_rng(0)
+        with conn.cursor() as cur:
+            # before = plain table (whole-table sort / window); after = xp index + xp_buckets
+            print(f"{'users':>8} | {'query':<28} | {'before':>9} | {'after':>8}   (p50 ms)")
+            print("-" * 72)
+            for count in USER_COUNTS:
+                cur.execute(SCHEMA)
+                cur.execute(LOAD, (count,))
+                cur.execute("ANALYZE bench_users")
+                conn.commit()
+
+                picks = rng.integers(1, count + 1, REPEATS)
+                cur.execute("SELECT email, xp FROM bench_users WHERE email = ANY(%s)",
+                            ([f"user{i}@example.com" for i in picks],))
+                params = [{"email": email, "xp": xp} for email, xp in cur.fetchall()]
+
+                before = {label: timed(cur, sql, params) for label, sql in QUERIES.items() if "buckets" not in label}
+
+                cur.execute("CREATE INDEX ON bench_users (xp DESC NULLS LAST, email)")
+                cur.execute("""INSERT INTO bench_xp_buckets (xp, user_count)
+                               SELECT coalesce(xp, 0), count(*) FROM bench_users GROUP BY 1""")
+                cur.execute("ANALYZE bench_users; ANALYZE bench_xp_buckets")
+                conn.commit()
+                for label, sql in QUERIES.items():
+                    after = timed(cur, sql, params)
+                    old = f"{before[label]:>9.2f}" if label in before else f"{'-':>9}"
+                    print(f"{count:>8} | {label:<28} | {old} | {after:>8.2f}")
+
+                # Cost of keeping xp_buckets current: an XP award with and without the trigger
+                update = "UPDATE bench_users SET xp = xp + 10 WHERE email = %(email)s"
+                plain = timed(cur, update, params)
+                conn.rollback()
+                cur.execute("""CREATE TRIGGER bench_users_xp_buckets AFTER INSERT OR DELETE OR UPDATE OF xp
+                               ON bench_users FOR EACH ROW EXECUTE FUNCTION bench_users_xp_buckets()""")
+                with_trigger = timed(cur, update, params)
+                conn.rollback()
+                print(f"{count:>8} | {'XP update (+trigger)':<28} | {plain:>9.2f} | {with_trigger:>8.2f}")
+                cur.execute("SELECT count(*) FROM bench_xp_buckets")
+                print(f"{'':>8} | {'distinct XP values':<28} | {'':>9} | {cur.fetchone()[0]:>8}")
+
+            cur.execute("drop table if exists bench_users, bench_xp_buckets")
+            cur.execute("drop function if exists bench_users_xp_buckets()")
+            conn.commit()
+
+if __name__ == "__main__":
+    main()
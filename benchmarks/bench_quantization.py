@@ -0,0 +1,182 @@
+"""
+Benchmark: recall@10 and size of the embedding layouts setup_db.py can build
+(EMBEDDING_DIMS / EMBEDDING_STORAGE / COARSE_INDEX), against exact search on
+full-size float4 vectors.
+
+  1. Offline, with NumPy: Matryoshka truncation (1536 / 768 dims), halfvec
+     (float2) storage, and binary quantization alone or as the coarse stage
+     of a two-stage search re-ranked on the stored vectors.
+  2. With a Postgres (pgvector >= 0.7) reachable through DATABASE_URL: the same
+     layouts as real tables + HNSW indexes, for table size, recall and query
+     latency. hnsw.ef_search is set the way setup_db's set_ann_search sets it
+     (the server default 40, raised to the candidate count), since HNSW never
+     returns more than ef_search rows.
+
+    python benchmarks/bench_quantization.py [rows]
+    DATABASE_URL=postgresql://postgres@localhost/portal_bench python benchmarks/bench_quantization.py
+
+The vectors are synthetic: clustered, with variance falling off across the
+dimensions the way Matryoshka-trained embeddings concentrate information in
+the leading dims. Real gemini-embedding-001 vectors should be checked with
+the same script before changing the production layout.
+"""
+import io
+import os
+import sys
+import time
+import struct
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import db  # noqa: E402
+
+FULL_DIMS = 3072
+ROWS = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+QUERIES = 100
+K = 10
+RERANK_CANDIDATES = [40, 100, 200]
+PG_CANDIDATES = 100
+# pgvector's hnsw.ef_search default
+DEFAULT_EF_SEARCH = 40
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+def synthetic_corpus(rows, queries, clusters=300, seed=0):
+    rng = np.random.default_rng(seed)
+    # Leading dims carry more of the signal, like a Matryoshka embedding
+    scale = (1.0 / np.sqrt(1.0 + np.arange(FULL_DIMS) / 128.0)).astype(np.float32)
+    centres = rng.standard_normal((clusters, FULL_DIMS), dtype=np.float32) * scale
+    labels = rng.integers(0, clusters, rows)
+    vectors = centres[labels] + 0.6 * rng.standard_normal((rows, FULL_DIMS), dtype=np.float32) * scale
+    # Queries are paraphrases: a stored chunk plus noise
+    picks = rng.integers(0, rows, queries)
+    query_vectors = vectors[picks] + 0.6 * rng.standard_normal((queries, FULL_DIMS), dtype=np.float32) * scale
+    return vectors, query_vectors
+
+def _unit(matrix):
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+def top_k(stored_unit, query, k):
+    """Cosine top-k; `stored_unit` rows are already unit length (in their storage precision)"""
+    scores = stored_unit @ query.astype(stored_unit.dtype)
+    return np.argpartition(-scores, k)[:k] if k < len(scores) else np.arange(len(scores))
+
+def hamming_top_k(bits, query_bits, k):
+    distances = _POPCOUNT[np.bitwise_xor(bits, query_bits)].sum(axis=1, dtype=np.int32)
+    return np.argpartition(distances, k)[:k]
+
+def recall(found, truth):
+    return np.mean([len(set(f.tolist()) & t) / K for f, t in zip(found, truth)])
+
+def offline(vectors, queries):
+    full = _unit(vectors)
+    truth = [set(top_k(full, q, K).tolist()) for q in queries]
+    # (NumPy timings would say nothing about Postgres, so only recall and size here)
+    print(f"{'layout':<38} | {'bytes/row':>9} | {'recall@10':>9}")
+    print("-" * 62)
+
+    def report(label, bytes_per_row, search):
+        found = [search(i, q) for i, q in enumerate(queries)]
+        print(f"{label:<38} | {bytes_per_row:>9} | {recall(found, truth):>9.3f}")
+
+    for dims in (FULL_DIMS, 1536, 768):
+        for storage, dtype, width in (("vector", np.float32, 4), ("halfvec", np.float16, 2)):
+            stored = _unit(vectors[:, :dims]).astype(dtype)
+            report(f"{storage}({dims})", width * dims + 8,
+                   lambda i, q, stored=stored, dims=dims: top_k(stored, q[:dims], K))
+
+    bits = np.packbits(vectors > 0, axis=1)
+    query_bits = np.packbits(queries > 0, axis=1)
+    report(f"bit({FULL_DIMS}) alone", FULL_DIMS // 8 + 8, lambda i, q: hamming_top_k(bits, query_bits[i], K))
+    for storage, dtype in (("vector", np.float32), ("halfvec", np.float16)):
+        stored = full.astype(dtype)
+        for candidates in RERANK_CANDIDATES:
+            def two_stage(i, q, stored=stored, candidates=candidates):
+                coarse = hamming_top_k(bits, query_bits[i], candidates)
+                return coarse[top_k(stored[coarse], q, K)]
+            report(f"bit({FULL_DIMS}) top {candidates} -> {storage}({FULL_DIMS})",
+                   FULL_DIMS // 8 + (4 if storage == "vector" else 2) * FULL_DIMS + 16, two_stage)
+    return truth
+
+# --- Postgres ---
+
+LAYOUTS = [
+    # (storage, dims, coarse index)
+    ("vector", FULL_DIMS, "ann"),
+    ("halfvec", FULL_DIMS, "ann"),
+    ("halfvec", 768, "ann"),
+    ("vector", FULL_DIMS, "binary"),
+]
+
+def load(cur, vectors, storage, dims):
+    column = f"{storage}({dims})"
+    ann = column if storage == "halfvec" or dims <= 2000 else f"halfvec({dims})"
+    cur.execute("DROP TABLE IF EXISTS bench_quant_vectors")
+    cur.execute(f"CREATE TABLE bench_quant_vectors (id int primary key, embedding {column} not null)")
+    buffer = io.BytesIO()
+    buffer.write(db._COPY_HEADER)
+    for i, vector in enumerate(vectors[:, :dims]):
+        buffer.write(struct.pack("!h", 2))
+        buffer.write(db._copy_field(struct.pack("!i", i)))
+        buffer.write(db._copy_field(db.encode_vector_binary(vector, storage)))
+    buffer.write(db._COPY_TRAILER)
+    buffer.seek(0)
+    cur.copy_expert("COPY bench_quant_vectors (id, embedding) FROM STDIN WITH (FORMAT binary)", buffer)
+    cur.execute(f"""CREATE INDEX ON bench_quant_vectors
+                    USING hnsw ((embedding::{ann}) {ann.split('(')[0]}_cosine_ops)""")
+    return column, ann
+
+def postgres(conn, vectors, queries, truth):
+    print(f"\n{'Postgres layout':<30} | {'table MB':>8} | {'stages':>13} | {'recall@10':>9} | {'p50 ms':>6} | {'p95 ms':>6}")
+    print("-" * 90)
+    with conn.cursor() as cur:
+        for storage, dims, coarse in LAYOUTS:
+            column, ann = load(cur, vectors, storage, dims)
+            coarse_order = f"embedding::{ann} <=> %(q)s::{ann}"
+            if coarse == "binary":
+                cur.execute(f"""CREATE INDEX ON bench_quant_vectors
+                                USING hnsw ((binary_quantize(embedding)::bit({dims})) bit_hamming_ops)""")
+                coarse_order = f"binary_quantize(embedding)::bit({dims}) <~> binary_quantize(%(q)s::{column})"
+            conn.commit()
+            cur.execute("SELECT pg_total_relation_size('bench_quant_vectors')")
+            size_mb = cur.fetchone()[0] / 1e6
+
+            plans = [
+                ("one", K, f"SELECT id FROM bench_quant_vectors ORDER BY {coarse_order} LIMIT {K}"),
+                (f"two (top {PG_CANDIDATES})", PG_CANDIDATES,
+                 f"""SELECT id FROM (SELECT id, embedding FROM bench_quant_vectors
+                                     ORDER BY {coarse_order} LIMIT {PG_CANDIDATES}) c
+                     ORDER BY embedding <=> %(q)s::{column} LIMIT {K}"""),
+            ]
+            for stages, candidates, query_sql in plans:
+                cur.execute(f"SET hnsw.ef_search = {max(DEFAULT_EF_SEARCH, candidates)}")
+                latencies, found = [], []
+                for q in queries:
+                    start = time.perf_counter()
+                    cur.execute(query_sql, {"q": q[:dims].tolist()})
+                    found.append(np.array([row[0] for row in cur.fetchall()]))
+                    latencies.append((time.perf_counter() - start) * 1000)
+                p50, p95 = np.percentile(latencies, [50, 95])
+                label = f"{column}" + (" + bit index" if coarse == "binary" else "")
+                print(f"{label:<30} | {size_mb:>8.1f} | {stages:>13} | {recall(found, truth):>9.3f} | "
+                      f"{p50:>6.1f} | {p95:>6.1f}")
+            conn.rollback()
+
+        cur.execute("DROP TABLE IF EXISTS bench_quant_vectors")
+        conn.commit()
+
+def main():
+    vectors, queries = synthetic_corpus(ROWS, QUERIES)
+    print(f"{ROWS} synthetic chunks, {QUERIES} queries, exact float4({FULL_DIMS}) top-{K} as ground truth\n")
+    truth = offline(vectors, queries)
+
+    if not os.getenv("DATABASE_URL") and not os.getenv("DB_HOST"):
+        print("\n(No DATABASE_URL: skipping the Postgres size/latency part)")
+        return
+    with db.db_connection() as conn:
+        if not conn:
+            sys.exit("❌ Could not connect to the database.")
+        postgres(conn, vectors, queries, truth)
+
+if __name__ == "__main__":
+    main()
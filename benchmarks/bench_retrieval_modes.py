@@ -0,0 +1,81 @@
+"""
+Benchmark: latency (and hit rate) of lexical-only, vector-only and hybrid
+retrieval through db.search_document_sections.
+
+Loads synthetic papers (benchmarks/sample_papers.py) chunked with the real
+chunker and embedded with a local hashed bag-of-words model padded to 3072
+dims, under throwaway file hashes that are deleted afterwards. Needs a
+local Postgres with pgvector and the setup_db.py schema:
+
+    DATABASE_URL=postgresql://postgres@localhost/portal_bench python benchmarks/bench_retrieval_modes.py
+"""
+import os
+import sys
+import time
+import zlib
+import re
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from sample_papers import generate_corpus  # noqa: E402
+import chunker  # noqa: E402
+import db  # noqa: E402
+
+DIMS = 3072
+PAPERS = 20
+MATCH_COUNT = 5
+WORD = re.compile(r"[a-z0-9']+")
+
+def embed(text):
+    vector = np.zeros(DIMS, dtype=np.float32)
+    for word in WORD.findall(text.lower()):
+        vector[zlib.crc32(word.encode()) % DIMS] += 1.0
+    return vector / (np.linalg.norm(vector) or 1)
+
+def main():
+    with db.db_connection() as conn:
+        if not conn:
+            sys.exit("❌ No database. Set DATABASE_URL to a Postgres with pgvector.")
+
+    papers = generate_corpus(PAPERS)
+    hashes = []
+    for paper in papers:
+        file_hash = f"bench-retrieval-{paper['year']}"
+        hashes.append(file_hash)
+        sections = [
+            (text, embed(text), start, end)
+            for text, start, end in chunker.iter_structured_chunks(paper["pages"])
+        ]
+        db.save_document_sections(file_hash, sections)
+
+    # Two kinds of question: the exact wording with its number ("Q7 ..."), and a paraphrase
+    queries = []
+    for file_hash, paper in zip(hashes, papers):
+        for q in paper["questions"]:
+            queries.append((file_hash, f"{q['number']} {q['topic']}", q["text"][:60]))
+            queries.append((file_hash, f"explain {q['topic']} please", q["text"][:60]))
+
+    try:
+        print(f"{len(queries)} queries over {PAPERS} papers\n")
+        print(f"{'mode':>8} | {'p50 ms':>7} | {'p95 ms':>7} | {'hit@5':>6}")
+        print("-" * 38)
+        for mode in db.RETRIEVAL_MODES:
+            latencies, hits = [], 0
+            for file_hash, query, expected in queries:
+                vector = embed(query).tolist()
+                start = time.perf_counter()
+                chunks = db.search_document_sections(file_hash, query, vector, mode=mode,
+                                                     match_count=MATCH_COUNT, match_threshold=0.0)
+                latencies.append((time.perf_counter() - start) * 1000)
+                hits += any(expected in c.replace("\n", " ") for c in chunks)
+            p50, p95 = np.percentile(latencies, [50, 95])
+            print(f"{mode:>8} | {p50:>7.1f} | {p95:>7.1f} | {hits / len(queries):>6.0%}")
+    finally:
+        with db.db_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("DELETE FROM document_sections WHERE file_hash = ANY(%s)", (hashes,))
+            conn.commit()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+"""
+Benchmark: cold start of the Streamlit app.
+
+  1. `python -X importtime` over what app.py imports, in fresh interpreters
+     (median of a few runs): streamlit itself, our modules on top of it, the
+     heaviest third-party packages they pull in, and which of the lazily
+     imported dependencies (numpy, pypdf, requests, httpx, asyncpg) loaded anyway.
+  2. The whole script under streamlit's AppTest, in a fresh process: the first
+     run (imports + first render, what an autoscaled container pays) and a rerun.
+
+Runs without a database or API key (the logged-out page renders either way):
+
+    python benchmarks/bench_startup.py
+"""
+import os
+import sys
+import json
+import statistics
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+APP_MODULES = ["metrics", "db", "utils", "cache", "analysis"]
+LAZY_DEPENDENCIES = ["numpy", "pypdf", "requests", "httpx", "asyncpg"]
+REPEATS = 5
+
+APP_RUN = """
+import json, sys, time
+from streamlit.testing.v1 import AppTest
+start = time.perf_counter()
+app = AppTest.from_file("app.py", default_timeout=60)
+app.run()
+first = time.perf_counter() - start
+start = time.perf_counter()
+app.run()
+print(json.dumps({"first_run_ms": first * 1000, "rerun_ms": (time.perf_counter() - start) * 1000}))
+"""
+
+def _fresh_python(code, *flags):
+    env = {**os.environ, "PYTHONDONTWRITEBYTECODE": "1"}
+    return subprocess.run([sys.executable, *flags, "-c", code], cwd=ROOT, env=env,
+                          capture_output=True, text=True, check=True)
+
+def _parse_importtime(stderr):
+    """[(depth, name, cumulative_us)] in the order -X importtime prints them"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((depth, name.strip(), int(cumulative)))
+    return rows
+
+def import_report(repeats=REPEATS):
+    """Median import times (ms) for streamlit, each app module, and the heaviest dependencies"""
+    code = "import streamlit; " + "; ".join(f"import {m}" for m in APP_MODULES) + \
+           "; import sys; print(','.join(m for m in %r if m in sys.modules))" % (LAZY_DEPENDENCIES,)
+    samples, heavy, loaded = {}, {}, set()
+    for _ in range(repeats):
+        run = _fresh_python(code, "-X", "importtime")
+        loaded.update(filter(None, run.stdout.strip().split(",")))
+        rows = _parse_importtime(run.stderr)
+        # Children are printed before their parent, so walk back from each top-level module
+        parent = None
+        for depth, name, cumulative in reversed(rows):
+            if depth == 0:
+                parent = name
+                samples.setdefault(name, []).append(cumulative / 1000)
+            elif depth == 1 and parent in APP_MODULES:
+                heavy.setdefault(name, []).append(cumulative / 1000)
+
+    report = {name: statistics.median(values) for name, values in samples.items()
+              if name == "streamlit" or name in APP_MODULES}
+    report["app_modules_total"] = sum(report.get(m, 0.0) for m in APP_MODULES)
+    dependencies = {name: statistics.median(values) for name, values in heavy.items() if name not in APP_MODULES}
+    return report, dependencies, sorted(loaded)
+
+def app_run_report():
+    return json.loads(_fresh_python(APP_RUN).stdout.strip().splitlines()[-1])
+
+def main():
+    report, dependencies, loaded = import_report()
+    print(f"Import time, median of {REPEATS} fresh interpreters (ms, cumulative)\n")
+    print(f"{'module':<24} | {'ms':>7}")
+    print("-" * 34)
+    for name in ["streamlit", *APP_MODULES, "app_modules_total"]:
+        print(f"{name:<24} | {report.get(name, 0.0):>7.1f}")
+
+    print("\nHeaviest imports made directly by app modules:")
+    for name, ms in sorted(dependencies.items(), key=lambda item: -item[1])[:8]:
+        print(f"  {name:<22} {ms:>7.1f}")
+    print(f"\nLazy dependencies loaded at startup: {', '.join(loaded) or 'none'}")
+
+    runs = app_run_report()
+    print(f"\napp.py under AppTest: first run {runs['first_run_ms']:.0f} ms, rerun {runs['rerun_ms']:.0f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+"""
+Benchmark suite: the real upload and chat code (utils.py, db.py, ingest.py)
+end to end over synthetic PDFs, against the local mock Gemini and a
+throwaway Postgres + pgvector, compared with a stored baseline.
+
+    python benchmarks/bench_suite.py                  # run and compare with benchmarks/baseline.json
+    python benchmarks/bench_suite.py --save-baseline  # run and record this machine's numbers
+    python benchmarks/bench_suite.py --ci             # as in CI: a missing baseline fails the run
+
+Reports ingest throughput (papers/min), p50/p95/p99 chat latency (embed the
+question -> hybrid search -> streamed answer), peak RSS and the app's import
+time (-X importtime, see bench_startup.py), and exits 1 when
+any of them is worse than the baseline by more than --tolerance. Baselines
+only mean something on the machine (CI runner) that recorded them.
+
+Postgres: BENCH_DATABASE_URL if set (a scratch database: its tables are
+wiped), otherwise a temporary cluster from the local initdb / pg_ctl, which
+needs pgvector installed and a non-root user. Or, with Docker:
+
+    docker run -d -p 5433:5432 -e POSTGRES_HOST_AUTH_METHOD=trust pgvector/pgvector:pg16
+    BENCH_DATABASE_URL=postgresql://postgres@localhost:5433/postgres python benchmarks/bench_suite.py
+"""
+import io
+import os
+import sys
+import glob
+import json
+import time
+import random
+import shutil
+import socket
+import argparse
+import resource
+import tempfile
+import subprocess
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from mock_gemini import start_mock_server  # noqa: E402
+from sample_papers import generate_corpus, paper_to_pdf  # noqa: E402
+from bench_startup import import_report  # noqa: E402
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json")
+# Metrics where a bigger number is better; for the rest smaller is better
+HIGHER_IS_BETTER = {"papers_per_min"}
+
+# What Supabase created before setup_db.py existed; setup_db.py adds the rest
+BASE_SCHEMA = """
+create extension if not exists vector;
+create table if not exists users (email text primary key, full_name text, xp int default 0);
+create table if not exists master_files (
+  file_hash text primary key, file_name text, created_at timestamptz default now(),
+  ai_status text, ai_analysis text, syllabus_data jsonb
+);
+"""
+RESET = """
+truncate master_files, file_owners, document_sections, file_pages, ai_cache,
+         question_clusters, question_occurrences, ingest_jobs cascade;
+"""
+
+# --- Postgres fixture ---
+
+def _pg_binary(name):
+    found = shutil.which(name)
+    if found:
+        return found
+    # Debian/Ubuntu keep the server binaries off the PATH
+    candidates = sorted(glob.glob(f"/usr/lib/postgresql/*/bin/{name}"))
+    return candidates[-1] if candidates else None
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+@contextmanager
+def local_postgres():
+    """Yields a DATABASE_URL: BENCH_DATABASE_URL, or a temporary cluster that is removed afterwards"""
+    url = os.getenv("BENCH_DATABASE_URL")
+    if url:
+        yield url
+        return
+
+    initdb, pg_ctl = _pg_binary("initdb"), _pg_binary("pg_ctl")
+    if not initdb or not pg_ctl:
+        sys.exit("❌ No initdb/pg_ctl found. Set BENCH_DATABASE_URL (see the docstring for a Docker one-liner).")
+    if hasattr(os, "geteuid") and os.geteuid() == 0:
+        sys.exit("❌ initdb refuses to run as root. Run as another user or set BENCH_DATABASE_URL.")
+
+    workdir = tempfile.mkdtemp(prefix="portal-bench-pg-")
+    data, port = os.path.join(workdir, "data"), _free_port()
+    try:
+        subprocess.run([initdb, "-D", data, "-U", "postgres", "--auth=trust", "-E", "UTF8"],
+                       check=True, capture_output=True)
+        # Durability off: this cluster lives for one run
+        subprocess.run([pg_ctl, "-D", data, "-l", os.path.join(workdir, "postgres.log"), "-w", "start",
+                        "-o", f"-p {port} -k {workdir} -c listen_addresses=127.0.0.1 "
+                              f"-c fsync=off -c synchronous_commit=off -c full_page_writes=off"],
+                       check=True, capture_output=True)
+        yield f"postgresql://postgres@127.0.0.1:{port}/postgres"
+    finally:
+        subprocess.run([pg_ctl, "-D", data, "-m", "fast", "stop"], capture_output=True)
+        shutil.rmtree(workdir, ignore_errors=True)
+
+def prepare_database(url):
+    import psycopg2
+
+    conn = psycopg2.connect(url)
+    with conn.cursor() as cur:
+        cur.execute(BASE_SCHEMA)
+    conn.commit()
+    conn.close()
+    setup = subprocess.run([sys.executable, "setup_db.py"], cwd=ROOT, capture_output=True, text=True,
+                           env={**os.environ, "DATABASE_URL": url})
+    if "❌" in setup.stdout or setup.returncode:
+        sys.exit(f"❌ setup_db.py failed:\n{setup.stdout}{setup.stderr}")
+
+# --- workloads ---
+
+def run_ingest(ingest_pdf, papers, concurrency):
+    pdfs = [(paper_to_pdf(paper), f"{paper['title']}.pdf") for paper in papers]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        file_hashes = list(executor.map(
+            lambda job: ingest_pdf(io.BytesIO(job[0]), job[1], uploaded_by="bench@example.com"), pdfs
+        ))
+    return time.perf_counter() - start, file_hashes
+
+def run_chat(file_hashes, papers, count, seed=0):
+    from utils import generate_embedding, ask_gemini_chat_stream
+    from db import search_document_sections
+
+    rng = random.Random(seed)
+    latencies = []
+    for _ in range(count):
+        index = rng.randrange(len(papers))
+        question = rng.choice(papers[index]["questions"])["text"]
+        # What the chat tab does for one question (minus the answer cache)
+        start = time.perf_counter()
+        query_vector = generate_embedding(question)
+        chunks = search_document_sections(file_hashes[index], question, query_embedding=query_vector)
+        answer = "".join(ask_gemini_chat_stream(question, chunks))
+        latencies.append((time.perf_counter() - start) * 1000)
+        assert chunks and answer, "chat returned nothing: is the index empty?"
+    return latencies
+
+def print_breakdown(paper_count):
+    """Where the time went, from the instrumentation in metrics.py"""
+    import metrics
+
+    histograms, _ = metrics.snapshot()
+    print(f"\n{'operation':<44} | {'calls':>6} | {'total s':>8} | {'p95 ms':>8}")
+    print("-" * 75)
+    for row in sorted(histograms, key=lambda r: -r["sum"]):
+        if not row["metric"].endswith("_seconds") or row["metric"] == "db_round_trip_seconds":
+            continue
+        label = row["metric"][:-len("_seconds")] + "".join(
+            f" {k}={v}" for k, v in row.items() if k not in ("metric", "count", "sum", "avg", "p50", "p95"))
+        print(f"{label:<44} | {row['count']:>6} | {row['sum']:>8.2f} | {row['p95'] * 1000:>8.1f}")
+
+    round_trips = {}
+    for row in histograms:
+        if row["metric"] == "db_round_trip_seconds":
+            round_trips[row["op"]] = round_trips.get(row["op"], 0) + row["count"]
+    print(f"\nDB round trips: {sum(round_trips.values())} "
+          f"({sum(round_trips.values()) / paper_count:.1f} per paper, chat included), by operation:")
+    for op, count in sorted(round_trips.items(), key=lambda item: -item[1]):
+        print(f"  {op:<40} {count:>6}")
+
+# --- baseline ---
+
+def compare(results, baseline, tolerance):
+    """Prints the comparison and returns the names of the regressed metrics"""
+    regressions = []
+    print(f"\n{'metric':<16} | {'baseline':>10} | {'now':>10} | {'change':>8}")
+    print("-" * 53)
+    for name, value in results.items():
+        old = baseline.get(name)
+        if not old:
+            print(f"{name:<16} | {'-':>10} | {value:>10.1f} |")
+            continue
+        change = (value - old) / old
+        worse = -change if name in HIGHER_IS_BETTER else change
+        flag = "  ❌" if worse > tolerance else ""
+        if flag:
+            regressions.append(name)
+        print(f"{name:<16} | {old:>10.1f} | {value:>10.1f} | {change:>+7.0%}{flag}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end benchmark with a regression check")
+    parser.add_argument("--papers", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4, help="papers ingested at once (like worker processes)")
+    parser.add_argument("--questions", type=int, default=50, help="chat questions, asked one after another")
+    parser.add_argument("--latency", type=float, default=0.05, help="mock Gemini seconds per request")
+    parser.add_argument("--error-rate", type=float, default=0.02, help="share of mock requests answered 429")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    parser.add_argument("--baseline", default=BASELINE_PATH)
+    parser.add_argument("--save-baseline", action="store_true")
+    # Most CI services set CI=true; there a run that can't compare must not pass
+    parser.add_argument("--ci", action="store_true", default=bool(os.getenv("CI")),
+                        help="fail when there is no baseline to compare with")
+    args = parser.parse_args()
+
+    server, base_url = start_mock_server(latency=args.latency, error_rate=args.error_rate, token_interval=0.005)
+    os.environ["GEMINI_API_BASE"] = base_url
+    os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+    config = {key: getattr(args, key) for key in ("papers", "concurrency", "questions", "latency", "error_rate")}
+
+    with local_postgres() as url:
+        os.environ["DATABASE_URL"] = url
+        prepare_database(url)
+        # Imported only now: db and utils read DATABASE_URL / GEMINI_API_BASE at import time
+        import db
+        from ingest import ingest_pdf
+
+        with db.db_connection() as conn:
+            if not conn:
+                sys.exit(f"❌ Could not connect to {url}")
+            with conn.cursor() as cur:
+                cur.execute(RESET)
+            conn.commit()
+
+        papers = generate_corpus(args.papers)
+        print(f"{args.papers} synthetic PDFs, {args.concurrency} at a time; mock Gemini at {base_url} "
+              f"({args.latency * 1000:.0f} ms/request, {args.error_rate:.0%} 429s)")
+        ingest_seconds, file_hashes = run_ingest(ingest_pdf, papers, args.concurrency)
+        latencies = run_chat(file_hashes, papers, args.questions)
+        # ru_maxrss is in KB on Linux (bytes on macOS)
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+        print_breakdown(args.papers)
+        print(f"\nMock Gemini calls: {dict(sorted(server.state.counts.items()))}")
+
+    imports, dependencies, loaded = import_report()
+    print(f"\nApp import time: {imports['app_modules_total']:.0f} ms on top of streamlit's "
+          f"{imports['streamlit']:.0f} ms; heaviest: " + ", ".join(
+              f"{name} {ms:.0f} ms" for name, ms in sorted(dependencies.items(), key=lambda item: -item[1])[:3]))
+    if loaded:
+        print(f"⚠️ Loaded at startup although imported lazily: {', '.join(loaded)}")
+
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    results = {
+        "papers_per_min": args.papers / ingest_seconds * 60,
+        "chat_p50_ms": p50, "chat_p95_ms": p95, "chat_p99_ms": p99,
+        "peak_rss_mb": peak_rss,
+        "app_import_ms": imports["app_modules_total"],
+    }
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({"config": config, "results": results}, f, indent=2)
+        compare(results, {}, args.tolerance)
+        print(f"\n✅ Baseline saved to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        compare(results, {}, args.tolerance)
+        if args.ci:
+            sys.exit(f"\n❌ No baseline at {args.baseline}: record one on the CI runner with --save-baseline")
+        print(f"\nNo baseline at {args.baseline}; record one with --save-baseline.")
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline["config"] != config:
+        sys.exit(f"❌ Baseline was recorded with {baseline['config']}, this run used {config}")
+
+    regressions = compare(results, baseline["results"], args.tolerance)
+    if regressions:
+        print(f"\n❌ Regressed by more than {args.tolerance:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+    print(f"\n✅ Within {args.tolerance:.0%} of the baseline")
+
+if __name__ == "__main__":
+    main()
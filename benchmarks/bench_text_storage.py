@@ -0,0 +1,122 @@
+"""
+Benchmark: raw text as JSON inside master_files.syllabus_data (the old layout)
+vs. compressed per-page rows in file_pages. Reports table sizes, the cost of a
+`SELECT *` over the metadata table, and fetching one paper / one page.
+
+Runs on scratch copies of both layouts, so the real tables are untouched.
+Needs a local Postgres (14+ for lz4):
+
+    DATABASE_URL=postgresql://postgres@localhost/portal_bench python benchmarks/bench_text_storage.py
+
+Note: the synthetic papers repeat a lot of filler, so they compress better
+than real scans would; compare the latencies more than the ratio.
+"""
+import os
+import sys
+import json
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from psycopg2.extras import execute_values  # noqa: E402
+import db  # noqa: E402
+from sample_papers import generate_paper  # noqa: E402
+
+PAPER_COUNT = 300
+REPEATS = 20
+
+SCHEMA = """
+drop table if exists bench_master_old, bench_master_new, bench_file_pages;
+
+create table bench_master_old (
+  file_hash text primary key, file_name text, created_at timestamptz default now(),
+  ai_status text, syllabus_data jsonb
+);
+create table bench_master_new (
+  file_hash text primary key, file_name text, created_at timestamptz default now(), ai_status text
+);
+create table bench_file_pages (
+  file_hash text not null, page_number int not null, content text not null,
+  primary key (file_hash, page_number)
+) with (toast_tuple_target = 256);
+alter table bench_file_pages alter column content set storage main;
+do $$
+begin
+  alter table bench_file_pages alter column content set compression lz4;
+exception when others then
+  raise notice 'lz4 not available';
+end;
+$$;
+"""
+
+def load(cur, papers):
+    for i, paper in enumerate(papers):
+        file_hash = f"bench-{i:05d}"
+        text = "".join(page for _, page in paper["pages"])
+        cur.execute(
+            "INSERT INTO bench_master_old (file_hash, file_name, ai_status, syllabus_data) VALUES (%s, %s, 'ready', %s)",
+            (file_hash, paper["title"], json.dumps({"content": text}))
+        )
+        cur.execute(
+            "INSERT INTO bench_master_new (file_hash, file_name, ai_status) VALUES (%s, %s, 'ready')",
+            (file_hash, paper["title"])
+        )
+        execute_values(
+            cur, "INSERT INTO bench_file_pages (file_hash, page_number, content) VALUES %s",
+            [(file_hash, number, page) for number, page in paper["pages"]]
+        )
+
+def timed(cur, query, args=()):
+    start = time.perf_counter()
+    for _ in range(REPEATS):
+        cur.execute(query, args)
+        cur.fetchall()
+    return (time.perf_counter() - start) / REPEATS * 1000
+
+def size(cur, table):
+    # Heap + TOAST + indexes
+    cur.execute("SELECT pg_total_relation_size(%s)", (table,))
+    return cur.fetchone()[0]
+
+def main():
+    with db.db_connection() as conn:
+        if not conn:
+            sys.exit("❌ No database. Set DATABASE_URL to a Postgres.")
+
+        papers = [generate_paper(2000 + i % 25, seed=i, questions_per_section=8) for i in range(PAPER_COUNT)]
+        with conn.cursor() as cur:
+            cur.execute(SCHEMA)
+            load(cur, papers)
+            conn.commit()
+            cur.execute("ANALYZE bench_master_old; ANALYZE bench_master_new; ANALYZE bench_file_pages;")
+
+            raw = sum(len("".join(p for _, p in paper["pages"]).encode()) for paper in papers)
+            old_size = size(cur, "bench_master_old")
+            new_meta, new_pages = size(cur, "bench_master_new"), size(cur, "bench_file_pages")
+            print(f"{PAPER_COUNT} papers, {raw / 1e6:.1f} MB of raw text\n")
+            print(f"old master_files (text inside):   {old_size / 1e6:7.2f} MB")
+            print(f"new master_files (metadata only): {new_meta / 1e6:7.2f} MB")
+            print(f"new file_pages (compressed):      {new_pages / 1e6:7.2f} MB\n")
+
+            target = "bench-00042"
+            rows = [
+                ("SELECT * over the metadata table",
+                 timed(cur, "SELECT * FROM bench_master_old"),
+                 timed(cur, "SELECT * FROM bench_master_new")),
+                ("one paper's full text",
+                 timed(cur, "SELECT syllabus_data->>'content' FROM bench_master_old WHERE file_hash = %s", (target,)),
+                 timed(cur, "SELECT string_agg(content, '' ORDER BY page_number) FROM bench_file_pages "
+                            "WHERE file_hash = %s", (target,))),
+                ("one page of one paper",
+                 timed(cur, "SELECT syllabus_data->>'content' FROM bench_master_old WHERE file_hash = %s", (target,)),
+                 timed(cur, "SELECT content FROM bench_file_pages WHERE file_hash = %s AND page_number = 2", (target,))),
+            ]
+            print(f"{'query':<34} | {'old (ms)':>8} | {'new (ms)':>8}")
+            print("-" * 57)
+            for label, old, new in rows:
+                print(f"{label:<34} | {old:>8.2f} | {new:>8.2f}")
+
+            cur.execute("drop table if exists bench_master_old, bench_master_new, bench_file_pages")
+            conn.commit()
+
+if __name__ == "__main__":
+    main()
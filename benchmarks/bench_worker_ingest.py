@@ -0,0 +1,108 @@
+"""
+Benchmark: a big (60+ page) PDF going through the ingest worker, where page
+extraction runs on a process pool inside the worker process.
+
+Part 1 needs no database: page extraction in a spawned worker-style process,
+daemonic (serial fallback) and not (process pool, as worker.py starts them).
+Part 2 queues the PDF in ingest_jobs and lets run_worker process it, against
+a local mock Gemini, then removes the job and the file again:
+
+    DATABASE_URL=postgresql://postgres@localhost/portal_bench python benchmarks/bench_worker_ingest.py
+"""
+import os
+import sys
+import time
+import multiprocessing
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from mock_gemini import start_mock_server  # noqa: E402
+from sample_papers import generate_corpus, paper_to_pdf  # noqa: E402
+
+server, base_url = start_mock_server(latency=0.05, stream_chunks=40, token_interval=0)
+# Spawned processes inherit these
+os.environ["GEMINI_API_BASE"] = base_url
+os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+
+USER = "bench-worker@example.com"
+FILE_NAME = "bench-question-bank.pdf"
+TIMEOUT = 300
+
+def question_bank(papers=24):
+    """Several years' papers in one PDF, like an uploaded question bank"""
+    pages = [text for paper in generate_corpus(papers) for _, text in paper["pages"]]
+    return paper_to_pdf({"pages": list(enumerate(pages, start=1))})
+
+def _extract(pdf_bytes, results):
+    import io
+    from utils import iter_pdf_pages
+
+    start = time.perf_counter()
+    try:
+        pages = sum(1 for _ in iter_pdf_pages(io.BytesIO(pdf_bytes)))
+        results.put((pages, time.perf_counter() - start, None))
+    except Exception as e:
+        results.put((0, time.perf_counter() - start, f"{type(e).__name__}: {e}"))
+
+def bench_extraction(pdf_bytes):
+    ctx = multiprocessing.get_context("spawn")
+    print(f"{'process':>12} | {'pages':>5} | {'seconds':>7} | error")
+    print("-" * 48)
+    for daemon in (True, False):
+        results = ctx.Queue()
+        process = ctx.Process(target=_extract, args=(pdf_bytes, results), daemon=daemon)
+        process.start()
+        pages, seconds, error = results.get(timeout=TIMEOUT)
+        process.join()
+        print(f"{'daemonic' if daemon else 'worker.py':>12} | {pages:>5} | {seconds:>7.2f} | {error or '-'}")
+        assert not error, "page extraction must work in either kind of process"
+
+def cleanup(db):
+    with db.db_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM ingest_jobs WHERE created_by = %s", (USER,))
+            hashes = "SELECT file_hash FROM file_owners WHERE user_email = %s"
+            for table in ("document_sections", "file_pages", "question_occurrences", "master_files"):
+                cur.execute(f"DELETE FROM {table} WHERE file_hash IN ({hashes})", (USER,))
+            cur.execute("DELETE FROM file_owners WHERE user_email = %s", (USER,))
+        conn.commit()
+
+def bench_worker(pdf_bytes):
+    import db
+    from worker import run_worker
+
+    with db.db_connection() as conn:
+        if not conn:
+            print("\n(no database: set DATABASE_URL to run the job through run_worker)")
+            return
+    cleanup(db)
+
+    ctx = multiprocessing.get_context("spawn")
+    # Started the way worker.main() starts its workers
+    process = ctx.Process(target=run_worker, args=("bench-worker", 0.2))
+    process.start()
+    try:
+        start = time.perf_counter()
+        job_id = db.enqueue_ingest_job(FILE_NAME, pdf_bytes, USER)
+        while time.perf_counter() - start < TIMEOUT:
+            job = next(j for j in db.get_ingest_jobs(USER) if j['id'] == job_id)
+            if job['status'] in ('done', 'failed'):
+                break
+            time.sleep(0.2)
+        seconds = time.perf_counter() - start
+        print(f"\nrun_worker: job {job_id} {job['status']} after {seconds:.2f}s"
+              + (f" ({job['error']})" if job['error'] else ""))
+        assert job['status'] == 'done', "a 40+ page PDF must ingest through the worker"
+    finally:
+        process.terminate()
+        process.join()
+        cleanup(db)
+    print(f"Mock Gemini calls: {dict(sorted(server.state.counts.items()))}")
+
+def main():
+    pdf_bytes = question_bank()
+    print(f"Question bank PDF: {len(pdf_bytes) // 1024} KB\n")
+    bench_extraction(pdf_bytes)
+    bench_worker(pdf_bytes)
+
+if __name__ == "__main__":
+    main()
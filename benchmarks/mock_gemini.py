@@ -0,0 +1,131 @@
+"""
+A tiny local stand-in for the Gemini REST API, so benchmarks never touch the
+real service (or our quota).
+
+    server, base_url = start_mock_server(latency=0.05, error_rate=0.1)
+    os.environ["GEMINI_API_BASE"] = base_url   # before importing utils
+
+Endpoints: embedContent, batchEmbedContents, generateContent and
+streamGenerateContent (SSE, `stream_chunks` events `token_interval` apart).
+`latency` is added to every request (so it is also the time to first token), `per_item_latency` once per text in a batch, and
+`error_rate` is the share of requests answered with 429, and `tail_rate` the
+share that take an extra `tail_latency` (a slow replica, for hedging).
+Generation answers carry usageMetadata (prompt tokens ~ characters / 4).
+"""
+import json
+import random
+import hashlib
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class MockGeminiState:
+    def __init__(self, latency=0.05, per_item_latency=0.002, error_rate=0.0, dims=3072, seed=0,
+                 stream_chunks=20, token_interval=0.01, tail_rate=0.0, tail_latency=1.0):
+        self.latency = latency
+        self.tail_rate = tail_rate
+        self.tail_latency = tail_latency
+        self.stream_chunks = stream_chunks
+        self.token_interval = token_interval
+        self.per_item_latency = per_item_latency
+        self.error_rate = error_rate
+        self.dims = dims
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    def count(self, endpoint):
+        with self.lock:
+            self.counts[endpoint] = self.counts.get(endpoint, 0) + 1
+
+    def should_throttle(self):
+        with self.lock:
+            return self.random.random() < self.error_rate
+
+    def extra_latency(self):
+        with self.lock:
+            return self.tail_latency if self.random.random() < self.tail_rate else 0.0
+
+    def vector(self, text):
+        # Deterministic per text, so repeated runs embed identically
+        rng = random.Random(hashlib.md5(text.encode()).hexdigest())
+        return [rng.uniform(-1, 1) for _ in range(self.dims)]
+
+def _make_handler(state):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def log_message(self, *args):
+            pass
+
+        def _send(self, status, body):
+            payload = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def _stream(self, usage):
+            # Server-sent events, one JSON candidate per "data:" line, chunked encoding
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for i in range(state.stream_chunks):
+                if i:
+                    threading.Event().wait(state.token_interval)
+                event = {"candidates": [{"content": {"parts": [{"text": f"token{i} "}]}}]}
+                if i == state.stream_chunks - 1:
+                    event["usageMetadata"] = usage
+                frame = f"data: {json.dumps(event)}\r\n\r\n".encode()
+                self.wfile.write(f"{len(frame):x}\r\n".encode() + frame + b"\r\n")
+            self.wfile.write(b"0\r\n\r\n")
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length", 0))
+            body = json.loads(self.rfile.read(length) or b"{}")
+            endpoint = self.path.split("?")[0].rsplit(":", 1)[-1]
+            state.count(endpoint)
+
+            threading.Event().wait(state.latency + state.extra_latency())
+            if state.should_throttle():
+                state.count("throttled")
+                return self._send(429, {"error": {"code": 429, "status": "RESOURCE_EXHAUSTED"}})
+
+            if endpoint == "embedContent":
+                text = body["content"]["parts"][0]["text"]
+                dims = body.get("outputDimensionality")
+                return self._send(200, {"embedding": {"values": state.vector(text)[:dims]}})
+
+            if endpoint == "batchEmbedContents":
+                requests = body["requests"]
+                threading.Event().wait(state.per_item_latency * len(requests))
+                return self._send(200, {"embeddings": [
+                    {"values": state.vector(r["content"]["parts"][0]["text"])[:r.get("outputDimensionality")]}
+                    for r in requests
+                ]})
+
+            prompt_chars = sum(len(part.get("text", "")) for content in body.get("contents", [])
+                               for part in content.get("parts", []))
+            if endpoint == "generateContent":
+                return self._send(200, {
+                    "candidates": [{"content": {"parts": [{"text": "Mock analysis."}]}}],
+                    "usageMetadata": {"promptTokenCount": prompt_chars // 4, "candidatesTokenCount": 3},
+                })
+
+            if endpoint == "streamGenerateContent":
+                return self._stream({"promptTokenCount": prompt_chars // 4,
+                                     "candidatesTokenCount": state.stream_chunks})
+
+            self._send(404, {"error": {"code": 404, "message": f"unknown endpoint {endpoint}"}})
+
+    return Handler
+
+def start_mock_server(host="127.0.0.1", port=0, **options):
+    """Starts the mock on a background thread. Returns (server, base_url); server.state holds the counters."""
+    state = MockGeminiState(**options)
+    server = ThreadingHTTPServer((host, port), _make_handler(state))
+    server.daemon_threads = True
+    server.state = state
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://{host}:{server.server_address[1]}"
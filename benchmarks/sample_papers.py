@@ -0,0 +1,114 @@
+"""
+Synthetic previous-year exam papers for the benchmarks: sections, numbered
+questions with sub-parts and marks, spread over pages like pypdf output.
+Questions repeat across years on purpose (as they do in real papers).
+
+    papers = generate_corpus(5)
+    papers[0]["pages"]      # [(page_number, text), ...]
+    papers[0]["questions"]  # [{"number": "Q3", "text": "...", "topic": "..."}, ...]
+    paper_to_pdf(papers[0])  # the same pages as a real (text-layer) PDF file, as bytes
+"""
+import random
+import textwrap
+
+SUBJECT = "Data Structures and Algorithms"
+TOPICS = [
+    "Dijkstra's shortest path algorithm", "AVL tree rotations", "B-tree insertion",
+    "quicksort partitioning", "merge sort", "heap sort", "hashing with open addressing",
+    "Kruskal's minimum spanning tree", "Prim's algorithm", "topological sorting",
+    "dynamic programming for the knapsack problem", "Floyd-Warshall all pairs shortest paths",
+    "red-black tree properties", "breadth first search", "depth first search",
+    "circular queues", "infix to postfix conversion using a stack", "binary search trees",
+    "amortized analysis of dynamic arrays", "Huffman coding", "trie data structures",
+    "the master theorem", "radix sort", "graph colouring with backtracking",
+]
+TEMPLATES = [
+    "Explain {topic} with a suitable example.",
+    "Write an algorithm for {topic} and analyse its time complexity.",
+    "Discuss the advantages and limitations of {topic}.",
+    "Illustrate {topic} step by step on the input 12, 7, 25, 3, 18, 9.",
+    "Compare {topic} with {other} in terms of time and space.",
+]
+SUBPARTS = [
+    "Define the key terms used in {topic}.",
+    "Give the worst case input for {topic} and justify it.",
+    "State one real-world application of {topic}.",
+]
+FILLER = (
+    "Candidates are required to give their answers in their own words as far as practicable. "
+    "Assume suitable data wherever necessary and state the assumptions clearly. "
+)
+PAGE_CHARS = 1800
+
+def _question(rng, number, topic, marks):
+    other = rng.choice([t for t in TOPICS if t != topic])
+    text = rng.choice(TEMPLATES).format(topic=topic, other=other)
+    lines = [f"Q{number}. {text} [{marks} marks]"]
+    if rng.random() < 0.5:
+        for label, template in zip("abc", rng.sample(SUBPARTS, rng.randint(2, 3))):
+            lines.append(f"({label}) {template.format(topic=topic)}")
+    return lines, " ".join(lines)
+
+def _paginate(lines):
+    pages, page, size = [], [], 0
+    for line in lines:
+        if size + len(line) > PAGE_CHARS and page:
+            pages.append("\n".join(page) + "\n")
+            page, size = [], 0
+        page.append(line)
+        size += len(line) + 1
+    if page:
+        pages.append("\n".join(page) + "\n")
+    return list(enumerate(pages, start=1))
+
+def generate_paper(year, seed=0, questions_per_section=5):
+    rng = random.Random(f"{seed}-{year}")
+    lines = [f"{SUBJECT} - End Semester Examination {year}", "Time: 3 Hours  Maximum Marks: 70", FILLER * 2]
+    questions, number = [], 1
+    # A core of topics shows up most years; the rest vary
+    core = TOPICS[:8]
+    for section, marks in (("A", 5), ("B", 10), ("C", 15)):
+        lines.append(f"SECTION {section}")
+        lines.append(f"Attempt any {questions_per_section - 1} questions. {FILLER}")
+        pool = core if section != "C" and rng.random() < 0.6 else TOPICS
+        for topic in rng.sample(pool, questions_per_section):
+            question_lines, text = _question(rng, number, topic, marks)
+            lines.extend(question_lines)
+            questions.append({"number": f"Q{number}", "text": text, "topic": topic, "year": year})
+            number += 1
+    return {"title": f"DSA {year}", "year": year, "pages": _paginate(lines), "questions": questions}
+
+def generate_corpus(count=5, first_year=2019, seed=0):
+    return [generate_paper(first_year + i, seed=seed) for i in range(count)]
+
+def _pdf_string(text):
+    escaped = text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+    return "(" + escaped.encode("latin-1", "replace").decode("latin-1") + ")"
+
+def paper_to_pdf(paper, line_width=95):
+    """
+    A minimal PDF (Helvetica text, one content stream per page) with the paper's
+    pages, so benchmarks exercise pypdf the way an uploaded file does. Extracted
+    text has the same words, re-wrapped at `line_width` characters.
+    """
+    objects = ["<< /Type /Catalog /Pages 2 0 R >>", None, "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>"]
+    page_refs = []
+    for _, text in paper["pages"]:
+        lines = [wrapped for line in text.splitlines() for wrapped in textwrap.wrap(line, line_width) or [""]]
+        stream = "BT /F1 9 Tf 11 TL 40 800 Td " + " ".join(f"{_pdf_string(line)} Tj T*" for line in lines) + " ET"
+        objects.append(f"<< /Length {len(stream.encode('latin-1'))} >>\nstream\n{stream}\nendstream")
+        objects.append(f"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] "
+                       f"/Resources << /Font << /F1 3 0 R >> >> /Contents {len(objects)} 0 R >>")
+        page_refs.append(f"{len(objects)} 0 R")
+    objects[1] = f"<< /Type /Pages /Kids [{' '.join(page_refs)}] /Count {len(page_refs)} >>"
+
+    out = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(out))
+        out += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(out)
+    out += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    out += "".join(f"{offset:010d} 00000 n \n" for offset in offsets).encode()
+    out += f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n".encode()
+    return bytes(out)
@@ -0,0 +1,355 @@
+import os
+import re
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+import streamlit as st
+from psycopg2.extras import RealDictCursor, execute_values
+from db import db_connection, text_hash
+from utils import ask_gemini, ask_gemini_stream, CHAT_MODEL, EMBEDDING_MODEL, EMBEDDING_DIMS
+
+# Bump this whenever ingest.ANALYSIS_PROMPT changes, so old
+# analyses stop matching instead of being served for the new prompt.
+ANALYSIS_PROMPT_VERSION = "v2"
+
+# LRU bound for the ai_cache table: least recently used rows beyond this are evicted
+CACHE_MAX_ROWS = int(os.getenv("AI_CACHE_MAX_ROWS", "50000"))
+# Eviction is a DELETE over the table, so only run it every N writes
+EVICT_EVERY_N_WRITES = 50
+
+# Process-wide hit/miss counters (shared by every Streamlit session)
+_stats_lock = threading.Lock()
+_stats = {
+    "analysis": {"hits": 0, "misses": 0},
+    "embedding": {"hits": 0, "misses": 0},
+}
+_writes_since_evict = 0
+
+def make_cache_key(kind, content_hash, model, version=""):
+    """Content hash + model + prompt version -> one stable key"""
+    return hashlib.sha256(f"{kind}|{model}|{version}|{content_hash}".encode()).hexdigest()
+
+def _count(kind, hits=0, misses=0):
+    with _stats_lock:
+        _stats.setdefault(kind, {"hits": 0, "misses": 0})
+        _stats[kind]["hits"] += hits
+        _stats[kind]["misses"] += misses
+
+EVICT_SQL = f"""DELETE FROM ai_cache WHERE cache_key IN (
+                   SELECT cache_key FROM ai_cache ORDER BY last_used_at DESC OFFSET {CACHE_MAX_ROWS}
+               )"""
+
+def _evict_due():
+    global _writes_since_evict
+    with _stats_lock:
+        _writes_since_evict += 1
+        if _writes_since_evict < EVICT_EVERY_N_WRITES:
+            return False
+        _writes_since_evict = 0
+    return True
+
+def _lookup(keys, column):
+    """Fetch cached values for many keys in one query and mark them as recently used"""
+    with db_connection() as conn:
+        if not conn: return {}
+
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(
+                f"""UPDATE ai_cache SET last_used_at = now(), hit_count = hit_count + 1
+                    WHERE cache_key = ANY(%s) RETURNING cache_key, {column}""",
+                (list(keys),)
+            )
+            rows = cur.fetchall()
+            conn.commit()
+    return {r['cache_key']: r[column] for r in rows}
+
+def _store(rows, column):
+    """rows: list of (cache_key, kind, value)"""
+    if not rows: return
+    with db_connection() as conn:
+        if not conn: return
+
+        with conn.cursor() as cur:
+            execute_values(
+                cur,
+                f"""INSERT INTO ai_cache (cache_key, kind, {column}) VALUES %s
+                    ON CONFLICT (cache_key) DO UPDATE SET last_used_at = now()""",
+                rows
+            )
+            if _evict_due():
+                cur.execute(EVICT_SQL)
+            conn.commit()
+
+async def _lookup_async(keys, column):
+    """_lookup over the asyncpg pool"""
+    from async_io import get_async_pool
+
+    pool = await get_async_pool()
+    if not pool: return {}
+    rows = await pool.fetch(
+        f"""UPDATE ai_cache SET last_used_at = now(), hit_count = hit_count + 1
+            WHERE cache_key = ANY($1::text[]) RETURNING cache_key, {column}""",
+        list(keys)
+    )
+    return {r['cache_key']: r[column] for r in rows}
+
+async def _store_async(rows, column):
+    """_store over the asyncpg pool"""
+    from async_io import get_async_pool
+
+    if not rows: return
+    pool = await get_async_pool()
+    if not pool: return
+    async with pool.acquire() as conn:
+        async with conn.transaction():
+            await conn.executemany(
+                f"""INSERT INTO ai_cache (cache_key, kind, {column}) VALUES ($1, $2, $3)
+                    ON CONFLICT (cache_key) DO UPDATE SET last_used_at = now()""",
+                rows
+            )
+            if _evict_due():
+                await conn.execute(EVICT_SQL)
+
+# --- PUBLIC API ---
+
+def cached_analysis(content_hash, prompt, on_partial=None):
+    """
+    Returns the Gemini analysis for this content, only calling Gemini when
+    this (content, model, prompt version) has never been analysed before.
+    With `on_partial`, the answer is streamed and on_partial(text_so_far) is
+    called as it grows.
+    """
+    key = make_cache_key("analysis", content_hash, CHAT_MODEL, ANALYSIS_PROMPT_VERSION)
+    cached = _lookup([key], "value_text").get(key)
+    if cached is not None:
+        _count("analysis", hits=1)
+        return cached
+
+    _count("analysis", misses=1)
+    if on_partial:
+        pieces = []
+        for piece in ask_gemini_stream(prompt, label="analysis"):
+            pieces.append(piece)
+            on_partial("".join(pieces))
+        response = "".join(pieces)
+    else:
+        response = ask_gemini(prompt)
+    # Failures raise GeminiError before this point, so they are never cached
+    if response:
+        _store([(key, "analysis", response)], "value_text")
+    return response
+
+def cached_text(kind, content_hash, version, compute):
+    """
+    Generic text cache: returns the stored value for (kind, content, model,
+    version) or calls compute() and stores its result (an exception stores nothing).
+    """
+    key = make_cache_key(kind, content_hash, CHAT_MODEL, version)
+    cached = _lookup([key], "value_text").get(key)
+    if cached is not None:
+        _count(kind, hits=1)
+        return cached
+
+    _count(kind, misses=1)
+    value = compute()
+    if value:
+        _store([(key, kind, value)], "value_text")
+    return value
+
+async def cached_embeddings_async(chunks):
+    """
+    Same contract as utils.generate_embeddings, but chunks we've embedded before
+    (in this paper or any other) come from the cache. Only misses hit the API.
+    Runs on async_io's loop: cache rows over asyncpg, misses over the async client.
+    """
+    import numpy as np
+    from async_io import gemini
+
+    chunks = list(chunks)
+    # Truncated (Matryoshka) embeddings get their own keys; full-size keys are unchanged
+    dims = "" if EMBEDDING_DIMS == 3072 else f"dims={EMBEDDING_DIMS}"
+    keys = [make_cache_key("embedding", text_hash(c), EMBEDDING_MODEL, dims) for c in chunks]
+    found = await _lookup_async(set(keys), "value_vector")
+
+    # Unique misses only: the same chunk twice in one paper is embedded once
+    missing = {}
+    for key, chunk in zip(keys, chunks):
+        if key not in found and key not in missing:
+            missing[key] = chunk
+    _count("embedding", hits=len(chunks) - len(missing), misses=len(missing))
+
+    fresh = {}
+    if missing:
+        vectors = await gemini().embed_many(list(missing.values()))
+        fresh = {k: v for k, v in zip(missing.keys(), vectors) if v}
+        await _store_async(
+            [(k, "embedding", np.asarray(v, dtype=np.float32).tobytes()) for k, v in fresh.items()],
+            "value_vector"
+        )
+
+    results = []
+    for key in keys:
+        if key in fresh:
+            results.append(fresh[key])
+        elif key in found:
+            results.append(np.frombuffer(found[key], dtype=np.float32).tolist())
+        else:
+            results.append(None)
+    return results
+
+def get_cache_stats():
+    """Hit/miss counters for this process, plus what the cache table holds overall"""
+    with _stats_lock:
+        stats = {kind: dict(counts) for kind, counts in _stats.items()}
+
+    with db_connection() as conn:
+        if conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute(
+                    "SELECT kind, count(*) AS entries, sum(hit_count) AS total_hits FROM ai_cache GROUP BY kind"
+                )
+                for row in cur.fetchall():
+                    stats.setdefault(row['kind'], {"hits": 0, "misses": 0})
+                    stats[row['kind']]["entries"] = row['entries']
+                    stats[row['kind']]["total_hits"] = int(row['total_hits'] or 0)
+    return stats
+
+# --- SEMANTIC CHAT CACHE ---
+# In-process (shared by every session via st.cache_resource): students keep asking
+# the same few questions about the same paper, so answer those from memory.
+
+CHAT_CACHE_SIMILARITY = float(os.getenv("CHAT_CACHE_SIMILARITY", "0.92"))
+CHAT_CACHE_TTL = float(os.getenv("CHAT_CACHE_TTL", "3600"))
+CHAT_CACHE_MAX_ENTRIES = int(os.getenv("CHAT_CACHE_MAX_ENTRIES", "2000"))
+
+def normalize_question(question):
+    """'  What are the TOP 5 questions?? ' and 'what are the top 5 questions' share a key"""
+    return re.sub(r"\s+", " ", question.lower()).strip().rstrip("?!. ")
+
+class SemanticChatCache:
+    """
+    Per-scope cache of (question -> retrieved chunks + answer); a scope is a
+    file_hash or one of app.py's "library:..." keys.
+    Lookups go exact text first (no embedding call needed), then cosine
+    similarity of the question embedding against earlier questions.
+    Entries expire after `ttl` seconds; beyond `max_entries` the least
+    recently used go first.
+    Each entry also carries the scope's `version` (db.get_library_version)
+    from when it was stored; a lookup with a different version misses. That
+    is what retires answers when another process (worker.py, reindex.py)
+    changes a paper, since invalidate() only reaches this process.
+    """
+
+    def __init__(self, threshold=CHAT_CACHE_SIMILARITY, ttl=CHAT_CACHE_TTL, max_entries=CHAT_CACHE_MAX_ENTRIES):
+        self.threshold = threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # (file_hash, normalized question) -> entry, in LRU order
+        self._entries = OrderedDict()
+        # file_hash -> (keys, unit-vector matrix) for the similarity scan, rebuilt lazily
+        self._matrices = {}
+        self.stats = {"exact_hits": 0, "semantic_hits": 0, "misses": 0}
+
+    def _expired(self, entry, version=None):
+        if version is not None and entry["version"] != version:
+            return True
+        return time.monotonic() - entry["created"] > self.ttl
+
+    def _drop(self, key):
+        self._entries.pop(key, None)
+        self._matrices.pop(key[0], None)
+
+    def _hit(self, key, kind):
+        self._entries.move_to_end(key)
+        self.stats[kind] += 1
+        return self._entries[key]
+
+    def get_exact(self, file_hash, question, version=None):
+        key = (file_hash, normalize_question(question))
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and not self._expired(entry, version):
+                return self._hit(key, "exact_hits")
+            if entry:
+                self._drop(key)
+            return None
+
+    def get_similar(self, file_hash, query_vector, version=None):
+        """Closest earlier question about this file, if it is within the threshold"""
+        import numpy as np
+
+        with self._lock:
+            cached = self._matrices.get(file_hash)
+            if cached is None:
+                keys = [k for k, e in self._entries.items() if k[0] == file_hash and not self._expired(e)]
+                if keys:
+                    cached = (keys, np.stack([self._entries[k]["vector"] for k in keys]))
+                    self._matrices[file_hash] = cached
+
+            if cached is not None:
+                keys, matrix = cached
+                scores = matrix @ _unit(query_vector)
+                # Expired, stale (or evicted) rows can't win, so they don't hide a valid runner-up
+                for i, key in enumerate(keys):
+                    entry = self._entries.get(key)
+                    if entry is None or self._expired(entry, version):
+                        scores[i] = -np.inf
+                best = int(np.argmax(scores))
+                if scores[best] >= self.threshold:
+                    return self._hit(keys[best], "semantic_hits")
+
+            self.stats["misses"] += 1
+            return None
+
+    def put(self, file_hash, question, query_vector, chunks, answer, version=None):
+        key = (file_hash, normalize_question(question))
+        with self._lock:
+            self._entries[key] = {
+                "vector": _unit(query_vector),
+                "chunks": chunks,
+                "answer": answer,
+                "version": version,
+                "created": time.monotonic(),
+            }
+            self._entries.move_to_end(key)
+            self._matrices.pop(file_hash, None)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+
+    def invalidate(self, file_hash):
+        """
+        Forget everything about a file (e.g. after it is re-indexed): its own
+        scope, the paper sets that include it, and every whole-library scope.
+        Only this process's cache; other processes are covered by the version.
+        """
+        def affected(scope_key):
+            if scope_key == file_hash:
+                return True
+            return scope_key.startswith("library:") and (file_hash in scope_key or scope_key.endswith(":*"))
+
+        with self._lock:
+            for key in [k for k in self._entries if affected(k[0])]:
+                del self._entries[key]
+            for scope_key in [k for k in self._matrices if affected(k)]:
+                del self._matrices[scope_key]
+
+    def clear(self):
+        """Forget everything (e.g. after the library is wiped)"""
+        with self._lock:
+            self._entries.clear()
+            self._matrices.clear()
+
+def _unit(vector):
+    import numpy as np
+
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+@st.cache_resource(show_spinner=False)
+def get_chat_cache():
+    """One chat cache per process, shared across sessions and reruns"""
+    return SemanticChatCache()
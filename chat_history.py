@@ -0,0 +1,144 @@
+"""
+Conversation memory for the chat tab: what a follow-up question carries of
+the earlier turns, at a bounded size.
+
+Messages are stored per (student, search scope) in chat_messages. A prompt
+gets the rolling summary from chat_sessions plus at most CHAT_WINDOW_TOKENS of
+messages: the newest turns word for word, then what fell out of that window
+but isn't summarised yet, cut down to the space left. Once CHAT_SUMMARY_EVERY
+messages have fallen out of the window they are folded into the summary (one
+LLM call per batch, not per turn, off the request path), so prompt size stays
+flat however long the conversation gets.
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from db import add_chat_messages, get_chat_messages, get_chat_session, save_chat_summary
+from utils import ask_gemini, GeminiError
+from chunker import estimate_tokens
+import metrics
+from metrics import timed
+
+# Recent turns sent word for word
+CHAT_WINDOW_TOKENS = int(os.getenv("CHAT_WINDOW_TOKENS", "1500"))
+# Part of the window kept for messages not yet folded into the summary
+PENDING_SHARE = 0.25
+# Fold messages into the summary once this many sit outside the window
+CHAT_SUMMARY_EVERY = int(os.getenv("CHAT_SUMMARY_EVERY", "6"))
+CHAT_SUMMARY_WORDS = 200
+# Upper bound on what one prompt build reads, should summarising keep failing
+MAX_UNSUMMARIZED = 60
+
+SUMMARY_PROMPT = """
+You keep a running summary of a tutoring conversation between a student and an AI tutor about exam papers.
+
+CURRENT SUMMARY:
+{summary}
+
+NEW MESSAGES:
+{transcript}
+
+Rewrite the summary so it also covers the new messages, in at most {words} words of plain text:
+the topics and questions discussed, what was explained, and anything the student found difficult
+or asked to focus on. Keep details a follow-up question might refer back to (question numbers, terms).
+"""
+
+def _format(messages):
+    return "\n".join(f"{m['role'].upper()}: {m['content']}" for m in messages)
+
+def _clip(messages, budget):
+    """The newest messages that fit in `budget` tokens, the oldest of them cut short if needed"""
+    kept = []
+    for message in reversed(messages):
+        if budget <= 0:
+            break
+        tokens = estimate_tokens(message['content'])
+        if tokens > budget:
+            # estimate_tokens counts ~4 characters per token
+            message = {**message, "content": message['content'][:budget * 4].rstrip() + " …"}
+        kept.append(message)
+        budget -= tokens
+    return kept[::-1]
+
+def split_window(messages, budget=CHAT_WINDOW_TOKENS):
+    """(older, recent): the newest messages that fit in `budget` tokens, and the rest"""
+    used, start = 0, len(messages)
+    for i in range(len(messages) - 1, -1, -1):
+        used += estimate_tokens(messages[i]['content'])
+        if used > budget and start < len(messages):
+            break
+        start = i
+    return messages[:start], messages[start:]
+
+def load_context(user_email, scope_key):
+    """
+    What the prompt carries for a new question: {"summary", "recent", "pending"},
+    where pending are the messages outside the window not yet in the summary.
+    """
+    session = get_chat_session(user_email, scope_key)
+    unsummarized = get_chat_messages(user_email, scope_key, after_id=session['summarized_through'],
+                                     limit=MAX_UNSUMMARIZED)
+    pending, recent = split_window(unsummarized, int(CHAT_WINDOW_TOKENS * (1 - PENDING_SHARE)))
+    return {"summary": session['summary'], "recent": recent, "pending": pending}
+
+def format_history(context):
+    """The conversation section of the tutor prompt ("" for a first question)"""
+    parts = []
+    if context['summary']:
+        parts.append(f"EARLIER IN THIS CONVERSATION (summary):\n{context['summary']}")
+    # Not yet folded into the summary: still sent (newest first, as far as the
+    # window allows), so nothing drops out in between
+    window = _clip(context['pending'] + context['recent'], CHAT_WINDOW_TOKENS)
+    if window:
+        parts.append(f"RECENT MESSAGES:\n{_format(window)}")
+    return "\n\n".join(parts)
+
+@timed("chat_summarize")
+def update_summary(user_email, scope_key):
+    """
+    Run after a turn is stored: folds the pending messages into the rolling
+    summary once enough have piled up. Returns True if it did.
+    """
+    context = load_context(user_email, scope_key)
+    pending = context['pending']
+    if len(pending) < CHAT_SUMMARY_EVERY:
+        return False
+    prompt = SUMMARY_PROMPT.format(summary=context['summary'] or "(none yet)", transcript=_format(pending),
+                                   words=CHAT_SUMMARY_WORDS)
+    try:
+        summary = ask_gemini(prompt).strip()
+    except GeminiError as e:
+        # The messages stay pending (and in the prompt); the next turn tries again
+        print(f"❌ Chat summary failed: {e}")
+        metrics.record_error("chat_summarize", e)
+        return False
+    return save_chat_summary(user_email, scope_key, summary, pending[-1]['id'])
+
+def record_turn(user_email, scope_key, question, answer):
+    """Stores a question and its answer; returns the stored rows for the on-screen history"""
+    return add_chat_messages(user_email, scope_key, [("user", question), ("assistant", answer)])
+
+# Summaries are written in the background: the LLM call shouldn't hold up the chat
+_summary_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix="chat-summary")
+_summarizing = set()
+_summarizing_lock = threading.Lock()
+
+def schedule_summary(user_email, scope_key):
+    """update_summary on a background thread (at most one queued per conversation)"""
+    key = (user_email, scope_key)
+    with _summarizing_lock:
+        if key in _summarizing:
+            return
+        _summarizing.add(key)
+
+    def run():
+        try:
+            update_summary(user_email, scope_key)
+        except Exception as e:
+            # Already counted in errors_total by @timed; the next turn schedules it again
+            print(f"❌ Chat summary failed: {e}")
+        finally:
+            with _summarizing_lock:
+                _summarizing.discard(key)
+
+    _summary_pool.submit(run)
@@ -0,0 +1,179 @@
+"""
+Splitting extracted exam-paper text into chunks for embedding.
+
+Both chunkers take the (page_number, text) stream from utils.iter_pdf_pages
+and yield (chunk, page_start, page_end) as soon as each chunk is complete.
+"""
+import os
+import re
+
+# Token budget per chunk (estimated, see estimate_tokens)
+CHUNK_MAX_TOKENS = int(os.getenv("CHUNK_MAX_TOKENS", "300"))
+# Tokens repeated at the start of the next chunk when a long question has to be cut
+CHUNK_OVERLAP_TOKENS = int(os.getenv("CHUNK_OVERLAP_TOKENS", "30"))
+# Don't start a new chunk at a question boundary until the current one has this many tokens
+CHUNK_MIN_TOKENS = int(os.getenv("CHUNK_MIN_TOKENS", "50"))
+
+FIXED_CHUNK_SIZE = 1000
+
+# "SECTION A", "PART - B", "UNIT III", "Module 2:"
+SECTION_PATTERN = re.compile(r"^(?:SECTION|PART|UNIT|MODULE)\b\s*[-–:]?\s*[A-Z0-9IVX]+\b", re.IGNORECASE)
+# "Q1", "Q.7", "Q 3(b)", "Question 4", "5.", "5)"
+QUESTION_PATTERN = re.compile(r"^(?:Q(?:uestion)?\s*\.?\s*\d+|\d{1,2}\s*[.)](?!\d))", re.IGNORECASE)
+# Sub-parts stay with their question: "(b)", "b)", "(iv)"
+SUBPART_PATTERN = re.compile(r"^(?:\(?[a-h]\)|\([ivx]{1,4}\))", re.IGNORECASE)
+SENTENCE_END = re.compile(r"(?<=[.?!;:])\s+")
+
+def estimate_tokens(text):
+    """Cheap token estimate (~4 chars per token for English), good enough for budgeting"""
+    return max(1, (len(text) + 3) // 4)
+
+def iter_fixed_chunks(pages, size=FIXED_CHUNK_SIZE):
+    """
+    The original splitter: every `size` characters of the joined text,
+    regardless of where questions start or end.
+    """
+    buffer, buffer_page = "", None
+    last_page = None
+    for page_number, text in pages:
+        last_page = page_number
+        if not text:
+            continue
+        if not buffer:
+            buffer_page = page_number
+        buffer += text
+
+        pos = 0
+        while len(buffer) - pos >= size:
+            yield buffer[pos:pos + size], buffer_page, page_number
+            pos += size
+            buffer_page = page_number
+        buffer = buffer[pos:]
+
+    if buffer:
+        yield buffer, buffer_page, last_page
+
+def _line_kind(line):
+    if SECTION_PATTERN.match(line):
+        return "section"
+    if QUESTION_PATTERN.match(line):
+        return "question"
+    if SUBPART_PATTERN.match(line):
+        return "subpart"
+    return None
+
+def iter_blocks(pages):
+    """
+    Groups lines into blocks: a block starts at a section heading, a question
+    number, a sub-part label or after a blank line. Yields
+    (kind, text, page_start, page_end) where kind is 'section', 'question',
+    'subpart' or 'text'.
+    """
+    kind, lines, page_start, page_end = "text", [], None, None
+    for page_number, text in pages:
+        for line in (text or "").splitlines():
+            stripped = line.strip()
+            line_kind = _line_kind(stripped) if stripped else None
+            # A blank line or a new heading/question closes the current block
+            if (not stripped or line_kind) and lines:
+                yield kind, " ".join(lines), page_start, page_end
+                kind, lines = "text", []
+            if not stripped:
+                continue
+            if not lines:
+                kind, page_start = line_kind or "text", page_number
+            lines.append(stripped)
+            page_end = page_number
+    if lines:
+        yield kind, " ".join(lines), page_start, page_end
+
+def _split_oversized(text, max_tokens, count_tokens):
+    """Cuts a block that alone blows the budget at sentence ends (words, if a sentence is huge)"""
+    if count_tokens(text) <= max_tokens:
+        yield text
+        return
+
+    piece = ""
+    for sentence in SENTENCE_END.split(text):
+        if count_tokens(sentence) > max_tokens:
+            if piece:
+                yield piece
+                piece = ""
+            words = sentence.split()
+            for word in words:
+                candidate = f"{piece} {word}" if piece else word
+                if piece and count_tokens(candidate) > max_tokens:
+                    yield piece
+                    candidate = word
+                piece = candidate
+            continue
+        candidate = f"{piece} {sentence}" if piece else sentence
+        if piece and count_tokens(candidate) > max_tokens:
+            yield piece
+            candidate = sentence
+        piece = candidate
+    if piece:
+        yield piece
+
+def _overlap_tail(text, overlap_tokens, count_tokens):
+    """The last ~overlap_tokens worth of words of a chunk"""
+    if overlap_tokens <= 0:
+        return ""
+    tail = []
+    for word in reversed(text.split()):
+        if count_tokens(" ".join([word] + tail)) > overlap_tokens:
+            break
+        tail.insert(0, word)
+    return " ".join(tail)
+
+def iter_structured_chunks(pages, max_tokens=CHUNK_MAX_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS,
+                           min_tokens=CHUNK_MIN_TOKENS, count_tokens=estimate_tokens):
+    """
+    Structure-aware splitter for exam papers: a new chunk starts at every
+    section heading, and at question numbers once the current chunk holds
+    `min_tokens` (sub-parts stay with their question where the budget allows).
+    Chunks never exceed `max_tokens`; when a long question has to be cut on
+    budget, the next chunk repeats its last `overlap_tokens`.
+    """
+    parts, pages_seen, tokens = [], [], 0
+    # True once the chunk holds something beyond the overlap carried over
+    has_new = False
+
+    def emit():
+        return "\n".join(parts), min(pages_seen), max(pages_seen)
+
+    # Pieces of an oversized block leave room for the overlap in front of them
+    piece_budget = max(max_tokens - overlap_tokens, 1)
+
+    for kind, block, page_start, page_end in iter_blocks(pages):
+        budget = piece_budget if count_tokens(block) > max_tokens else max_tokens
+        for index, piece in enumerate(_split_oversized(block, budget, count_tokens)):
+            piece_tokens = count_tokens(piece)
+            # Split pieces of a long block can't tell which page they came from; use the block's range
+            page = (page_start, page_end)
+            if index == 0 and (kind == "section" or (kind == "question" and tokens >= min_tokens)):
+                # Structural boundary: clean cut, no overlap needed
+                if has_new:
+                    yield emit()
+                parts, pages_seen, tokens, has_new = [], [], 0, False
+            elif parts and tokens + piece_tokens > max_tokens:
+                # Budget cut in the middle of something: carry a little context over
+                if has_new:
+                    chunk = emit()
+                    yield chunk
+                    tail = _overlap_tail(chunk[0], overlap_tokens, count_tokens)
+                    parts, pages_seen = ([tail], [chunk[2]]) if tail else ([], [])
+                else:
+                    parts, pages_seen = [], []
+                tokens = sum(count_tokens(p) for p in parts)
+                has_new = False
+                if tokens + piece_tokens > max_tokens:
+                    parts, pages_seen, tokens = [], [], 0
+
+            parts.append(piece)
+            pages_seen.extend(page)
+            tokens += piece_tokens
+            has_new = True
+
+    if has_new:
+        yield emit()
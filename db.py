@@ -1,178 +1,891 @@
+import io
 import os
+import time
+import struct
+import hashlib
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
 import psycopg2
-from psycopg2.extras import RealDictCursor
+from psycopg2 import pool as pg_pool
+from psycopg2.extensions import connection as pg_connection, cursor as pg_cursor
+from psycopg2.extras import RealDictCursor, execute_values
 from dotenv import load_dotenv
-import json
 import streamlit as st
+import metrics
+from metrics import timed
 
 # 1. Load keys (Try local .env first)
 load_dotenv()
 
-def get_db_connection():
+# Pool sizing. POOL_MIN_CONN connections are opened up front; the pool grows
+# on demand up to POOL_MAX_CONN and keeps every one of them open once made.
+POOL_MIN_CONN = int(os.getenv("DB_POOL_MIN", "2"))
+POOL_MAX_CONN = int(os.getenv("DB_POOL_MAX", "10"))
+# How long a caller waits for a free connection before giving up (seconds)
+POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+# Connections idle for longer than this are pinged before being handed out
+POOL_IDLE_CHECK_SECONDS = float(os.getenv("DB_POOL_IDLE_CHECK", "30"))
+
+def get_database_settings():
+    """Works out how to connect: Cloud Link (DATABASE_URL) first, then the local DB_* vars"""
+    # 1. First, check if we have a Cloud Link (Supabase) from .env
+    database_url = os.getenv("DATABASE_URL")
+
+    # 2. If that failed, try Streamlit Cloud Secrets
+    if not database_url:
+        try:
+            database_url = st.secrets["DATABASE_URL"]
+        except:
+            pass
+
+    if database_url:
+        return {"dsn": database_url}
+
+    # 3. If no Cloud Link, try the old Local way (Fallback)
+    return {
+        "dbname": os.getenv("DB_NAME"),
+        "user": os.getenv("DB_USER"),
+        "password": os.getenv("DB_PASSWORD"),
+        "host": os.getenv("DB_HOST"),
+        "port": os.getenv("DB_PORT"),
+    }
+
+class _CountingCursorMixin:
+    """Counts every round trip (and its latency) against the timed() operation that is running"""
+
+    def _round_trip(self, name, send, *args):
+        op = metrics.current_op()
+        start = time.perf_counter()
+        try:
+            return send(*args)
+        finally:
+            metrics.observe("db_round_trip_seconds", time.perf_counter() - start, op=op, call=name)
+
+    def execute(self, query, vars=None):
+        return self._round_trip("execute", super().execute, query, vars)
+
+    def executemany(self, query, vars_list):
+        return self._round_trip("executemany", super().executemany, query, vars_list)
+
+    def copy_expert(self, sql, file, size=8192):
+        if isinstance(file, io.BytesIO):
+            metrics.observe("db_copy_bytes", file.getbuffer().nbytes, buckets=metrics.SIZE_BUCKETS,
+                            op=metrics.current_op())
+        return self._round_trip("copy", super().copy_expert, sql, file, size)
+
+class _CountingCursor(_CountingCursorMixin, pg_cursor):
+    pass
+
+class _CountingRealDictCursor(_CountingCursorMixin, RealDictCursor):
+    pass
+
+_COUNTING_CURSORS = {None: _CountingCursor, pg_cursor: _CountingCursor, RealDictCursor: _CountingRealDictCursor}
+
+class InstrumentedConnection(pg_connection):
+    """Hands out cursors that feed db_round_trip_seconds; unknown cursor factories pass through"""
+
+    def cursor(self, *args, **kwargs):
+        factory = kwargs.get("cursor_factory") or self.cursor_factory
+        kwargs["cursor_factory"] = _COUNTING_CURSORS.get(factory, factory)
+        return super().cursor(*args, **kwargs)
+
+class HealthCheckedPool(pg_pool.ThreadedConnectionPool):
+    """
+    Thread-safe pool that waits (instead of erroring) when every connection is
+    borrowed, and swaps out connections whose socket has gone stale.
+    """
+
+    def __init__(self, minconn, maxconn, *args, **kwargs):
+        self._slots = threading.BoundedSemaphore(maxconn)
+        self._last_used = {}
+        super().__init__(minconn, maxconn, *args, **kwargs)
+        # psycopg2 closes a returned connection once `minconn` sit idle, so a
+        # burst above it would reconnect every time; keep up to maxconn instead
+        self.minconn = maxconn
+
+    def borrow(self, timeout=POOL_TIMEOUT):
+        if not self._slots.acquire(timeout=timeout):
+            raise pg_pool.PoolError(f"no free connection after {timeout}s")
+        try:
+            conn = self.getconn()
+            if not self._is_healthy(conn):
+                # Stale socket (Supabase idle timeout, network blip...): reconnect
+                self._forget(conn)
+                self.putconn(conn, close=True)
+                conn = self.getconn()
+            return conn
+        except Exception:
+            self._slots.release()
+            raise
+
+    def give_back(self, conn, discard=False):
+        try:
+            discard = discard or bool(conn.closed)
+            self.putconn(conn, close=discard)
+            if conn.closed:
+                self._forget(conn)
+            else:
+                self._last_used[id(conn)] = time.monotonic()
+        finally:
+            self._slots.release()
+
+    def _connect(self, key=None):
+        # Every new physical connection (warm-up, growth, stale replacement)
+        with timed("db_connect"):
+            return super()._connect(key)
+
+    def _forget(self, conn):
+        self._last_used.pop(id(conn), None)
+
+    def _is_healthy(self, conn):
+        if conn.closed:
+            return False
+        last_used = self._last_used.get(id(conn))
+        if last_used is not None and time.monotonic() - last_used < POOL_IDLE_CHECK_SECONDS:
+            return True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("SELECT 1")
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+@st.cache_resource(show_spinner=False)
+def _create_connection_pool():
+    # Raising here (instead of returning None) stops Streamlit caching a failed pool
+    return HealthCheckedPool(POOL_MIN_CONN, POOL_MAX_CONN, connection_factory=InstrumentedConnection,
+                             **get_database_settings())
+
+def get_connection_pool():
+    """One pool per process, shared by every session and every rerun"""
     try:
-        # 1. First, check if we have a Cloud Link (Supabase) from .env
-        database_url = os.getenv("DATABASE_URL")
-        
-        # 2. If that failed, try Streamlit Cloud Secrets
-        if not database_url:
-            try:
-                database_url = st.secrets["DATABASE_URL"]
-            except:
-                pass
-        
-        if database_url:
-            return psycopg2.connect(database_url)
-            
-        # 2. If no Cloud Link, try the old Local way (Fallback)
-        else:
-            return psycopg2.connect(
-                dbname=os.getenv("DB_NAME"),
-                user=os.getenv("DB_USER"),
-                password=os.getenv("DB_PASSWORD"),
-                host=os.getenv("DB_HOST"),
-                port=os.getenv("DB_PORT")
-            )
+        return _create_connection_pool()
     except Exception as e:
         print(f"❌ Connection Error: {e}")
         return None
 
-# ... (The rest of your functions: login_user, save_file_record etc. are fine!) ...
+@contextmanager
+def db_connection():
+    """
+    Borrows a connection from the pool and always hands it back, even if the
+    block raises. Yields None when the database is unreachable.
+    """
+    db_pool = get_connection_pool()
+    conn = None
+    if db_pool:
+        try:
+            with timed("db_pool_wait"):
+                conn = db_pool.borrow()
+        except Exception as e:
+            print(f"❌ Connection Error: {e}")
+
+    if conn is None:
+        yield None
+        return
+
+    discard = False
+    try:
+        yield conn
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        # The socket itself is broken, don't put it back in the pool
+        discard = True
+        raise
+    except Exception:
+        if not conn.closed:
+            conn.rollback()
+        raise
+    finally:
+        db_pool.give_back(conn, discard=discard)
 
 # --- NEW FUNCTIONS FOR THE APP ---
 
 def login_user(email):
     """Simple login: If email exists, return user. If not, create new one."""
-    conn = get_db_connection()
-    if not conn: return None
-    
-    with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        # 1. Check if user exists
-        cur.execute("SELECT * FROM users WHERE email = %s", (email,))
-        user = cur.fetchone()
-        
-        if not user:
-            # 2. Create new user if not found
-            cur.execute(
-                "INSERT INTO users (email, full_name, xp) VALUES (%s, %s, %s) RETURNING *",
-                (email, email.split('@')[0], 0)
-            )
+    with db_connection() as conn:
+        if not conn: return None
+
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            # 1. Check if user exists
+            cur.execute("SELECT * FROM users WHERE email = %s", (email,))
             user = cur.fetchone()
-            conn.commit()
-            
-    conn.close()
+
+            if not user:
+                # 2. Create new user if not found
+                cur.execute(
+                    "INSERT INTO users (email, full_name, xp) VALUES (%s, %s, %s) RETURNING *",
+                    (email, email.split('@')[0], 0)
+                )
+                user = cur.fetchone()
+                conn.commit()
+
     return user
 
-def save_file_record(file_hash, filename, text_content):
-    """Saves the file record to the DB"""
-    conn = get_db_connection()
-    if not conn: return False
-
-    with conn.cursor() as cur:
-        # Check for duplicates
-        cur.execute("SELECT file_hash FROM master_files WHERE file_hash = %s", (file_hash,))
-        if cur.fetchone():
-            return True 
-
-        # FIX: Wrap the raw text in a real JSON object
-        json_data = json.dumps({"content": text_content})
-
-        cur.execute(
-            """INSERT INTO master_files (file_hash, file_name, syllabus_data, ai_status) 
-               VALUES (%s, %s, %s, 'completed')""",
-            (file_hash, filename, json_data) # Now sending valid JSON
-        )
-        conn.commit()
-    conn.close()
+@timed("save_file_record")
+def save_file_record(file_hash, filename, pages, uploaded_by=None):
+    """
+    Saves the file record to the DB. `pages` is [(page_number, text), ...];
+    the text goes to file_pages, so master_files stays small.
+    """
+    with db_connection() as conn:
+        if not conn: return False
+
+        with conn.cursor() as cur:
+            # Every uploader owns the paper, also when it was stored before
+            if uploaded_by:
+                cur.execute(
+                    "INSERT INTO file_owners (file_hash, user_email) VALUES (%s, %s) ON CONFLICT DO NOTHING",
+                    (file_hash, uploaded_by)
+                )
+
+            # Check for duplicates
+            cur.execute("SELECT file_hash FROM master_files WHERE file_hash = %s", (file_hash,))
+            if cur.fetchone():
+                conn.commit()
+                return True
+
+            cur.execute(
+                """INSERT INTO master_files (file_hash, file_name, ai_status, uploaded_by) 
+                   VALUES (%s, %s, 'uploaded', %s)""",
+                (file_hash, filename, uploaded_by)
+            )
+            execute_values(
+                cur,
+                "INSERT INTO file_pages (file_hash, page_number, content) VALUES %s ON CONFLICT DO NOTHING",
+                [(file_hash, page_number, text) for page_number, text in pages],
+                page_size=200
+            )
+            conn.commit()
     return True
 
-def get_all_files():
-    """Fetch all uploaded files to show in the UI"""
-    conn = get_db_connection()
-    if not conn: return []
-    with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute("SELECT * FROM master_files ORDER BY created_at DESC")
-        files = cur.fetchall()
-    conn.close()
+# Only what the library list needs: ai_analysis stays in the table until
+# someone actually opens a file (the raw text lives in file_pages).
+FILE_LIST_COLUMNS = "m.file_hash, m.file_name, m.created_at, m.ai_status, m.uploaded_by"
+
+def list_files(uploaded_by=None, after=None, limit=20):
+    """
+    One page of the library, newest first, metadata columns only. With
+    uploaded_by, that student's papers, newest upload first (created_at is
+    then when they uploaded it).
+    Keyset pagination: pass the (created_at, file_hash) of the last row you got as `after`.
+    """
+    if uploaded_by:
+        # Sorted (and paged) by when this student uploaded it, off idx_file_owners_listing
+        key, source = "o", "file_owners o JOIN master_files m ON m.file_hash = o.file_hash"
+        conditions, params = ["o.user_email = %s"], [uploaded_by]
+    else:
+        key, source, conditions, params = "m", "master_files m", [], []
+    if after:
+        conditions.append(f"({key}.created_at, {key}.file_hash) < (%s, %s)")
+        params.extend(after)
+    where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    with db_connection() as conn:
+        if not conn: return []
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(
+                f"""SELECT {FILE_LIST_COLUMNS.replace("m.created_at", f"{key}.created_at")} FROM {source} {where}
+                    ORDER BY {key}.created_at DESC, {key}.file_hash DESC LIMIT %s""",
+                params + [limit]
+            )
+            files = cur.fetchall()
     return files
 
+def count_files(uploaded_by=None):
+    """Number of files in the library (or uploaded by one user)"""
+    with db_connection() as conn:
+        if not conn: return 0
+        with conn.cursor() as cur:
+            if uploaded_by:
+                cur.execute("SELECT count(*) FROM file_owners WHERE user_email = %s", (uploaded_by,))
+            else:
+                cur.execute("SELECT count(*) FROM master_files")
+            total = cur.fetchone()[0]
+    return total
+
+def get_file_analysis(file_hash):
+    """
+    Fetch one file's AI analysis (only when the user opens it). None until the
+    analysis has completed: while it streams, ai_analysis holds partial text.
+    """
+    with db_connection() as conn:
+        if not conn: return None
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT ai_analysis FROM master_files WHERE file_hash = %s AND ai_status = 'completed'",
+                (file_hash,)
+            )
+            result = cur.fetchone()
+    return result[0] if result else None
+
+def get_file_names(file_hashes):
+    """file_hash -> file_name for a set of files"""
+    with db_connection() as conn:
+        if not conn: return {}
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT file_hash, file_name FROM master_files WHERE file_hash = ANY(%s)",
+                (list(file_hashes),)
+            )
+            names = dict(cur.fetchall())
+    return names
+
 def update_ai_analysis(file_hash, analysis_text):
-    """Updates the database with the AI's generated report"""
-    conn = get_db_connection()
-    if not conn: return False
-    
-    with conn.cursor() as cur:
-        cur.execute(
-            "UPDATE master_files SET ai_analysis = %s, ai_status = 'analyzed' WHERE file_hash = %s",
-            (analysis_text, file_hash)
-        )
-        conn.commit()
-    conn.close()
+    """Updates the database with the AI's generated report and marks it completed"""
+    with db_connection() as conn:
+        if not conn: return False
+
+        with conn.cursor() as cur:
+            cur.execute(
+                "UPDATE master_files SET ai_analysis = %s, ai_status = 'completed' WHERE file_hash = %s",
+                (analysis_text, file_hash)
+            )
+            conn.commit()
+    return True
+
+def save_partial_analysis(file_hash, partial_text):
+    """Stores the analysis while it is still streaming in, without touching ai_status"""
+    with db_connection() as conn:
+        if not conn: return False
+
+        with conn.cursor() as cur:
+            cur.execute("UPDATE master_files SET ai_analysis = %s WHERE file_hash = %s", (partial_text, file_hash))
+            conn.commit()
+    return True
+
+def fail_analysis(file_hash):
+    """The analysis stream broke off: drop the partial text and mark the paper failed"""
+    with db_connection() as conn:
+        if not conn: return False
+
+        with conn.cursor() as cur:
+            cur.execute(
+                "UPDATE master_files SET ai_analysis = NULL, ai_status = 'failed' WHERE file_hash = %s",
+                (file_hash,)
+            )
+            conn.commit()
     return True
 
 def get_leaderboard():
     """Fetch top 10 students by XP"""
-    conn = get_db_connection()
-    if not conn: return []
-    
-    with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        # Get top 10 users, sorted by XP (Highest first)
-        cur.execute("SELECT full_name, xp FROM users ORDER BY xp DESC LIMIT 10")
-        leaders = cur.fetchall()
-    conn.close()
+    with db_connection() as conn:
+        if not conn: return []
+
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            # Get top 10 users, sorted by XP (Highest first); served by idx_users_xp
+            cur.execute("SELECT full_name, xp FROM users ORDER BY xp DESC NULLS LAST, email LIMIT 10")
+            leaders = cur.fetchall()
     return leaders
 
-def get_file_content(file_hash):
-    """Fetch the raw text content of a file for the Chatbot"""
-    conn = get_db_connection()
-    if not conn: return None
-    
-    with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        cur.execute("SELECT syllabus_data FROM master_files WHERE file_hash = %s", (file_hash,))
-        result = cur.fetchone()
-        
-    conn.close()
-    
-    if result and result['syllabus_data']:
-        # The text is stored inside a JSON object: {"content": "..."}
-        data = result['syllabus_data']
-        # Handle cases where it might be a string or a dict depending on how it was saved
-        if isinstance(data, str):
-            import json
-            data = json.loads(data)
-        return data.get("content", "")
-    return None
+def get_xp_rank(xp):
+    """
+    Global rank for an XP value: 1 + number of users with more XP (ties share
+    a rank). Reads the trigger-maintained xp_buckets, so the cost doesn't grow
+    with the number of users. Returns {"rank", "total"} or None.
+    """
+    with db_connection() as conn:
+        if not conn: return None
+
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(
+                """SELECT (coalesce(sum(user_count) FILTER (WHERE xp > %s), 0) + 1)::bigint AS rank,
+                          coalesce(sum(user_count), 0)::bigint AS total
+                   FROM xp_buckets""",
+                (xp or 0,)
+            )
+            return cur.fetchone()
+
+# Rows pulled per round trip when streaming pages from a server-side cursor
+PAGE_FETCH_SIZE = 20
+
+def iter_file_pages(file_hash, pages=None):
+    """
+    Yields (page_number, text) in page order, `PAGE_FETCH_SIZE` rows at a time,
+    so a long paper never sits in memory twice. `pages` limits it to those
+    page numbers (files migrated from syllabus_data only have page 0).
+    """
+    with db_connection() as conn:
+        if not conn: return
+
+        # A named cursor keeps the result on the server and fetches it in batches
+        with conn.cursor(name=f"file_pages_{file_hash[:16]}") as cur:
+            cur.itersize = PAGE_FETCH_SIZE
+            cur.execute(
+                """SELECT page_number, content FROM file_pages
+                   WHERE file_hash = %s AND (%s::int[] IS NULL OR page_number = ANY(%s::int[]))
+                   ORDER BY page_number""",
+                (file_hash, list(pages) if pages else None, list(pages) if pages else None)
+            )
+            for page_number, content in cur:
+                yield page_number, content
+
+@timed("get_file_content")
+def get_file_content(file_hash, pages=None):
+    """Fetch the raw text content of a file (or only `pages` of it)"""
+    with db_connection() as conn:
+        if not conn: return None
+
+        with conn.cursor() as cur:
+            # Joined in the database: one round trip, one string
+            cur.execute(
+                """SELECT string_agg(content, '' ORDER BY page_number) FROM file_pages
+                   WHERE file_hash = %s AND (%s::int[] IS NULL OR page_number = ANY(%s::int[]))""",
+                (file_hash, list(pages) if pages else None, list(pages) if pages else None)
+            )
+            result = cur.fetchone()
+    return result[0] if result else None
+
+# --- EMBEDDING LAYOUT ---
+# Must match what setup_db.py built: after changing these, re-run setup_db.py, then reindex.py.
+# EMBEDDING_DIMS: Matryoshka size requested from gemini-embedding-001 (3072, 1536 or 768).
+# EMBEDDING_STORAGE: "vector" (float4, 4 bytes/dim) or "halfvec" (float2, 2 bytes/dim).
+EMBEDDING_DIMS = int(os.getenv("EMBEDDING_DIMS", "3072"))
+EMBEDDING_STORAGE = os.getenv("EMBEDDING_STORAGE", "vector").lower()
+EMBEDDING_TYPE = f"{EMBEDDING_STORAGE}({EMBEDDING_DIMS})"
+# The ANN index is built on embedding::ANN_TYPE. pgvector indexes vector up to
+# 2000 dims and halfvec up to 4000, so full-size float4 vectors are indexed as halfvec.
+ANN_TYPE = EMBEDDING_TYPE if EMBEDDING_STORAGE == "halfvec" or EMBEDDING_DIMS <= 2000 else f"halfvec({EMBEDDING_DIMS})"
+# Two-stage search: this many coarse candidates (ANN / binary index) are re-ranked
+# on the stored precision, in every vector search (plain, hybrid and library-wide).
+# 0 = only as many candidates as the search returns (or fuses), still re-ranked.
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "0"))
+
+# --- BINARY COPY HELPERS ---
+# COPY ... (FORMAT binary) framing: signature, flags, header extension length
+_COPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack("!ii", 0, 0)
+_COPY_TRAILER = struct.pack("!h", -1)
+
+def encode_vector_binary(embedding, storage="vector"):
+    """
+    pgvector's binary wire format: int16 dims, int16 unused, then big-endian
+    float4s (vector) or float2s (halfvec).
+    """
+    import numpy as np
+
+    values = np.asarray(embedding, dtype=">f2" if storage == "halfvec" else ">f4")
+    return struct.pack("!hh", values.shape[0], 0) + values.tobytes()
+
+def decode_vector_binary(data, storage="vector"):
+    """Inverse of encode_vector_binary (e.g. for vector_send(embedding) results)"""
+    import numpy as np
+
+    return np.frombuffer(bytes(data), dtype=">f2" if storage == "halfvec" else ">f4", offset=4).astype(np.float32)
 
+def _copy_field(data):
+    return struct.pack("!i", len(data)) + data
+
+_COPY_NULL = struct.pack("!i", -1)
+
+def _copy_int_field(value):
+    return _COPY_NULL if value is None else _copy_field(struct.pack("!i", value))
+
+def text_hash(text):
+    """sha256 of a chunk: identifies it in document_sections and in the AI cache"""
+    return hashlib.sha256(text.encode()).hexdigest()
+
+def _build_sections_copy(file_hash, sections):
+    """
+    Builds one binary COPY payload holding every section row. A section is
+    (content, embedding) or (content, embedding, page_start, page_end).
+    """
+    hash_field = _copy_field(file_hash.encode())
+    buffer = io.BytesIO()
+    buffer.write(_COPY_HEADER)
+    for content, embedding, *pages in sections:
+        page_start, page_end = pages or (None, None)
+        buffer.write(struct.pack("!h", 6))
+        buffer.write(hash_field)
+        buffer.write(_copy_field(content.encode()))
+        buffer.write(_copy_field(text_hash(content).encode()))
+        buffer.write(_copy_field(encode_vector_binary(embedding, EMBEDDING_STORAGE)))
+        buffer.write(_copy_int_field(page_start))
+        buffer.write(_copy_int_field(page_end))
+    buffer.write(_COPY_TRAILER)
+    buffer.seek(0)
+    return buffer
+
+def get_section_hashes(file_hash):
+    """content_hash -> how many of this file's sections have that content"""
+    with db_connection() as conn:
+        if not conn: return None
+        with conn.cursor() as cur:
+            cur.execute(
+                "SELECT content_hash, count(*) FROM document_sections WHERE file_hash = %s GROUP BY content_hash",
+                (file_hash,)
+            )
+            return dict(cur.fetchall())
+
+@timed("save_document_sections")
 def save_document_sections(file_hash, sections):
-    """Saves chunks and their embeddings to the document_sections table"""
-    conn = get_db_connection()
-    if not conn: return False
-    
-    with conn.cursor() as cur:
-        # Clear existing sections for this hash to avoid duplicates if re-indexed
-        cur.execute("DELETE FROM document_sections WHERE file_hash = %s", (file_hash,))
-        
-        for content, embedding in sections:
-            cur.execute(
-                "INSERT INTO document_sections (file_hash, content, embedding) VALUES (%s, %s, %s)",
-                (file_hash, content, embedding)
-            )
-        conn.commit()
-    conn.close()
-    return True
+    """
+    Makes the stored sections of a file match `sections`, in one transaction:
+    chunks already stored keep their row and embedding (only the pages are
+    refreshed), chunks that are gone are deleted, and new chunks go over in a
+    single binary COPY. The embedding may be None for a chunk that is already
+    stored. Returns {"kept", "inserted", "deleted", "skipped"}.
+    """
+    with db_connection() as conn:
+        if not conn: return None
+
+        with conn.cursor() as cur:
+            # Two re-indexes of the same file must not diff against each other's half-done work
+            cur.execute("SELECT pg_advisory_xact_lock(hashtext(%s))", (file_hash,))
+            cur.execute("SELECT id, content_hash FROM document_sections WHERE file_hash = %s", (file_hash,))
+            stored = defaultdict(list)
+            for section_id, content_hash in cur.fetchall():
+                stored[content_hash].append(section_id)
+
+            kept, inserts, skipped = [], [], 0
+            for content, embedding, *pages in sections:
+                page_start, page_end = pages or (None, None)
+                ids = stored.get(text_hash(content))
+                if ids:
+                    kept.append((ids.pop(), page_start, page_end))
+                elif embedding is not None:
+                    inserts.append((content, embedding, page_start, page_end))
+                else:
+                    skipped += 1
+            stale = [section_id for ids in stored.values() for section_id in ids]
 
-def match_document_sections(file_hash, query_embedding, match_threshold=0.3, match_count=5):
-    """Performs vector search using the match_document_sections RPC function"""
-    conn = get_db_connection()
-    if not conn: return []
-    
-    with conn.cursor(cursor_factory=RealDictCursor) as cur:
-        # Calling the RPC function with explicit type casts to avoid AmbiguousFunction error
-        cur.execute(
-            "SELECT content, similarity FROM match_document_sections(%s::vector(3072), %s::float, %s::int, %s::text)",
-            (query_embedding, match_threshold, match_count, file_hash)
-        )
-        results = cur.fetchall()
-    conn.close()
+            if stale:
+                cur.execute("DELETE FROM document_sections WHERE id = ANY(%s::uuid[])", (stale,))
+            if kept:
+                execute_values(
+                    cur,
+                    """UPDATE document_sections d SET page_start = v.page_start, page_end = v.page_end
+                       FROM (VALUES %s) AS v (id, page_start, page_end)
+                       WHERE d.id = v.id
+                         AND (d.page_start, d.page_end) IS DISTINCT FROM (v.page_start, v.page_end)""",
+                    kept, template="(%s::uuid, %s::int, %s::int)", page_size=500
+                )
+            if inserts:
+                cur.copy_expert(
+                    """COPY document_sections (file_hash, content, content_hash, embedding, page_start, page_end)
+                       FROM STDIN WITH (FORMAT binary)""",
+                    _build_sections_copy(file_hash, inserts)
+                )
+            if inserts or stale:
+                cur.execute(
+                    "UPDATE master_files SET sections_version = sections_version + 1 WHERE file_hash = %s",
+                    (file_hash,)
+                )
+            conn.commit()
+    return {"kept": len(kept), "inserted": len(inserts), "deleted": len(stale), "skipped": skipped}
+
+def get_library_version(file_hashes=None, uploaded_by=None):
+    """
+    A stamp that changes whenever the sections of these papers (or of all of
+    a student's papers) change, or a paper joins that set. None without a DB.
+    """
+    with db_connection() as conn:
+        if not conn: return None
+
+        with conn.cursor() as cur:
+            if file_hashes:
+                cur.execute(
+                    "SELECT count(*), coalesce(sum(sections_version), 0) FROM master_files WHERE file_hash = ANY(%s)",
+                    (list(file_hashes),)
+                )
+            else:
+                cur.execute(
+                    """SELECT count(*), coalesce(sum(m.sections_version), 0)
+                       FROM file_owners o JOIN master_files m ON m.file_hash = o.file_hash
+                       WHERE o.user_email = %s""",
+                    (uploaded_by,)
+                )
+            count, version = cur.fetchone()
+    return f"{count}:{version}"
+
+@timed("match_document_sections")
+def match_document_sections(file_hash, query_embedding, match_threshold=0.3, match_count=5,
+                            ef_search=None, probes=None, rerank_candidates=RERANK_CANDIDATES):
+    """
+    Performs vector search using the match_document_sections RPC function.
+    ef_search (HNSW) / probes (IVFFlat) raise recall at the cost of latency; None = server default.
+    rerank_candidates > 0 makes it two-stage: that many coarse candidates, re-ranked exactly.
+    """
+    with db_connection() as conn:
+        if not conn: return []
+
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            # Calling the RPC function with explicit type casts to avoid AmbiguousFunction error
+            cur.execute(
+                f"""SELECT content, similarity FROM match_document_sections(
+                        %s::vector({EMBEDDING_DIMS}), %s::float, %s::int, %s::text, %s::int, %s::int, %s::int)""",
+                (query_embedding, match_threshold, match_count, file_hash, ef_search, probes,
+                 rerank_candidates or None)
+            )
+            results = cur.fetchall()
     return [r['content'] for r in results]
 
-    
\ No newline at end of file
+RETRIEVAL_MODES = ("hybrid", "vector", "lexical")
+
+@timed("search_document_sections")
+def search_document_sections(file_hash, query_text, query_embedding=None, mode="hybrid", match_count=5,
+                             match_threshold=0.3, ef_search=None):
+    """
+    Retrieval with a choice of mode:
+      vector  - embedding similarity only (match_document_sections)
+      lexical - Postgres full-text search only; needs no embedding
+      hybrid  - both, fused with reciprocal-rank fusion in a single query
+    """
+    if mode not in RETRIEVAL_MODES:
+        raise ValueError(f"Unknown retrieval mode {mode!r}, expected one of {RETRIEVAL_MODES}")
+    if mode == "vector":
+        return match_document_sections(file_hash, query_embedding, match_threshold, match_count, ef_search=ef_search)
+    if mode == "hybrid" and query_embedding is None:
+        mode = "lexical"
+
+    with db_connection() as conn:
+        if not conn: return []
+
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            if mode == "lexical":
+                cur.execute(
+                    "SELECT content FROM lexical_match_document_sections(%s::text, %s::int, %s::text)",
+                    (query_text, match_count, file_hash)
+                )
+            else:
+                cur.execute(
+                    f"""SELECT content FROM hybrid_match_document_sections(
+                            %s::text, %s::vector({EMBEDDING_DIMS}), %s::int, %s::text, ef_search => %s::int,
+                            rerank_count => %s::int)""",
+                    (query_text, query_embedding, match_count, file_hash, ef_search, RERANK_CANDIDATES or None)
+                )
+            results = cur.fetchall()
+    return [r['content'] for r in results]
+
+@timed("search_library")
+def search_library(query_text, query_embedding, file_hashes=None, uploaded_by=None, mode="hybrid", match_count=8,
+                   ef_search=None):
+    """
+    Searches across papers: the whole library (file_hashes=None) or a chosen
+    subset, optionally only one student's uploads. Returns the top chunks with their source:
+    [{file_hash, file_name, content, page_start, page_end, similarity}, ...]
+    mode is "hybrid" or "vector" (a query embedding is always needed here).
+    """
+    if mode not in ("hybrid", "vector"):
+        raise ValueError(f"Library search supports 'hybrid' or 'vector', not {mode!r}")
+
+    with db_connection() as conn:
+        if not conn: return []
+
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(
+                f"""SELECT file_hash, file_name, content, page_start, page_end, similarity
+                    FROM match_library_sections(%s::text, %s::vector({EMBEDDING_DIMS}), %s::int, %s::text[],
+                                                ef_search => %s::int, filter_uploaded_by => %s::text,
+                                                rerank_count => %s::int)""",
+                (query_text if mode == "hybrid" else None, query_embedding, match_count,
+                 list(file_hashes) if file_hashes else None, ef_search, uploaded_by, RERANK_CANDIDATES or None)
+            )
+            results = cur.fetchall()
+    return results
+
+def wipe_all_files():
+    """Dev tool: deletes every uploaded file, its indexed sections and the chats about it"""
+    with db_connection() as conn:
+        if not conn: return False
+
+        with conn.cursor() as cur:
+            cur.execute("TRUNCATE TABLE master_files CASCADE;")
+            cur.execute("TRUNCATE TABLE file_owners;")
+            # Also truncate document_sections and the raw text
+            cur.execute("TRUNCATE TABLE document_sections CASCADE;")
+            cur.execute("TRUNCATE TABLE file_pages;")
+            # Conversations about those files
+            cur.execute("TRUNCATE TABLE chat_messages, chat_sessions;")
+            conn.commit()
+    return True
+
+def set_ai_status(file_hash, status):
+    """Per-stage progress for a file (analyzing / indexing / ready / failed)"""
+    with db_connection() as conn:
+        if not conn: return False
+
+        with conn.cursor() as cur:
+            cur.execute("UPDATE master_files SET ai_status = %s WHERE file_hash = %s", (status, file_hash))
+            conn.commit()
+    return True
+
+# --- INGEST JOB QUEUE (processed by worker.py) ---
+
+# A running job whose worker hasn't reported progress for this long is assumed dead
+JOB_STALE_AFTER = os.getenv("JOB_STALE_AFTER", "15 minutes")
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+
+def enqueue_ingest_job(file_name, pdf_bytes, created_by):
+    """Queues an uploaded PDF for the workers. Returns the job id."""
+    with db_connection() as conn:
+        if not conn: return None
+
+        with conn.cursor() as cur:
+            cur.execute(
+                """INSERT INTO ingest_jobs (file_name, pdf_data, created_by)
+                   VALUES (%s, %s, %s) RETURNING id""",
+                (file_name, psycopg2.Binary(pdf_bytes), created_by)
+            )
+            job_id = cur.fetchone()[0]
+            conn.commit()
+    return job_id
+
+def claim_ingest_job(worker_id):
+    """
+    Atomically takes the oldest queued job (or one whose worker died).
+    SKIP LOCKED lets many workers poll the same table without blocking each other.
+    """
+    with db_connection() as conn:
+        if not conn: return None
+
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            # Jobs that keep killing their worker are given up on
+            cur.execute(
+                """UPDATE ingest_jobs
+                   SET status = 'failed', stage = 'failed', error = 'worker stopped responding',
+                       finished_at = now(), pdf_data = NULL
+                   WHERE status = 'running' AND heartbeat_at < now() - %s::interval AND attempts >= %s""",
+                (JOB_STALE_AFTER, JOB_MAX_ATTEMPTS)
+            )
+            cur.execute(
+                """UPDATE ingest_jobs
+                   SET status = 'running', stage = 'claimed', attempts = attempts + 1,
+                       locked_by = %s, heartbeat_at = now()
+                   WHERE id = (
+                       SELECT id FROM ingest_jobs
+                       WHERE status = 'queued'
+                          OR (status = 'running' AND heartbeat_at < now() - %s::interval)
+                       ORDER BY id
+                       FOR UPDATE SKIP LOCKED
+                       LIMIT 1
+                   )
+                   RETURNING id, file_name, pdf_data, created_by""",
+                (worker_id, JOB_STALE_AFTER)
+            )
+            job = cur.fetchone()
+            conn.commit()
+    return job
+
+def update_ingest_job_stage(job_id, stage, file_hash=None):
+    """Records the stage a job is in; doubles as the worker's heartbeat"""
+    with db_connection() as conn:
+        if not conn: return False
+
+        with conn.cursor() as cur:
+            cur.execute(
+                """UPDATE ingest_jobs SET stage = %s, file_hash = coalesce(%s, file_hash), heartbeat_at = now()
+                   WHERE id = %s""",
+                (stage, file_hash, job_id)
+            )
+            conn.commit()
+    return True
+
+def finish_ingest_job(job_id, file_hash=None, error=None):
+    """Marks a job done (or failed) and drops the PDF bytes, which are no longer needed"""
+    status = 'failed' if error else 'done'
+    with db_connection() as conn:
+        if not conn: return False
+
+        with conn.cursor() as cur:
+            cur.execute(
+                """UPDATE ingest_jobs
+                   SET status = %s, stage = %s, file_hash = coalesce(%s, file_hash), error = %s,
+                       finished_at = now(), pdf_data = NULL
+                   WHERE id = %s""",
+                (status, status, file_hash, error, job_id)
+            )
+            if error and file_hash:
+                cur.execute("UPDATE master_files SET ai_status = 'failed' WHERE file_hash = %s", (file_hash,))
+            conn.commit()
+    return True
+
+def get_ingest_jobs(created_by, limit=20):
+    """Latest jobs for a user, for the status panel"""
+    with db_connection() as conn:
+        if not conn: return []
+
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(
+                """SELECT j.id, j.file_name, j.status, j.stage, j.file_hash, j.error, j.created_at, j.finished_at,
+                          -- the analysis streamed so far, while the job is still analysing
+                          CASE WHEN j.stage = 'analyzing' THEN m.ai_analysis END AS partial_analysis
+                   FROM ingest_jobs j
+                   LEFT JOIN master_files m ON m.file_hash = j.file_hash
+                   WHERE j.created_by = %s ORDER BY j.id DESC LIMIT %s""",
+                (created_by, limit)
+            )
+            jobs = cur.fetchall()
+    return jobs
+
+# --- CHAT HISTORY (see chat_history.py) ---
+
+CHAT_PAGE_SIZE = int(os.getenv("CHAT_PAGE_SIZE", "20"))
+
+def add_chat_messages(user_email, scope_key, messages):
+    """Appends [(role, content), ...] to a conversation. Returns the stored rows (with ids), or [] without a DB."""
+    with db_connection() as conn:
+        if not conn: return []
+
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            rows = execute_values(
+                cur,
+                """INSERT INTO chat_messages (user_email, scope_key, role, content) VALUES %s
+                   RETURNING id, role, content, created_at""",
+                [(user_email, scope_key, role, content) for role, content in messages],
+                fetch=True
+            )
+            conn.commit()
+    return sorted(rows, key=lambda row: row['id'])
+
+@timed("get_chat_messages")
+def get_chat_messages(user_email, scope_key, before_id=None, after_id=None, limit=CHAT_PAGE_SIZE):
+    """
+    The newest `limit` messages older than `before_id` (and newer than
+    `after_id`), oldest first. Pass the first id of a page as before_id to
+    get the page before it.
+    """
+    with db_connection() as conn:
+        if not conn: return []
+
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(
+                """SELECT id, role, content, created_at FROM chat_messages
+                   WHERE user_email = %s AND scope_key = %s
+                     AND (%s::bigint IS NULL OR id < %s) AND (%s::bigint IS NULL OR id > %s)
+                   ORDER BY id DESC LIMIT %s""",
+                (user_email, scope_key, before_id, before_id, after_id, after_id, limit)
+            )
+            rows = cur.fetchall()
+    return rows[::-1]
+
+def get_chat_session(user_email, scope_key):
+    """{summary, summarized_through} for a conversation (empty for a new one)"""
+    with db_connection() as conn:
+        if conn:
+            with conn.cursor(cursor_factory=RealDictCursor) as cur:
+                cur.execute(
+                    "SELECT summary, summarized_through FROM chat_sessions WHERE user_email = %s AND scope_key = %s",
+                    (user_email, scope_key)
+                )
+                session = cur.fetchone()
+                if session:
+                    return session
+    return {"summary": "", "summarized_through": 0}
+
+def save_chat_summary(user_email, scope_key, summary, summarized_through):
+    """Stores a newer rolling summary; one covering fewer messages (a slower concurrent rerun) is ignored"""
+    with db_connection() as conn:
+        if not conn: return False
+
+        with conn.cursor() as cur:
+            cur.execute(
+                """INSERT INTO chat_sessions (user_email, scope_key, summary, summarized_through)
+                   VALUES (%s, %s, %s, %s)
+                   ON CONFLICT (user_email, scope_key) DO UPDATE
+                   SET summary = excluded.summary, summarized_through = excluded.summarized_through,
+                       updated_at = now()
+                   WHERE chat_sessions.summarized_through < excluded.summarized_through""",
+                (user_email, scope_key, summary, summarized_through)
+            )
+            conn.commit()
+    return True
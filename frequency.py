@@ -0,0 +1,241 @@
+"""
+Local question-frequency index: which questions keep coming back across papers.
+
+Question chunks in document_sections are clustered by their stored embeddings
+(no API calls), and each chunk's cluster is recorded in question_occurrences.
+Frequencies are then plain SQL counts, and the LLM prompts only get the short
+summary from format_repeat_summary().
+
+    python frequency.py          # rebuild the whole index
+"""
+import os
+import time
+from psycopg2.extras import RealDictCursor, execute_values
+from db import db_connection, decode_vector_binary, EMBEDDING_TYPE, ANN_TYPE
+from chunker import QUESTION_PATTERN
+
+# Two question chunks at least this similar (cosine) are "the same question"
+QUESTION_SIMILARITY = float(os.getenv("QUESTION_SIMILARITY", "0.88"))
+# The rebuild compares Matryoshka-truncated prefixes first (gemini-embedding-001
+# is trained so leading dims work on their own), then confirms on the full vector
+PREFILTER_DIMS = 768
+PREFILTER_MARGIN = 0.03
+BLOCK_ROWS = 1024
+# Nearest sections of other papers fetched per question in index_file,
+# before keeping the ones that are indexed questions
+NEIGHBOR_CANDIDATES = 20
+
+def question_text(content):
+    """First question line of a chunk, or None if the chunk holds no question"""
+    for line in content.splitlines():
+        line = line.strip()
+        if QUESTION_PATTERN.match(line):
+            return line[:300]
+    return None
+
+def _fetch_question_sections(cur, file_hash=None):
+    cur.execute(
+        f"""SELECT id, file_hash, content, vector_send(embedding::vector) AS vector FROM document_sections
+            {'WHERE file_hash = %s' if file_hash else ''}""",
+        (file_hash,) if file_hash else None
+    )
+    rows = []
+    for row in cur:
+        text = question_text(row['content'])
+        if text:
+            rows.append((row['id'], row['file_hash'], text, decode_vector_binary(row['vector'])))
+    return rows
+
+def _normalize(matrix):
+    import numpy as np
+
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+def cluster_vectors(vectors, threshold=QUESTION_SIMILARITY):
+    """
+    Connected components of the "cosine >= threshold" graph, computed
+    blockwise so memory stays at BLOCK_ROWS x n. Returns a cluster label per row.
+    """
+    n = len(vectors)
+    parent = list(range(n))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    if n == 0:
+        return []
+    # numpy loads with the first indexing run, not with the app
+    import numpy as np
+
+    full = _normalize(np.asarray(vectors, dtype=np.float32))
+    prefix = _normalize(full[:, :PREFILTER_DIMS])
+
+    for start in range(0, n, BLOCK_ROWS):
+        block = prefix[start:start + BLOCK_ROWS] @ prefix.T
+        rows, cols = np.nonzero(block >= threshold - PREFILTER_MARGIN)
+        rows += start
+        keep = cols > rows
+        rows, cols = rows[keep], cols[keep]
+        if not len(rows):
+            continue
+        # Confirm candidates on the full-precision vectors (row-wise dot products)
+        exact = np.einsum("ij,ij->i", full[rows], full[cols])
+        for i, j in zip(rows[exact >= threshold], cols[exact >= threshold]):
+            root_i, root_j = find(int(i)), find(int(j))
+            if root_i != root_j:
+                parent[root_j] = root_i
+
+    return [find(i) for i in range(n)]
+
+def build_question_index(threshold=QUESTION_SIMILARITY):
+    """Re-clusters every question chunk in the library (one transaction). Returns stats."""
+    start = time.perf_counter()
+    with db_connection() as conn:
+        if not conn: return None
+
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            rows = _fetch_question_sections(cur)
+            labels = cluster_vectors([r[3] for r in rows], threshold)
+
+            cur.execute("TRUNCATE question_occurrences, question_clusters RESTART IDENTITY")
+            members = {}
+            for row, label in zip(rows, labels):
+                members.setdefault(label, []).append(row)
+
+            # Representative = the question text of the cluster's first member
+            labels_in_order = list(members)
+            cluster_ids = execute_values(
+                cur, "INSERT INTO question_clusters (representative) VALUES %s RETURNING id",
+                [(members[label][0][2],) for label in labels_in_order], fetch=True
+            )
+            execute_values(
+                cur, "INSERT INTO question_occurrences (cluster_id, file_hash, section_id) VALUES %s",
+                [
+                    (cluster['id'], file_hash, section_id)
+                    for label, cluster in zip(labels_in_order, cluster_ids)
+                    for section_id, file_hash, _, _ in members[label]
+                ]
+            )
+            conn.commit()
+
+    return {
+        "questions": len(rows),
+        "clusters": len(members),
+        "repeated_clusters": sum(1 for m in members.values() if len({r[1] for r in m}) > 1),
+        "seconds": round(time.perf_counter() - start, 2),
+    }
+
+def index_file(file_hash, threshold=QUESTION_SIMILARITY):
+    """
+    Incremental update after one paper is (re-)indexed: each of its question
+    chunks joins the cluster of its nearest neighbour in other papers (via the
+    ANN index) if that is close enough, otherwise starts a new cluster.
+    Clusters left without any occurrence are deleted.
+    """
+    with db_connection() as conn:
+        if not conn: return False
+
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute("DELETE FROM question_occurrences WHERE file_hash = %s", (file_hash,))
+            # ef_search >= NEIGHBOR_CANDIDATES, and an iterative scan where pgvector has it
+            cur.execute("SELECT set_ann_search(NULL, %s)", (NEIGHBOR_CANDIDATES,))
+            for section_id, _, text, vector in _fetch_question_sections(cur, file_hash):
+                vector_list = vector.tolist()
+                # Nearest sections of other papers off the ANN index, then the ones that
+                # are indexed questions. Joining inside that scan would drop matches past ef_search.
+                cur.execute(
+                    f"""SELECT o.cluster_id, n.similarity
+                        FROM (
+                          SELECT s.id, 1 - (s.embedding <=> %s::{EMBEDDING_TYPE}) AS similarity
+                          FROM document_sections s
+                          WHERE s.file_hash <> %s
+                          ORDER BY s.embedding::{ANN_TYPE} <=> %s::{ANN_TYPE}
+                          LIMIT %s
+                        ) n
+                        JOIN question_occurrences o ON o.section_id = n.id""",
+                    (vector_list, file_hash, vector_list, NEIGHBOR_CANDIDATES)
+                )
+                nearest = max(cur.fetchall(), key=lambda row: row['similarity'], default=None)
+                if nearest and nearest['similarity'] >= threshold:
+                    cluster_id = nearest['cluster_id']
+                else:
+                    cur.execute(
+                        "INSERT INTO question_clusters (representative) VALUES (%s) RETURNING id", (text,)
+                    )
+                    cluster_id = cur.fetchone()['id']
+                cur.execute(
+                    "INSERT INTO question_occurrences (cluster_id, file_hash, section_id) VALUES (%s, %s, %s)",
+                    (cluster_id, file_hash, section_id)
+                )
+            # Clusters this paper alone held (its old occurrences were deleted above,
+            # or went with its deleted sections)
+            cur.execute(
+                """DELETE FROM question_clusters c
+                   WHERE NOT EXISTS (SELECT 1 FROM question_occurrences o WHERE o.cluster_id = c.id)"""
+            )
+            conn.commit()
+    return True
+
+def get_repeated_questions(file_hashes=None, min_papers=2, limit=30):
+    """Question clusters seen in at least `min_papers` papers (optionally within a selection)"""
+    with db_connection() as conn:
+        if not conn: return []
+
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(
+                """SELECT c.representative, count(DISTINCT o.file_hash) AS papers,
+                          array_agg(DISTINCT m.file_name) AS file_names
+                   FROM question_occurrences o
+                   JOIN question_clusters c ON c.id = o.cluster_id
+                   LEFT JOIN master_files m ON m.file_hash = o.file_hash
+                   WHERE %(hashes)s::text[] IS NULL OR o.file_hash = ANY(%(hashes)s::text[])
+                   GROUP BY c.id
+                   HAVING count(DISTINCT o.file_hash) >= %(min_papers)s
+                   ORDER BY papers DESC, c.id
+                   LIMIT %(limit)s""",
+                {"hashes": list(file_hashes) if file_hashes else None, "min_papers": min_papers, "limit": limit}
+            )
+            return cur.fetchall()
+
+def get_file_repeats(file_hash, limit=20):
+    """This paper's questions that also appear in other papers of the library"""
+    with db_connection() as conn:
+        if not conn: return []
+
+        with conn.cursor(cursor_factory=RealDictCursor) as cur:
+            cur.execute(
+                """SELECT c.representative, count(DISTINCT other.file_hash) AS papers,
+                          array_agg(DISTINCT m.file_name) AS file_names
+                   FROM question_occurrences mine
+                   JOIN question_occurrences other ON other.cluster_id = mine.cluster_id
+                   JOIN question_clusters c ON c.id = mine.cluster_id
+                   LEFT JOIN master_files m ON m.file_hash = other.file_hash
+                   WHERE mine.file_hash = %s
+                   GROUP BY c.id
+                   HAVING count(DISTINCT other.file_hash) > 1
+                   ORDER BY papers DESC, c.id
+                   LIMIT %s""",
+                (file_hash, limit)
+            )
+            return cur.fetchall()
+
+def format_repeat_summary(rows):
+    """Compact text for the LLM prompt"""
+    if not rows:
+        return "No question in this selection appears in more than one paper."
+    return "\n".join(
+        f"- Asked in {row['papers']} papers ({', '.join(n for n in row['file_names'] if n)}): {row['representative']}"
+        for row in rows
+    )
+
+if __name__ == "__main__":
+    stats = build_question_index()
+    if stats is None:
+        print("❌ Failed to connect to database.")
+    else:
+        print(f"✅ Indexed {stats['questions']} question chunks into {stats['clusters']} clusters "
+              f"({stats['repeated_clusters']} repeated across papers) in {stats['seconds']}s")
@@ -0,0 +1,193 @@
+import hashlib
+import time
+from db import (
+    save_file_record, update_ai_analysis, save_document_sections, set_ai_status, save_partial_analysis,
+    fail_analysis, iter_file_pages, get_section_hashes, text_hash
+)
+from utils import iter_pdf_pages
+import metrics
+from metrics import timed
+from chunker import iter_structured_chunks
+from cache import cached_analysis, cached_embeddings_async, get_chat_cache
+from frequency import index_file, get_file_repeats, format_repeat_summary
+
+# The PRO Prompt. Bump cache.ANALYSIS_PROMPT_VERSION whenever this changes.
+ANALYSIS_PROMPT = """
+Here is the text content from the uploaded exam paper ({file_name}):
+{raw_text}
+
+---------------------------------------------
+QUESTIONS FROM THIS PAPER ALSO FOUND IN OTHER PAPERS OF THE LIBRARY (precomputed):
+{repeat_summary}
+
+---------------------------------------------
+INSTRUCTIONS:
+Analyze this exam paper in detail. Your goal is to extract crystal-clear insights.
+
+Deliver the analysis in this structure:
+1️⃣ Repeated Questions Analysis (Frequency & Topics) - base this on the precomputed list above
+2️⃣ Important Topics Priority List (High Weightage)
+3️⃣ Chapter-wise Weightage (%)
+4️⃣ Difficulty Assessment (Easy/Moderate/Hard)
+5️⃣ Final Summary: Top 5 Expected Questions
+
+Be highly accurate and structured.
+"""
+
+# Chunks are sent for embedding in groups this big while later pages are still being read
+EMBED_GROUP_SIZE = 50
+# How often (seconds) the streamed analysis is written to the DB for the UI to show
+PARTIAL_ANALYSIS_EVERY = 2.0
+
+def embed_group(texts):
+    """
+    Starts embedding a group of chunks on async_io's loop (cache lookups over
+    asyncpg, misses over the async Gemini client) and returns a Future.
+    Every group is in flight at once; the client's limiter and the asyncpg
+    pool cap the requests actually running.
+    """
+    # httpx/asyncpg load with the first upload, not with the app
+    from async_io import submit
+
+    return submit(cached_embeddings_async(texts))
+
+@timed("ingest_pdf")
+def ingest_pdf(pdf_file, file_name, on_stage=None, uploaded_by=None):
+    """
+    The whole upload pipeline for one PDF: extract -> save -> chunk & embed -> analyse.
+    Pages are streamed, so embedding starts on the first pages while the rest are parsed.
+    `on_stage(stage, file_hash)` is called as each stage starts. Returns the file_hash.
+    """
+    notify = on_stage or (lambda stage, file_hash=None: None)
+    current_stage = [None, time.perf_counter()]
+
+    def end_stage():
+        if current_stage[0]:
+            metrics.observe("ingest_stage_seconds", time.perf_counter() - current_stage[1], stage=current_stage[0])
+
+    def report(stage, file_hash=None):
+        end_stage()
+        current_stage[:] = [stage, time.perf_counter()]
+        notify(stage, file_hash)
+
+    # A. Read PDF page by page (pypdf takes the stream directly; only big PDFs go through a temp file).
+    # The hash is built incrementally; md5 over the pages == md5 over the joined text.
+    report("extracting", None)
+    hasher = hashlib.md5()
+    page_texts = []
+
+    def tracked_pages():
+        for page_number, text in iter_pdf_pages(pdf_file):
+            hasher.update(text.encode())
+            page_texts.append((page_number, text))
+            yield page_number, text
+
+    # F (early). CHUNKING & EMBEDDINGS for RAG, overlapping with extraction and saving.
+    # Cached chunks are reused; the rest go out in batched, concurrent calls on the async client.
+    embed_jobs, group = [], []
+    for chunk in iter_structured_chunks(tracked_pages()):
+        group.append(chunk)
+        if len(group) >= EMBED_GROUP_SIZE:
+            embed_jobs.append((group, embed_group([c[0] for c in group])))
+            group = []
+    if group:
+        embed_jobs.append((group, embed_group([c[0] for c in group])))
+
+    raw_text = "".join(text for _, text in page_texts)
+    if not raw_text:
+        raise ValueError(f"No text could be extracted from {file_name}")
+
+    # B. Generate Hash (Unique ID)
+    file_hash = hasher.hexdigest()
+
+    # C. Save Raw Input to DB
+    report("saving", file_hash)
+    save_file_record(file_hash, file_name, page_texts, uploaded_by=uploaded_by)
+
+    # D. Collect the embeddings (most are done by now) and store them with their pages
+    report("indexing", file_hash)
+    set_ai_status(file_hash, "indexing")
+    # A chunk whose embedding failed still goes in (as None): if the paper was stored
+    # before, its existing row is kept instead of being diffed away as gone
+    sections_to_save = [
+        (chunk, vector or None, page_start, page_end)
+        for group, future in embed_jobs
+        for (chunk, page_start, page_end), vector in zip(group, future.result())
+    ]
+
+    if sections_to_save:
+        result = save_document_sections(file_hash, sections_to_save)
+        if result and result["skipped"]:
+            print(f"⚠️ {result['skipped']} chunks of {file_name} have no embedding yet; run reindex.py to retry")
+        # Which of this paper's questions were asked before (local, no LLM)
+        index_file(file_hash)
+
+    # E. Ask Gemini (same paper uploaded before? the cached analysis comes back without an LLM call).
+    # Repeats come precomputed from the frequency index instead of being guessed by the LLM.
+    report("analyzing", file_hash)
+    set_ai_status(file_hash, "analyzing")
+    prompt = ANALYSIS_PROMPT.format(
+        file_name=file_name, raw_text=raw_text,
+        repeat_summary=format_repeat_summary(get_file_repeats(file_hash))
+    )
+    last_flush = [0.0]
+
+    def on_partial(text_so_far):
+        # Throttled, so a fast stream doesn't turn into a write per token
+        if time.monotonic() - last_flush[0] >= PARTIAL_ANALYSIS_EVERY:
+            last_flush[0] = time.monotonic()
+            save_partial_analysis(file_hash, text_so_far)
+
+    try:
+        ai_response = cached_analysis(file_hash, prompt, on_partial=on_partial)
+    except Exception:
+        # What streamed in so far must not be mistaken for the analysis
+        fail_analysis(file_hash)
+        raise
+
+    # F. Save AI Output to DB (this also marks the paper completed)
+    update_ai_analysis(file_hash, ai_response)
+    end_stage()
+    return file_hash
+
+def reindex_file(file_hash):
+    """
+    Re-chunks a stored paper and re-embeds only what changed: chunks whose
+    content hash is already in document_sections keep their embedding, the
+    rest are embedded (cache first), and the difference is applied in one
+    transaction. Returns save_document_sections' counts (plus "embedded").
+    """
+    stored = get_section_hashes(file_hash)
+    if stored is None:
+        raise ConnectionError("Connection to database failed")
+    chunks = list(iter_structured_chunks(iter_file_pages(file_hash)))
+    if not chunks:
+        raise ValueError(f"No stored text for {file_hash}")
+
+    # A chunk can occur twice in a paper, so match stored rows by count, not just by hash
+    to_embed = []
+    for index, (chunk, _, _) in enumerate(chunks):
+        content_hash = text_hash(chunk)
+        if stored.get(content_hash):
+            stored[content_hash] -= 1
+        else:
+            to_embed.append(index)
+
+    vectors = dict(zip(to_embed, embed_group([chunks[i][0] for i in to_embed]).result()))
+    result = save_document_sections(file_hash, [
+        (chunk, vectors.get(index), page_start, page_end)
+        for index, (chunk, page_start, page_end) in enumerate(chunks)
+    ])
+    if result is None:
+        raise ConnectionError("Connection to database failed")
+
+    # Deleted sections took their question occurrences with them, and cached
+    # chat answers may quote them. invalidate() only reaches this process's
+    # cache: run from reindex.py or worker.py, the app's cache never sees it,
+    # and it is the sections_version bump in save_document_sections that
+    # retires the app's answers (see SemanticChatCache)
+    if result["inserted"] or result["deleted"]:
+        index_file(file_hash)
+        get_chat_cache().invalidate(file_hash)
+    result["embedded"] = len(to_embed)
+    return result
@@ -0,0 +1,224 @@
+"""
+In-process metrics for the hot paths: latency histograms, payload sizes and
+counters (DB round trips, Gemini tokens, errors), exported in the Prometheus
+text format.
+
+    @timed("gemini_generate")            # decorator (generators are timed to exhaustion)
+    with timed("db_connect"): ...        # or context manager
+    observe("gemini_request_bytes", len(body), buckets=SIZE_BUCKETS, endpoint="embedContent")
+    inc("gemini_tokens_total", 120, kind="output")
+
+Each process (the app server, every worker) keeps its own registry. Set
+METRICS_PORT to serve it at http://host:METRICS_PORT/metrics for Prometheus.
+"""
+import os
+import time
+import inspect
+import threading
+import functools
+import contextvars
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PREFIX = "portal_"
+# Seconds: 1 ms .. 2 min
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# Bytes: 1 KB .. 64 MB
+SIZE_BUCKETS = tuple(1024 * 4 ** i for i in range(9))
+METRICS_PORT = int(os.getenv("METRICS_PORT", "0"))
+
+_lock = threading.Lock()
+_histograms = {}
+_counters = {}
+# The timed() operation currently running in this thread/task, so DB round
+# trips can be attributed to it
+_current_op = contextvars.ContextVar("metrics_op", default="other")
+
+def _key(name, labels):
+    return PREFIX + name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+def observe(name, value, buckets=LATENCY_BUCKETS, **labels):
+    """Adds one observation to a histogram"""
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = {"bounds": buckets, "counts": [0] * len(buckets), "sum": 0.0, "count": 0}
+        for i, bound in enumerate(histogram["bounds"]):
+            if value <= bound:
+                histogram["counts"][i] += 1
+                break
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+def inc(name, amount=1, **labels):
+    """Adds to a counter"""
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + amount
+
+def record_error(op, error):
+    inc("errors_total", op=op, error=type(error).__name__)
+
+def current_op():
+    return _current_op.get()
+
+class timed:
+    """
+    Records `<name>_seconds{labels}` and counts exceptions in errors_total.
+    Works as a context manager or a decorator.
+    """
+
+    def __init__(self, name, **labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self._token = _current_op.set(self.name)
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        observe(f"{self.name}_seconds", time.perf_counter() - self._start, **self.labels)
+        _current_op.reset(self._token)
+        # GeneratorExit: a generator closed early by its consumer, not a failure
+        if exc is not None and not isinstance(exc, GeneratorExit):
+            record_error(self.name, exc)
+        return False
+
+    def __call__(self, fn):
+        name, labels = self.name, self.labels
+        if inspect.isgeneratorfunction(fn):
+            @functools.wraps(fn)
+            def generator_wrapper(*args, **kwargs):
+                # The work happens while the caller iterates, so time that. The op is
+                # only current while the generator runs: between yields the caller's
+                # own round trips are theirs.
+                def step(action, *arg):
+                    token = _current_op.set(name)
+                    try:
+                        return action(*arg)
+                    finally:
+                        _current_op.reset(token)
+
+                generator = fn(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    while True:
+                        try:
+                            value = step(next, generator)
+                        except StopIteration as stop:
+                            return stop.value
+                        yield value
+                except GeneratorExit:
+                    raise
+                except Exception as e:
+                    record_error(name, e)
+                    raise
+                finally:
+                    # Runs the generator's own cleanup when the caller stops early
+                    step(generator.close)
+                    observe(f"{name}_seconds", time.perf_counter() - start, **labels)
+            return generator_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timed(name, **labels):
+                return fn(*args, **kwargs)
+        return wrapper
+
+# --- READING ---
+
+def _quantile(histogram, q):
+    """Linear interpolation inside the bucket, like PromQL's histogram_quantile"""
+    if not histogram["count"]:
+        return 0.0
+    target, seen, lower = q * histogram["count"], 0, 0.0
+    for bound, count in zip(histogram["bounds"], histogram["counts"]):
+        if count and seen + count >= target:
+            return lower + (bound - lower) * (target - seen) / count
+        seen += count
+        lower = bound
+    # Beyond the last bucket: the best we can say is "more than the top bound"
+    return histogram["bounds"][-1]
+
+def snapshot():
+    """Plain dicts for the admin page: one per histogram series and one per counter series"""
+    with _lock:
+        histograms = [
+            {
+                "metric": name[len(PREFIX):], **dict(labels), "count": h["count"], "sum": round(h["sum"], 4),
+                "avg": round(h["sum"] / h["count"], 4) if h["count"] else 0.0,
+                "p50": round(_quantile(h, 0.5), 4), "p95": round(_quantile(h, 0.95), 4),
+            }
+            for (name, labels), h in sorted(_histograms.items())
+        ]
+        counters = [
+            {"metric": name[len(PREFIX):], **dict(labels), "value": value}
+            for (name, labels), value in sorted(_counters.items())
+        ]
+    return histograms, counters
+
+def _format_labels(labels, extra=()):
+    pairs = list(labels) + list(extra)
+    if not pairs:
+        return ""
+    escaped = (k + '="' + str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") + '"'
+               for k, v in pairs)
+    return "{" + ",".join(escaped) + "}"
+
+def render_prometheus():
+    """The registry in the Prometheus text exposition format (version 0.0.4)"""
+    lines = []
+    with _lock:
+        typed = set()
+        for (name, labels), h in sorted(_histograms.items()):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} histogram")
+            cumulative = 0
+            for bound, count in zip(h["bounds"], h["counts"]):
+                cumulative += count
+                lines.append(f"{name}_bucket{_format_labels(labels, [('le', f'{bound:g}')])} {cumulative}")
+            lines.append(f"{name}_bucket{_format_labels(labels, [('le', '+Inf')])} {h['count']}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {h['sum']:.6f}")
+            lines.append(f"{name}_count{_format_labels(labels)} {h['count']}")
+        for (name, labels), value in sorted(_counters.items()):
+            if name not in typed:
+                typed.add(name)
+                lines.append(f"# TYPE {name} counter")
+            lines.append(f"{name}{_format_labels(labels)} {value}")
+    return "\n".join(lines) + "\n"
+
+# --- EXPORT ---
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+_server = None
+
+def start_metrics_server(port=METRICS_PORT):
+    """Serves /metrics on a daemon thread (once per process). port=0 disables it."""
+    global _server
+    if not port or _server is not None:
+        return _server
+    try:
+        _server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+    except OSError as e:
+        print(f"❌ Metrics server could not listen on port {port}: {e}")
+        return None
+    _server.daemon_threads = True
+    threading.Thread(target=_server.serve_forever, daemon=True).start()
+    print(f"📈 Metrics at http://0.0.0.0:{port}/metrics")
+    return _server
@@ -0,0 +1,68 @@
+"""
+Re-indexes the whole library (or the given files) after a chunker change:
+
+    python reindex.py --workers 4
+    python reindex.py <file_hash> [<file_hash> ...]
+
+Only chunks whose text changed are embedded and written (see
+ingest.reindex_file); the rest keep their rows and embeddings.
+The chat cache is per process: running app servers keep answering from
+theirs for up to CHAT_CACHE_TTL, so restart them after a big re-index.
+"""
+import os
+import time
+import argparse
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+REINDEX_WORKERS = int(os.getenv("REINDEX_WORKERS", "4"))
+LIST_PAGE_SIZE = 500
+
+def all_file_hashes():
+    from db import list_files
+
+    after = None
+    while True:
+        files = list_files(after=after, limit=LIST_PAGE_SIZE)
+        for f in files:
+            yield f['file_hash']
+        if len(files) < LIST_PAGE_SIZE:
+            return
+        after = (files[-1]['created_at'], files[-1]['file_hash'])
+
+def main():
+    parser = argparse.ArgumentParser(description="Re-chunk stored papers and re-embed only what changed")
+    parser.add_argument("file_hashes", nargs="*", help="files to re-index (default: the whole library)")
+    parser.add_argument("--workers", type=int, default=REINDEX_WORKERS,
+                        help="files processed at once (each also batches its own embedding calls)")
+    args = parser.parse_args()
+
+    from ingest import reindex_file
+
+    file_hashes = args.file_hashes or list(all_file_hashes())
+    totals = {"kept": 0, "inserted": 0, "deleted": 0, "skipped": 0, "embedded": 0}
+    failed = 0
+    start = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=max(1, args.workers)) as executor:
+        futures = {executor.submit(reindex_file, h): h for h in file_hashes}
+        for done, future in enumerate(as_completed(futures), start=1):
+            file_hash = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                failed += 1
+                traceback.print_exc()
+                print(f"❌ [{done}/{len(futures)}] {file_hash}: {e}")
+                continue
+            for key in totals:
+                totals[key] += result[key]
+            print(f"✅ [{done}/{len(futures)}] {file_hash}: {result['kept']} kept, "
+                  f"+{result['inserted']} / -{result['deleted']} sections")
+
+    print(f"\n{len(file_hashes) - failed} file(s) re-indexed in {time.perf_counter() - start:.1f}s, {failed} failed. "
+          f"{totals['embedded']} chunks embedded, {totals['kept']} kept, {totals['inserted']} inserted, "
+          f"{totals['deleted']} deleted, {totals['skipped']} skipped (no embedding)")
+
+if __name__ == "__main__":
+    main()
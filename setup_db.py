@@ -1,11 +1,59 @@
 import os
 import psycopg2
 from dotenv import load_dotenv
+from db import EMBEDDING_DIMS, EMBEDDING_TYPE, ANN_TYPE, RERANK_CANDIDATES
 
 load_dotenv()
 database_url = os.getenv("DATABASE_URL")
 
-sql = """
+# Column type and size come from db.py (EMBEDDING_DIMS / EMBEDDING_STORAGE env vars).
+# Changing them drops the stored sections below: run reindex.py afterwards.
+ANN_OPS = ANN_TYPE.split("(")[0] + "_cosine_ops"
+
+# Approximate (ANN) index for the embeddings: "hnsw" (default) or "ivfflat".
+# pgvector can't index plain vector columns over 2000 dims, so full-size float4
+# vectors are indexed through a halfvec cast (halfvec indexes go up to 4000 dims).
+VECTOR_INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "hnsw").lower()
+HNSW_M = int(os.getenv("HNSW_M", "16"))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", "64"))
+# Rule of thumb from the pgvector docs: rows / 1000 lists (build it after loading data)
+IVFFLAT_LISTS = int(os.getenv("IVFFLAT_LISTS", "100"))
+# Coarse stage of the two-stage search (db.RERANK_CANDIDATES): "ann" reuses the
+# index above, "binary" adds an HNSW index over 1 bit/dim sign vectors (hamming
+# distance), 32x smaller than float4, for the candidates that are then re-ranked.
+COARSE_INDEX = os.getenv("COARSE_INDEX", "ann").lower()
+# pgvector's upper bound for hnsw.ef_search, which the searches raise to their candidate count
+MAX_EF_SEARCH = 1000
+
+if COARSE_INDEX not in ("ann", "binary"):
+    raise SystemExit(f"❌ COARSE_INDEX must be 'ann' or 'binary', not {COARSE_INDEX!r}")
+if COARSE_INDEX == "binary" and RERANK_CANDIDATES <= 0:
+    raise SystemExit("❌ COARSE_INDEX=binary needs RERANK_CANDIDATES > 0: hamming order alone is too coarse to rank by")
+if VECTOR_INDEX_TYPE == "hnsw" and RERANK_CANDIDATES > MAX_EF_SEARCH:
+    raise SystemExit(f"❌ RERANK_CANDIDATES can be at most {MAX_EF_SEARCH} with an HNSW index (hnsw.ef_search limit)")
+
+if VECTOR_INDEX_TYPE == "ivfflat":
+    vector_index_sql = f"""
+create index if not exists idx_doc_sections_embedding on document_sections
+  using ivfflat ((embedding::{ANN_TYPE}) {ANN_OPS}) with (lists = {IVFFLAT_LISTS});
+"""
+else:
+    vector_index_sql = f"""
+create index if not exists idx_doc_sections_embedding on document_sections
+  using hnsw ((embedding::{ANN_TYPE}) {ANN_OPS})
+  with (m = {HNSW_M}, ef_construction = {HNSW_EF_CONSTRUCTION});
+"""
+
+if COARSE_INDEX == "binary":
+    vector_index_sql += f"""
+create index if not exists idx_doc_sections_embedding_bits on document_sections
+  using hnsw ((binary_quantize(embedding)::bit({EMBEDDING_DIMS})) bit_hamming_ops);
+"""
+    coarse_order = f"binary_quantize(d.embedding)::bit({EMBEDDING_DIMS}) <~> binary_quantize(query_embedding)"
+else:
+    coarse_order = f"d.embedding::{ANN_TYPE} <=> query_embedding::{ANN_TYPE}"
+
+sql = f"""
 create extension if not exists vector;
 
 drop table if exists document_sections cascade;
@@ -14,18 +62,301 @@ create table document_sections (
   id uuid primary key default gen_random_uuid(),
   file_hash text not null,
   content text not null,
-  embedding vector(3072) not null
+  -- sha256 of content (db.text_hash): re-indexing keeps rows whose chunk didn't change
+  content_hash text not null,
+  embedding {EMBEDDING_TYPE} not null,
+  -- PDF pages the chunk was cut from (1-based)
+  page_start int,
+  page_end int,
+  -- Lexical side of hybrid search (exact terms like "Dijkstra" or "Q.7(b)")
+  content_tsv tsvector generated always as (to_tsvector('english', content)) stored
 );
 
-create index if not exists idx_doc_sections_file_hash on document_sections (file_hash);
+create index if not exists idx_doc_sections_content_tsv on document_sections using gin (content_tsv);
+
+create index if not exists idx_doc_sections_file_hash on document_sections (file_hash, content_hash);
+
+-- Question-frequency index (see frequency.py). Derived from document_sections,
+-- so it is rebuilt with it: run `python frequency.py` after re-indexing.
+drop table if exists question_occurrences;
+drop table if exists question_clusters;
+
+create table question_clusters (
+  id bigserial primary key,
+  representative text not null
+);
+
+create table question_occurrences (
+  cluster_id bigint not null references question_clusters (id) on delete cascade,
+  file_hash text not null,
+  section_id uuid not null references document_sections (id) on delete cascade,
+  primary key (cluster_id, section_id)
+);
+
+create index if not exists idx_question_occurrences_file_hash on question_occurrences (file_hash);
+""" + vector_index_sql + f"""
+-- master_files (created in Supabase) gains its first uploader, plus an index for
+-- the keyset-paginated library listing in db.list_files
+alter table master_files add column if not exists uploaded_by text;
+-- Bumped whenever a paper's sections change; the app's chat cache stamps its
+-- entries with these (db.get_library_version), so changes made by the worker
+-- or reindex.py processes retire stale cached answers too
+alter table master_files add column if not exists sections_version int not null default 0;
+-- ai_status: uploaded -> indexing -> analyzing -> completed | failed. Only a
+-- completed paper's ai_analysis is final (earlier it may hold streamed partial text);
+-- papers analysed before this flow ended at 'analyzed' or 'ready'
+update master_files set ai_status = 'completed'
+  where ai_status in ('analyzed', 'ready') and ai_analysis is not null;
+create index if not exists idx_master_files_created on master_files (created_at desc, file_hash desc);
+drop index if exists idx_master_files_uploaded_by;
+
+-- Who uploaded what: the same paper (same hash) can be uploaded by several
+-- students, and it is in each one's library from their own upload on
+create table if not exists file_owners (
+  file_hash text not null,
+  user_email text not null,
+  created_at timestamptz not null default now(),
+  primary key (user_email, file_hash)
+);
+create index if not exists idx_file_owners_listing on file_owners (user_email, created_at desc, file_hash desc);
+create index if not exists idx_file_owners_file_hash on file_owners (file_hash);
+insert into file_owners (file_hash, user_email, created_at)
+select file_hash, uploaded_by, created_at from master_files where uploaded_by is not null
+on conflict do nothing;
+
+-- Leaderboard: the top-N is an index scan instead of a sort of the whole users table
+create index if not exists idx_users_xp on users (xp desc nulls last, email);
+
+-- Rank service (db.get_xp_rank): how many users sit at each XP value, kept up to
+-- date by a trigger, so a rank is a sum over distinct XP values (a few hundred
+-- to thousands) no matter how many users there are. Ties share a rank, like RANK().
+create table if not exists xp_buckets (
+  xp int primary key,
+  user_count int not null
+);
+
+create or replace function users_xp_buckets() returns trigger
+language plpgsql
+as $$
+begin
+  if tg_op in ('UPDATE', 'DELETE') then
+    update xp_buckets set user_count = user_count - 1 where xp = coalesce(old.xp, 0);
+    delete from xp_buckets where xp = coalesce(old.xp, 0) and user_count <= 0;
+  end if;
+  if tg_op in ('INSERT', 'UPDATE') then
+    insert into xp_buckets (xp, user_count) values (coalesce(new.xp, 0), 1)
+    on conflict (xp) do update set user_count = xp_buckets.user_count + 1;
+  end if;
+  return null;
+end;
+$$;
+
+drop trigger if exists users_xp_buckets on users;
+create trigger users_xp_buckets
+  after insert or delete or update of xp on users
+  for each row execute function users_xp_buckets();
+
+-- Rebuilt from scratch on every setup run, so it can never drift for long
+truncate xp_buckets;
+insert into xp_buckets (xp, user_count)
+select coalesce(xp, 0), count(*) from users group by coalesce(xp, 0);
+
+-- Raw extracted text, one row per PDF page, out of the hot master_files table.
+-- Compressed by TOAST: lz4 where the server has it (PG 14+), pglz otherwise, and
+-- storage "main" + a low toast_tuple_target so even a single page is compressed
+-- inline rather than left as plain text. Page 0 holds text migrated from the old
+-- syllabus_data JSON, whose page boundaries were never stored.
+create table if not exists file_pages (
+  file_hash text not null,
+  page_number int not null,
+  content text not null,
+  primary key (file_hash, page_number)
+) with (toast_tuple_target = 256);
+
+alter table file_pages alter column content set storage main;
+
+do $$
+begin
+  alter table file_pages alter column content set compression lz4;
+exception when others then
+  raise notice 'lz4 not available, file_pages keeps the default TOAST compression';
+end;
+$$;
+
+-- Migration: move syllabus_data into file_pages, then drop it from the hot rows.
+-- (Run VACUUM FULL master_files afterwards to hand the space back to the OS.)
+alter table master_files alter column syllabus_data drop not null;
+
+insert into file_pages (file_hash, page_number, content)
+select file_hash, 0, syllabus_data->>'content'
+from master_files
+where syllabus_data->>'content' is not null
+on conflict do nothing;
+
+update master_files set syllabus_data = null where syllabus_data is not null;
+
+-- Content-addressed cache for Gemini analyses and chunk embeddings (see cache.py).
+-- Kept across setup runs: it is what saves us the API calls.
+create table if not exists ai_cache (
+  cache_key text primary key,
+  kind text not null,
+  value_text text,
+  value_vector bytea,
+  hit_count bigint not null default 0,
+  created_at timestamptz not null default now(),
+  last_used_at timestamptz not null default now()
+);
+
+create index if not exists idx_ai_cache_last_used on ai_cache (last_used_at desc);
+
+-- Background ingest jobs: app.py enqueues uploads, worker.py processes them.
+-- status: queued -> running -> done | failed. stage is the step currently running.
+create table if not exists ingest_jobs (
+  id bigserial primary key,
+  file_name text not null,
+  pdf_data bytea,
+  created_by text,
+  status text not null default 'queued',
+  stage text not null default 'queued',
+  file_hash text,
+  error text,
+  attempts int not null default 0,
+  locked_by text,
+  created_at timestamptz not null default now(),
+  heartbeat_at timestamptz,
+  finished_at timestamptz
+);
+
+create index if not exists idx_ingest_jobs_pending on ingest_jobs (id) where status in ('queued', 'running');
+create index if not exists idx_ingest_jobs_created_by on ingest_jobs (created_by, id desc);
+
+-- Chat history per student and search scope (a paper's file_hash, or a
+-- "library:..." key for several papers). See chat_history.py.
+create table if not exists chat_messages (
+  id bigserial primary key,
+  user_email text not null,
+  scope_key text not null,
+  role text not null check (role in ('user', 'assistant')),
+  content text not null,
+  created_at timestamptz not null default now()
+);
+
+-- Newest-first pages of one conversation (keyset pagination on id)
+create index if not exists idx_chat_messages_scope on chat_messages (user_email, scope_key, id desc);
+
+-- Rolling summary of everything up to summarized_through (a chat_messages id);
+-- only the turns after it are sent to the model word for word.
+create table if not exists chat_sessions (
+  user_email text not null,
+  scope_key text not null,
+  summary text not null default '',
+  summarized_through bigint not null default 0,
+  updated_at timestamptz not null default now(),
+  primary key (user_email, scope_key)
+);
 
--- Drop existing function to avoid ambiguity if parameters changed
+-- Drop existing functions to avoid ambiguity if parameters changed
+drop function if exists lexical_match_document_sections(text, int, text);
+drop function if exists hybrid_match_document_sections(text, vector, int, text, int, int, int);
+drop function if exists hybrid_match_document_sections(text, vector, int, text, int, int, int, int);
+drop function if exists match_library_sections(text, vector, int, text[], int, int, int);
+drop function if exists match_library_sections(text, vector, int, text[], int, int, int, text);
+drop function if exists match_library_sections(text, vector, int, text[], int, int, int, text, int);
 drop function if exists match_document_sections(vector, float, int, text);
+drop function if exists match_document_sections(vector, float, int, text, int, int);
+drop function if exists match_document_sections(vector, float, int, text, int, int, int);
 
+-- ANN settings for the searches below, set with is_local = true so they only
+-- last for the calling transaction. HNSW returns at most hnsw.ef_search rows,
+-- and the file filters only apply to those, so ef_search (NULL = server
+-- default) is raised to the candidates the caller wants; with pgvector >= 0.8
+-- the scan also keeps going until enough rows pass the filters.
+create or replace function set_ann_search (ef_search int, candidate_count int)
+returns void
+language plpgsql
+as $$
+begin
+  perform set_config('hnsw.ef_search', least({MAX_EF_SEARCH}, greatest(
+    coalesce(ef_search, nullif(current_setting('hnsw.ef_search', true), '')::int, 40), candidate_count
+  ))::text, true);
+  begin
+    -- Relaxed: every caller re-orders its candidates by exact distance
+    perform set_config('hnsw.iterative_scan', 'relaxed_order', true);
+  exception when others then
+    null;
+  end;
+end;
+$$;
+
+-- ef_search (HNSW) / probes (IVFFlat) trade recall for speed; NULL keeps the server default.
 create or replace function match_document_sections (
-  query_embedding vector(3072),
+  query_embedding vector({EMBEDDING_DIMS}),
   match_threshold float,
   match_count int,
+  filter_file_hash text,
+  ef_search int default null,
+  probes int default null,
+  candidate_count int default null
+)
+returns table (
+  id uuid,
+  content text,
+  similarity float
+)
+language plpgsql
+as $$
+begin
+  perform set_ann_search(ef_search, coalesce(candidate_count, match_count));
+  if probes is not null then
+    perform set_config('ivfflat.probes', probes::text, true);
+  end if;
+
+  if candidate_count is null then
+    return query
+    select m.id, m.content, m.similarity
+    from (
+      select d.id, d.content, 1 - (d.embedding <=> query_embedding::{EMBEDDING_TYPE}) as similarity
+      from document_sections d
+      where
+        d.file_hash = filter_file_hash
+        and (1 - (d.embedding <=> query_embedding::{EMBEDDING_TYPE})) > match_threshold
+      -- Order by the indexed expression so the ANN index can serve the query
+      order by d.embedding::{ANN_TYPE} <=> query_embedding::{ANN_TYPE}
+      limit match_count
+    ) m
+    order by m.similarity desc;
+    return;
+  end if;
+
+  -- Two-stage: candidate_count rows off the coarse index, re-ranked on the stored vectors
+  return query
+  with candidates as (
+    select d.id, d.content, d.embedding
+    from document_sections d
+    where d.file_hash = filter_file_hash
+    order by {coarse_order}
+    limit candidate_count
+  )
+  select c.id, c.content, 1 - (c.embedding <=> query_embedding::{EMBEDDING_TYPE}) as similarity
+  from candidates c
+  where (1 - (c.embedding <=> query_embedding::{EMBEDDING_TYPE})) > match_threshold
+  order by c.embedding <=> query_embedding::{EMBEDDING_TYPE}
+  limit match_count;
+end;
+$$;
+
+-- OR-ed keywords (plainto_tsquery would AND them), so a chunk matching some
+-- of the terms still ranks; ts_rank_cd then rewards density like BM25 does.
+create or replace function keyword_tsquery (query_text text)
+returns tsquery
+language sql stable
+as $$
+  select nullif(replace(plainto_tsquery('english', query_text)::text, ' & ', ' | '), '')::tsquery;
+$$;
+
+create or replace function lexical_match_document_sections (
+  query_text text,
+  match_count int,
   filter_file_hash text
 )
 returns table (
@@ -33,22 +364,148 @@ returns table (
   content text,
   similarity float
 )
+language sql stable
+as $$
+  select d.id, d.content, ts_rank_cd(d.content_tsv, q)::float as similarity
+  from document_sections d, keyword_tsquery(query_text) q
+  where d.file_hash = filter_file_hash and d.content_tsv @@ q
+  order by similarity desc
+  limit match_count;
+$$;
+
+-- Hybrid search: the top candidate_count of each ranking, fused with
+-- reciprocal-rank fusion (score = sum of 1 / (rrf_k + rank)), in one round trip.
+create or replace function hybrid_match_document_sections (
+  query_text text,
+  query_embedding vector({EMBEDDING_DIMS}),
+  match_count int,
+  filter_file_hash text,
+  candidate_count int default 30,
+  rrf_k int default 60,
+  ef_search int default null,
+  rerank_count int default null
+)
+returns table (
+  id uuid,
+  content text,
+  similarity float
+)
 language plpgsql
 as $$
 begin
+  perform set_ann_search(ef_search, greatest(candidate_count, rerank_count));
+
   return query
-  select
-    document_sections.id,
-    document_sections.content,
-    1 - (document_sections.embedding <=> query_embedding) as similarity
-  from document_sections
-  where
-    document_sections.file_hash = filter_file_hash
-    and (1 - (document_sections.embedding <=> query_embedding)) > match_threshold
-  order by document_sections.embedding <=> query_embedding
+  -- Semantic side is two-stage like match_document_sections: rerank_count coarse
+  -- candidates, ranked on the stored vectors
+  with coarse as (
+    select d.id, d.embedding
+    from document_sections d
+    where d.file_hash = filter_file_hash
+    order by {coarse_order}
+    limit greatest(candidate_count, rerank_count)
+  ),
+  semantic as (
+    select c.id, row_number() over (order by c.embedding <=> query_embedding::{EMBEDDING_TYPE}) as rank
+    from coarse c
+    order by c.embedding <=> query_embedding::{EMBEDDING_TYPE}
+    limit candidate_count
+  ),
+  lexical as (
+    select d.id, row_number() over (order by ts_rank_cd(d.content_tsv, q) desc) as rank
+    from document_sections d, keyword_tsquery(query_text) q
+    where d.file_hash = filter_file_hash and d.content_tsv @@ q
+    order by ts_rank_cd(d.content_tsv, q) desc
+    limit candidate_count
+  ),
+  fused as (
+    select coalesce(s.id, l.id) as id,
+           coalesce(1.0 / (rrf_k + s.rank), 0) + coalesce(1.0 / (rrf_k + l.rank), 0) as score
+    from semantic s
+    full outer join lexical l on l.id = s.id
+  )
+  select d.id, d.content, f.score::float as similarity
+  from fused f
+  join document_sections d on d.id = f.id
+  order by f.score desc
   limit match_count;
 end;
 $$;
+
+-- Library-wide search (all papers, a subset via filter_file_hashes, and/or
+-- one student's uploads via filter_uploaded_by, see file_owners).
+-- The nearest neighbours come straight off the ANN index and master_files
+-- is only joined to the final top-k, so this stays index-driven as the
+-- library grows. With query_text the lexical ranking is fused in (RRF) too.
+create or replace function match_library_sections (
+  query_text text,
+  query_embedding vector({EMBEDDING_DIMS}),
+  match_count int,
+  filter_file_hashes text[] default null,
+  candidate_count int default 40,
+  rrf_k int default 60,
+  ef_search int default null,
+  filter_uploaded_by text default null,
+  rerank_count int default null
+)
+returns table (
+  id uuid,
+  file_hash text,
+  file_name text,
+  content text,
+  page_start int,
+  page_end int,
+  similarity float
+)
+language plpgsql
+as $$
+begin
+  perform set_ann_search(ef_search, greatest(candidate_count, rerank_count));
+
+  return query
+  with coarse as (
+    select d.id, d.embedding
+    from document_sections d
+    where (filter_file_hashes is null or d.file_hash = any(filter_file_hashes))
+      and (filter_uploaded_by is null or d.file_hash in (
+        select fo.file_hash from file_owners fo where fo.user_email = filter_uploaded_by
+      ))
+    order by {coarse_order}
+    limit greatest(candidate_count, rerank_count)
+  ),
+  semantic as (
+    select c.id, row_number() over (order by c.embedding <=> query_embedding::{EMBEDDING_TYPE}) as rank
+    from coarse c
+    order by c.embedding <=> query_embedding::{EMBEDDING_TYPE}
+    limit candidate_count
+  ),
+  lexical as (
+    select d.id, row_number() over (order by ts_rank_cd(d.content_tsv, q) desc) as rank
+    from document_sections d, keyword_tsquery(query_text) q
+    where query_text is not null
+      and d.content_tsv @@ q
+      and (filter_file_hashes is null or d.file_hash = any(filter_file_hashes))
+      and (filter_uploaded_by is null or d.file_hash in (
+        select fo.file_hash from file_owners fo where fo.user_email = filter_uploaded_by
+      ))
+    order by ts_rank_cd(d.content_tsv, q) desc
+    limit candidate_count
+  ),
+  fused as (
+    select coalesce(s.id, l.id) as id,
+           coalesce(1.0 / (rrf_k + s.rank), 0) + coalesce(1.0 / (rrf_k + l.rank), 0) as score
+    from semantic s
+    full outer join lexical l on l.id = s.id
+    order by score desc
+    limit match_count
+  )
+  select d.id, d.file_hash, m.file_name, d.content, d.page_start, d.page_end, f.score::float as similarity
+  from fused f
+  join document_sections d on d.id = f.id
+  left join master_files m on m.file_hash = d.file_hash
+  order by f.score desc;
+end;
+$$;
 """
 
 try:
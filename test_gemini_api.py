@@ -1,5 +1,4 @@
 import os
-import google.generativeai as genai
 from dotenv import load_dotenv
 
 def test_gemini_api():
@@ -12,28 +11,24 @@ def test_gemini_api():
         print("Please add GEMINI_API_KEY=your_actual_key to your .env file.")
         return
 
-    # Configure the SDK
-    genai.configure(api_key=api_key)
+    # Same REST client (and model) the app uses, so a pass here means the app can reach Gemini
+    from utils import ask_gemini, CHAT_MODEL, GeminiError
 
-    # Initialize the model
-    # Using gemini-1.5-flash as it's fast and usually available
-    model = genai.GenerativeModel('gemini-flash-latest')
+    print(f"🚀 Testing Gemini API Key ({CHAT_MODEL})...")
 
-    print("🚀 Testing Gemini API Key...")
-    
     try:
         # Simple prompt to test connectivity and key validity
-        response = model.generate_content("Say 'Gemini API is working correctly!'")
-        
-        if response and response.text:
-            print(f"✅ Success! Response: {response.text}")
+        response = ask_gemini("Say 'Gemini API is working correctly!'")
+
+        if response:
+            print(f"✅ Success! Response: {response}")
         else:
             print("⚠️ API call succeeded but returned an empty response.")
-            
-    except Exception as e:
+
+    except GeminiError as e:
         print(f"❌ API Test Failed!")
         print(f"Error details: {str(e)}")
-    
+
     print("🏁 Test script finished execution.")
 
 if __name__ == "__main__":
@@ -1,67 +1,470 @@
+import io
 import os
-import requests
+import time
+import random
+import threading
 import json
 import streamlit as st
-from pypdf import PdfReader
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
 from dotenv import load_dotenv
+import metrics
+from metrics import timed
+
+# pypdf, requests and the PDF process pool are imported where they are first
+# used: together they are ~150 ms of cold start that a page render which never
+# parses a PDF or calls Gemini shouldn't pay.
 
 # 1. Load keys (Try local .env first)
 load_dotenv()
 
-# 2. Smart Key Retrieval
-# Try to get it from the OS (Local .env)
-api_key = os.getenv("GEMINI_API_KEY")
+# 2. Smart Key Retrieval (once per process, on the first Gemini call)
+@st.cache_resource(show_spinner=False)
+def get_api_key():
+    # Try to get it from the OS (Local .env)
+    api_key = os.getenv("GEMINI_API_KEY")
 
-# If that failed, try to get it from Streamlit Cloud Secrets
-if not api_key:
-    try:
-        api_key = st.secrets["GEMINI_API_KEY"]
-    except:
-        pass
+    # If that failed, try to get it from Streamlit Cloud Secrets
+    if not api_key:
+        try:
+            api_key = st.secrets["GEMINI_API_KEY"]
+        except:
+            pass
+
+    # If BOTH fail, the call fails (raising isn't cached, so fixing the secret is picked up)
+    if not api_key:
+        raise GeminiError("❌ Missing GEMINI_API_KEY! Check your .env (Local) or Streamlit Secrets (Cloud).")
+    return api_key
+
+# 3. Where to send requests (override to point at a local mock server for benchmarks)
+GEMINI_API_BASE = os.getenv("GEMINI_API_BASE", "https://generativelanguage.googleapis.com/v1beta").rstrip("/")
+
+EMBEDDING_MODEL = "models/gemini-embedding-001"
+# Matryoshka truncation requested from the API. The same env var sizes db.py's
+# vector columns; read here too so utils doesn't pull in db (and psycopg2).
+EMBEDDING_DIMS = int(os.getenv("EMBEDDING_DIMS", "3072"))
+CHAT_MODEL = "models/gemini-flash-latest"
+# batchEmbedContents accepts at most 100 texts per call
+EMBED_BATCH_SIZE = 100
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+# Endpoints whose responses carry no usageMetadata: their input tokens are counted from our estimate
+UNMETERED_METHODS = {"embedContent", "batchEmbedContents"}
+
+# Client-side quota: keep these a little under the project's Gemini limits
+GEMINI_RPM = int(os.getenv("GEMINI_RPM", "1000"))
+GEMINI_TPM = int(os.getenv("GEMINI_TPM", "1000000"))
+# Send a duplicate request when the first is slower than this many seconds.
+# 0 = adaptive (the endpoint's recent p95), negative = never hedge.
+GEMINI_HEDGE_AFTER = float(os.getenv("GEMINI_HEDGE_AFTER", "0"))
+HEDGE_MIN_SAMPLES = 20
+THROTTLE_STATUS = {429, 503}
+
+class GeminiError(Exception):
+    """A Gemini call that failed for good (after retries)"""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+@st.cache_resource(show_spinner=False)
+def get_http_session():
+    """One keep-alive session for the whole process, so TLS is negotiated once"""
+    import requests
+    from requests.adapters import HTTPAdapter
+
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.headers.update({'Content-Type': 'application/json'})
+    return session
+
+class TokenBucket:
+    """
+    Refills `per_minute` units a minute, up to one minute's worth. reserve()
+    never blocks: it takes the units (going into debt if needed) and returns
+    how long the caller has to wait, so sync and async callers can share it.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def reserve(self, amount=1):
+        with self.lock:
+            self._refill()
+            self.tokens -= amount
+            return max(0.0, -self.tokens / self.rate)
+
+    def try_reserve(self, amount=1):
+        """Takes the units only if they are available right now"""
+        with self.lock:
+            self._refill()
+            if self.tokens < amount:
+                return False
+            self.tokens -= amount
+            return True
+
+    def drain(self):
+        # After a 429 nobody in this process should fire until the bucket refills a bit
+        with self.lock:
+            self._refill()
+            self.tokens = min(self.tokens, 0.0)
+
+def estimate_request_tokens(payload):
+    """Rough input-token count (~4 characters per token) of a generate/embed payload"""
+    if "requests" in payload:
+        contents = [r["content"] for r in payload["requests"]]
+    elif "content" in payload:
+        contents = [payload["content"]]
+    else:
+        contents = payload.get("contents", [])
+    chars = sum(len(part.get("text", "")) for content in contents for part in content.get("parts", []))
+    return max(1, chars // 4)
+
+class GeminiClient:
+    """
+    Shared Gemini REST client: requests/minute and tokens/minute buckets,
+    retries on 429/5xx with jittered exponential backoff, optional hedging,
+    and per-endpoint counters (see stats()).
+    """
+
+    def __init__(self, rpm=GEMINI_RPM, tpm=GEMINI_TPM, max_retries=4, base_delay=1.0,
+                 max_delay=32.0, hedge_after=GEMINI_HEDGE_AFTER):
+        self.requests_bucket = TokenBucket(rpm)
+        self.tokens_bucket = TokenBucket(tpm)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge_after = hedge_after
+        self.hedge_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="gemini-hedge")
+        self.lock = threading.Lock()
+        self.endpoints = {}
+
+    # --- quota ---
+
+    def reserve(self, tokens):
+        """Seconds to wait before sending a request of `tokens` input tokens"""
+        return max(self.requests_bucket.reserve(1), self.tokens_bucket.reserve(tokens))
+
+    def charge_output(self, usage):
+        # Output tokens count against TPM too, but are only known afterwards
+        if usage and usage.get("candidatesTokenCount"):
+            self.tokens_bucket.reserve(usage["candidatesTokenCount"])
+            metrics.inc("gemini_tokens_total", usage["candidatesTokenCount"], kind="output")
+        if usage and usage.get("promptTokenCount"):
+            metrics.inc("gemini_tokens_total", usage["promptTokenCount"], kind="input")
+
+    def backoff(self, attempt, response=None):
+        """Full-jitter exponential backoff, but never sooner than Retry-After"""
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+        if response is not None:
+            try:
+                delay = max(delay, float(response.headers.get("Retry-After")))
+            except (TypeError, ValueError):
+                pass
+        return delay
+
+    # --- counters ---
+
+    def _endpoint(self, name):
+        stats = self.endpoints.get(name)
+        if stats is None:
+            stats = self.endpoints.setdefault(name, {
+                "requests": 0, "errors": 0, "retries": 0, "throttles": 0, "hedges": 0, "hedge_wins": 0,
+                "latency_total": 0.0, "latency_max": 0.0, "recent": deque(maxlen=200),
+            })
+        return stats
+
+    def record(self, name, latency=None, status=None, retry=False, hedge=False, hedge_win=False):
+        with self.lock:
+            stats = self._endpoint(name)
+            if latency is not None:
+                stats["requests"] += 1
+                stats["latency_total"] += latency
+                stats["latency_max"] = max(stats["latency_max"], latency)
+                stats["recent"].append(latency)
+            if status is not None and status != 200:
+                stats["errors"] += 1
+            if status in THROTTLE_STATUS:
+                stats["throttles"] += 1
+            stats["retries"] += retry
+            stats["hedges"] += hedge
+            stats["hedge_wins"] += hedge_win
+        if latency is not None:
+            metrics.observe("gemini_request_seconds", latency, endpoint=name)
+            metrics.inc("gemini_requests_total", endpoint=name, status=status)
+        for event, happened in (("retry", retry), ("hedge", hedge), ("hedge_win", hedge_win)):
+            if happened:
+                metrics.inc("gemini_events_total", endpoint=name, event=event)
+
+    def _hedge_delay(self, name):
+        if self.hedge_after < 0:
+            return None
+        if self.hedge_after > 0:
+            return self.hedge_after
+        with self.lock:
+            recent = sorted(self._endpoint(name)["recent"])
+        if len(recent) < HEDGE_MIN_SAMPLES:
+            return None
+        return recent[int(len(recent) * 0.95)]
+
+    def stats(self):
+        """{endpoint: {requests, errors, retries, throttles, hedges, hedge_wins, latency_avg_ms, p50_ms, p95_ms, latency_max_ms}}"""
+        with self.lock:
+            report = {}
+            for name, stats in self.endpoints.items():
+                recent = sorted(stats["recent"])
+                report[name] = {
+                    key: stats[key] for key in ("requests", "errors", "retries", "throttles", "hedges", "hedge_wins")
+                }
+                report[name].update({
+                    "latency_avg_ms": round(1000 * stats["latency_total"] / stats["requests"], 1) if stats["requests"] else 0.0,
+                    "p50_ms": round(1000 * recent[len(recent) // 2], 1) if recent else 0.0,
+                    "p95_ms": round(1000 * recent[int(len(recent) * 0.95)], 1) if recent else 0.0,
+                    "latency_max_ms": round(1000 * stats["latency_max"], 1),
+                })
+            return report
+
+    # --- requests ---
+
+    def _send(self, name, url, body, stream):
+        import requests
+
+        metrics.observe("gemini_request_bytes", len(body), buckets=metrics.SIZE_BUCKETS, endpoint=name)
+        start = time.perf_counter()
+        try:
+            response = get_http_session().post(url, data=body, stream=stream, timeout=(10, 120))
+        except requests.RequestException:
+            self.record(name, latency=time.perf_counter() - start, status=-1)
+            raise
+        self.record(name, latency=time.perf_counter() - start, status=response.status_code)
+        if not stream:
+            metrics.observe("gemini_response_bytes", len(response.content), buckets=metrics.SIZE_BUCKETS,
+                            endpoint=name)
+        return response
+
+    def _send_hedged(self, name, url, body, tokens):
+        delay = self._hedge_delay(name)
+        primary = self.hedge_pool.submit(self._send, name, url, body, False)
+        if delay is None:
+            return primary.result()
+        done, _ = wait([primary], timeout=delay)
+        # A hedge spends quota too, so only send one when the bucket has room to spare
+        if done or not self.requests_bucket.try_reserve(1):
+            return primary.result()
+        self.tokens_bucket.reserve(tokens)
+
+        self.record(name, hedge=True)
+        backup = self.hedge_pool.submit(self._send, name, url, body, False)
+        pending = {primary, backup}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is None and future.result().status_code == 200:
+                    self.record(name, hedge_win=future is backup)
+                    _close_when_done(backup if future is primary else primary)
+                    return future.result()
+        # Neither succeeded: report the primary's outcome
+        _close_when_done(backup)
+        return primary.result()
+
+    def post(self, model, method, payload, stream=False, hedge=False):
+        """
+        POSTs to `{model}:{method}` and returns the 200 response (still open
+        when stream=True). Anything else raises GeminiError once retries run out.
+        hedge=True is meant for cheap idempotent calls (embeddings); generation
+        latency is dominated by output length, so a hedge there mostly doubles the bill.
+        """
+        import requests
+
+        query = "alt=sse&" if stream else ""
+        url = f"{GEMINI_API_BASE}/{model}:{method}?{query}key={get_api_key()}"
+        body = json.dumps(payload)
+        tokens = estimate_request_tokens(payload)
+
+        for attempt in range(self.max_retries + 1):
+            time.sleep(self.reserve(tokens))
+            try:
+                if hedge and not stream:
+                    response = self._send_hedged(method, url, body, tokens)
+                else:
+                    response = self._send(method, url, body, stream)
+            except requests.RequestException as e:
+                if attempt == self.max_retries:
+                    raise GeminiError(f"Connection Error: {e}") from e
+                self.record(method, retry=True)
+                time.sleep(self.backoff(attempt))
+                continue
+
+            if response.status_code == 200:
+                # Generation's real counts come via charge_output
+                if method in UNMETERED_METHODS:
+                    metrics.inc("gemini_tokens_total", tokens, kind="input_estimated", endpoint=method)
+                return response
+            if response.status_code in THROTTLE_STATUS:
+                self.requests_bucket.drain()
+            if response.status_code not in RETRYABLE_STATUS or attempt == self.max_retries:
+                raise GeminiError(f"Server Error {response.status_code}: {response.text}", response.status_code)
+            response.close()
+            self.record(method, retry=True)
+            time.sleep(self.backoff(attempt, response))
+
+def _close_when_done(future):
+    """Closes a losing request's response (now or once it arrives), so its pooled connection is reused"""
+    def close(f):
+        if f.exception() is None:
+            f.result().close()
+    future.add_done_callback(close)
+
+@st.cache_resource(show_spinner=False)
+def get_gemini_client():
+    return GeminiClient()
 
-# If BOTH fail, then crash
-if not api_key:
-    raise ValueError("❌ Missing GEMINI_API_KEY! Check your .env (Local) or Streamlit Secrets (Cloud).")
+# PDFs with at least this many pages are parsed across a process pool
+PARALLEL_PDF_MIN_PAGES = int(os.getenv("PARALLEL_PDF_MIN_PAGES", "40"))
+PDF_PAGES_PER_TASK = 8
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(min(os.cpu_count() or 1, 4))))
 
+_pdf_pool = None
+_pdf_pool_lock = threading.Lock()
+# Pool processes only: the PDF they last opened, so its structure is parsed once per file, not per task
+_worker_reader = (None, None)
+
+def _get_pdf_pool():
+    """
+    One process pool per process, reused by every big PDF. Spawned, not
+    forked: the app and the workers are multithreaded (pools, hedging, the
+    async loop), and a forked child could inherit a lock some thread held.
+    """
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    global _pdf_pool
+    with _pdf_pool_lock:
+        if _pdf_pool is None:
+            _pdf_pool = ProcessPoolExecutor(max_workers=PDF_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+            # A multiprocessing child (worker.py's) joins its children on exit before
+            # the executor's own atexit hook could stop them: shut the pool down first
+            multiprocessing.util.Finalize(None, _pdf_pool.shutdown, exitpriority=100)
+    return _pdf_pool
+
+def _reset_pdf_pool():
+    global _pdf_pool
+    with _pdf_pool_lock:
+        _pdf_pool = None
+
+def _extract_page_range(path, start, stop):
+    from pypdf import PdfReader
+
+    global _worker_reader
+    if _worker_reader[0] != path:
+        _worker_reader = (path, PdfReader(path))
+    reader = _worker_reader[1]
+    return [reader.pages[i].extract_text() or "" for i in range(start, stop)]
+
+def iter_pdf_pages(pdf_file, parallel=None):
+    """
+    Yields (page_number, text) one page at a time (page numbers start at 1), so
+    callers can start chunking early pages while later ones are still parsing.
+    parallel=None picks the process pool automatically for big PDFs.
+    """
+    import multiprocessing
+    from pypdf import PdfReader
+
+    reader = PdfReader(pdf_file)
+    page_count = len(reader.pages)
+    metrics.inc("pdf_pages_total", page_count)
+    if parallel is None:
+        parallel = page_count >= PARALLEL_PDF_MIN_PAGES
+    # Daemonic processes can't start a pool of their own
+    if multiprocessing.current_process().daemon:
+        parallel = False
+
+    if not parallel:
+        for index, page in enumerate(reader.pages):
+            yield index + 1, page.extract_text() or ""
+        return
+
+    # The pool outlives this file, so its processes open it by path (streams can't be pickled)
+    import tempfile
+    from concurrent.futures.process import BrokenProcessPool
+
+    if hasattr(pdf_file, "read"):
+        pdf_file.seek(0)
+        with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+            f.write(pdf_file.getvalue() if hasattr(pdf_file, "getvalue") else pdf_file.read())
+        path, temporary = f.name, True
+    else:
+        path, temporary = os.path.abspath(pdf_file), False
+
+    try:
+        executor = _get_pdf_pool()
+        futures = [
+            (start, executor.submit(_extract_page_range, path, start, min(start + PDF_PAGES_PER_TASK, page_count)))
+            for start in range(0, page_count, PDF_PAGES_PER_TASK)
+        ]
+        # Waiting on futures in submission order keeps the pages in order
+        for start, future in futures:
+            for offset, text in enumerate(future.result()):
+                yield start + offset + 1, text
+    except BrokenProcessPool:
+        # A pool process died (OOM kill...): the next PDF gets a fresh pool
+        _reset_pdf_pool()
+        raise
+    finally:
+        if temporary:
+            os.unlink(path)
+
+@timed("extract_text_from_pdf")
 def extract_text_from_pdf(pdf_path):
     try:
-        reader = PdfReader(pdf_path)
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text() or ""
-        return text
+        # join() copies once, instead of growing the string page by page
+        return "".join(text for _, text in iter_pdf_pages(pdf_path))
     except Exception as e:
         print(f"❌ Error reading PDF: {e}")
+        metrics.record_error("extract_text_from_pdf", e)
         return None
 
-def generate_embedding(text):
-    """Generates a 3072-dimension vector embedding using Gemini"""
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-embedding-001:embedContent?key={api_key}"
-    
-    headers = {'Content-Type': 'application/json'}
-    data = {
-        "model": "models/gemini-embedding-001",
-        "content": {"parts": [{"text": text}]}
-    }
+def build_embed_request(text):
+    """One embedContent request body (also an item of batchEmbedContents)"""
+    request = {"model": EMBEDDING_MODEL, "content": {"parts": [{"text": text}]}}
+    if EMBEDDING_DIMS != 3072:
+        # Truncated outputs aren't unit length; fine for cosine distance, which all our searches use
+        request["outputDimensionality"] = EMBEDDING_DIMS
+    return request
 
+@timed("generate_embedding")
+def generate_embedding(text):
+    """Generates an EMBEDDING_DIMS-dimension vector embedding using Gemini"""
     try:
-        response = requests.post(url, headers=headers, data=json.dumps(data))
-        if response.status_code == 200:
-            return response.json()['embedding']['values']
-        else:
-            print(f"❌ Embedding API Error {response.status_code}: {response.text}")
-            return None
-    except Exception as e:
-        print(f"❌ Connection Error: {e}")
+        response = get_gemini_client().post(EMBEDDING_MODEL, "embedContent", build_embed_request(text), hedge=True)
+        return response.json()['embedding']['values']
+    except GeminiError as e:
+        print(f"❌ Embedding API Error: {e}")
+        metrics.record_error("generate_embedding", e)
         return None
 
-def ask_gemini(prompt):
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/gemini-flash-latest:generateContent?key={api_key}"
-    
-    headers = {
-        'Content-Type': 'application/json'
-    }
-    
+def generate_embeddings(texts, batch_size=EMBED_BATCH_SIZE):
+    """
+    Embeds many texts at once over async_io's shared client (see
+    AsyncGemini.embed_many). The result lines up with `texts` (a failed batch
+    gives None for each of its texts).
+    """
+    # httpx loads on the first batch, not with the app
+    from async_io import gemini, run_async
+
+    return run_async(gemini().embed_many(texts, batch_size))
+
+def build_generate_payload(prompt, json_output=False):
     data = {
         "contents": [{
             "parts": [{"text": prompt}]
@@ -71,33 +474,80 @@ def ask_gemini(prompt):
             "temperature": 0.3
         }
     }
+    if json_output:
+        data["generationConfig"]["responseMimeType"] = "application/json"
+    return data
 
+@timed("ask_gemini")
+def ask_gemini(prompt, json_output=False):
+    """
+    Returns Gemini's answer. json_output=True asks for a JSON document
+    (responseMimeType application/json). Raises GeminiError on failure.
+    """
+    client = get_gemini_client()
+    response = client.post(CHAT_MODEL, "generateContent", build_generate_payload(prompt, json_output))
+    result = response.json()
+    client.charge_output(result.get('usageMetadata'))
     try:
-        # We generally don't need verify=False on the cloud, but you can add it if needed.
-        response = requests.post(url, headers=headers, data=json.dumps(data))
-        
-        if response.status_code == 200:
-            result = response.json()
-            return result['candidates'][0]['content']['parts'][0]['text']
-        else:
-            return f"❌ Server Error {response.status_code}: {response.text}"
-            
-    except Exception as e:
-        return f"❌ Connection Error: {e}"
+        return result['candidates'][0]['content']['parts'][0]['text']
+    except (KeyError, IndexError) as e:
+        # e.g. a safety block: 200, but no text
+        raise GeminiError(f"No text in response: {json.dumps(result)[:500]}") from e
 
-def ask_gemini_chat(question, context_chunks):
+@timed("ask_gemini_stream")
+def ask_gemini_stream(prompt, label="generate"):
     """
-    Sends a specific question + retrieved document segments to Gemini.
+    Streaming version of ask_gemini: yields the answer piece by piece as
+    streamGenerateContent (SSE) delivers it. Time-to-first-token is logged.
+    Raises GeminiError if the request fails or the stream breaks off.
     """
+    import requests
+
+    client = get_gemini_client()
+    start = time.perf_counter()
+    first_token = True
+    usage = None
+    try:
+        with client.post(CHAT_MODEL, "streamGenerateContent", build_generate_payload(prompt), stream=True) as response:
+            for line in response.iter_lines(decode_unicode=True):
+                # SSE frames look like "data: {...json...}"; skip keep-alives and blank lines
+                if not line or not line.startswith("data:"):
+                    continue
+                try:
+                    event = json.loads(line[len("data:"):])
+                except json.JSONDecodeError as e:
+                    raise GeminiError(f"Malformed stream event: {line[:200]}") from e
+                # Every event repeats the running usage; charge the final one
+                usage = event.get('usageMetadata') or usage
+                for candidate in event.get('candidates', []):
+                    for part in candidate.get('content', {}).get('parts', []):
+                        text = part.get('text')
+                        if not text:
+                            continue
+                        if first_token:
+                            first_token = False
+                            metrics.observe("gemini_ttft_seconds", time.perf_counter() - start, label=label)
+                            print(f"⏱️ Gemini TTFT ({label}): {(time.perf_counter() - start) * 1000:.0f} ms")
+                        yield text
+    except requests.RequestException as e:
+        raise GeminiError(f"Stream interrupted: {e}") from e
+    finally:
+        client.charge_output(usage)
+        print(f"⏱️ Gemini stream ({label}) finished in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+def build_chat_prompt(question, context_chunks, history=""):
+    """Specific question + retrieved document segments (+ the conversation so far, see chat_history.py) -> tutor prompt"""
     context_text = "\n\n".join(context_chunks)
+    # Follow-ups ("and part b?") only make sense with the earlier turns
+    history_text = f"\n    {history}\n    \n    ----------------" if history else ""
     
-    prompt = f"""
+    return f"""
     You are an expert tutor. I am a student asking questions about an exam paper.
     
     CONTEXT FROM THE DOCUMENT:
     {context_text}
     
-    ----------------
+    ----------------{history_text}
     STUDENT QUESTION: {question}
     
     INSTRUCTIONS:
@@ -105,5 +555,13 @@ def ask_gemini_chat(question, context_chunks):
     - If the answer is not in the context, use your general knowledge but clarify that it wasn't explicitly in the paper.
     - Be concise, encouraging, and helpful.
     """
-    
-    return ask_gemini(prompt)
\ No newline at end of file
+
+def ask_gemini_chat(question, context_chunks, history=""):
+    """
+    Sends a specific question + retrieved document segments to Gemini.
+    """
+    return ask_gemini(build_chat_prompt(question, context_chunks, history))
+
+def ask_gemini_chat_stream(question, context_chunks, history=""):
+    """Same as ask_gemini_chat, but yields the answer as it streams in (for st.write_stream)"""
+    return ask_gemini_stream(build_chat_prompt(question, context_chunks, history), label="chat")
@@ -0,0 +1,93 @@
+"""
+Ingest worker: processes the PDFs that app.py queues in ingest_jobs.
+
+    python worker.py --workers 4
+
+Run as many of these (on as many machines) as the upload load needs; the
+workers coordinate through Postgres (SELECT ... FOR UPDATE SKIP LOCKED), so
+their number is independent of how many people have the app open.
+"""
+import io
+import os
+import time
+import socket
+import argparse
+import traceback
+import multiprocessing
+
+import metrics
+
+POLL_INTERVAL = float(os.getenv("WORKER_POLL_INTERVAL", "2"))
+
+def run_worker(worker_id, poll_interval=POLL_INTERVAL, metrics_port=0):
+    """Claim -> process -> report, forever. Each process has its own connection pool (and metrics)."""
+    # Imported here so every spawned process builds its own pool and HTTP session
+    from db import claim_ingest_job, update_ingest_job_stage, finish_ingest_job
+    from ingest import ingest_pdf
+
+    metrics.start_metrics_server(metrics_port)
+    print(f"👷 Worker {worker_id} started")
+    while True:
+        job = claim_ingest_job(worker_id)
+        if not job:
+            time.sleep(poll_interval)
+            continue
+
+        job_id = job['id']
+        print(f"📄 Worker {worker_id} picked job {job_id}: {job['file_name']}")
+        state = {"file_hash": None}
+
+        def on_stage(stage, file_hash=None):
+            state["file_hash"] = file_hash or state["file_hash"]
+            update_ingest_job_stage(job_id, stage, file_hash)
+
+        try:
+            file_hash = ingest_pdf(
+                io.BytesIO(bytes(job['pdf_data'])), job['file_name'],
+                on_stage=on_stage, uploaded_by=job['created_by']
+            )
+            finish_ingest_job(job_id, file_hash=file_hash)
+            print(f"✅ Job {job_id} done ({file_hash})")
+        except Exception as e:
+            traceback.print_exc()
+            finish_ingest_job(job_id, file_hash=state["file_hash"], error=str(e) or type(e).__name__)
+            print(f"❌ Job {job_id} failed: {e}")
+            metrics.record_error("ingest_job", e)
+
+def main():
+    parser = argparse.ArgumentParser(description="Process queued PDF ingest jobs")
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WORKER_COUNT", "2")),
+                        help="number of worker processes")
+    parser.add_argument("--poll", type=float, default=POLL_INTERVAL,
+                        help="seconds to wait when the queue is empty")
+    args = parser.parse_args()
+
+    host = socket.gethostname()
+    # spawn (not fork) so no process inherits another's sockets
+    ctx = multiprocessing.get_context("spawn")
+    # With METRICS_PORT set, worker i serves its own /metrics on METRICS_PORT + 1 + i.
+    # Not daemonic: ingest_pdf parses big PDFs on a process pool of its own
+    processes = [
+        ctx.Process(target=run_worker, args=(
+            f"{host}:{os.getpid()}:{i}", args.poll,
+            metrics.METRICS_PORT + 1 + i if metrics.METRICS_PORT else 0,
+        ))
+        for i in range(args.workers)
+    ]
+    for p in processes:
+        p.start()
+    try:
+        for p in processes:
+            p.join()
+    except KeyboardInterrupt:
+        print("🛑 Stopping workers")
+    finally:
+        # A job cut short stays 'running' and is picked up again once its claim goes stale
+        for p in processes:
+            if p.is_alive():
+                p.terminate()
+        for p in processes:
+            p.join()
+
+if __name__ == "__main__":
+    main()